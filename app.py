@@ -1,14 +1,121 @@
-from flask import Flask, request, render_template, redirect, url_for, send_file
-from utils import get_db_connection, run_forecast, get_budget
-from datetime import datetime
+from flask import (
+    Flask,
+    Response,
+    abort,
+    before_render_template,
+    g,
+    jsonify,
+    redirect,
+    render_template,
+    request,
+    send_file,
+    stream_with_context,
+    template_rendered,
+    url_for,
+)
+from utils import (
+    get_db_connection,
+    get_budget,
+    get_budget_range,
+    invalidate_rate_cache,
+    rate_cache,
+    get_budget_grouped,
+    month_range,
+    GROUP_COLUMNS,
+)
+from database import bump_data_version, get_data_version, get_pool
+from ingest import ingest_csv
+from pagination import page_from_request
+from exports import FORMATS, MAX_FORECAST_MONTHS, export_forecast, export_people
+import batch
+import charts
+import churn
+import occupancy
+import scenarios
+from variance import variance_rows
+import forecast_cache
+import intervals
+import jobs
+import metrics
+import profiling
+from datetime import datetime, timezone
+import functools
+import os
+import re
 import io
 import csv
-import matplotlib
-matplotlib.use('Agg')  # Use a non-interactive backend.
-import matplotlib.pyplot as plt
+import sqlite3
 
 app = Flask(__name__)
 
+
+@app.before_request
+def open_db_scope():
+    # Every get_db_connection() during the request shares one pooled connection.
+    get_pool().begin_scope()
+    metrics.begin_request()
+
+
+@app.after_request
+def record_request_metrics(response):
+    # Registered first so that it runs last, after the other after_request
+    # hooks' queries.
+    route = request.url_rule.rule if request.url_rule else "unmatched"
+    metrics.end_request(route, request.method, response.status_code)
+    return response
+
+
+@before_render_template.connect_via(app)
+def start_template_timer(sender, template, context, **extra):
+    metrics.begin_template(template)
+
+
+@template_rendered.connect_via(app)
+def stop_template_timer(sender, template, context, **extra):
+    metrics.end_template(template)
+
+
+# POST routes that only queue background jobs; the jobs move the data
+# version themselves when they change plan data.
+JOB_ENDPOINTS = {"api_upload_job", "api_forecast_job", "jobs_page"}
+
+
+@app.after_request
+def bump_version_after_write(response):
+    # Every other POST route writes plan data, so a successful one moves the
+    # data version that the JSON API's ETags are derived from.
+    if (request.method == "POST" and response.status_code < 400 and request.endpoint not in JOB_ENDPOINTS
+            and not g.get("queued_job")):
+        conn = get_db_connection()
+        bump_data_version(conn)
+        conn.close()
+    return response
+
+
+@app.teardown_appcontext
+def close_db_scope(exception):
+    get_pool().end_scope()
+
+
+def _profiled(view):
+    """
+    Runs the view under a profiler when the request asks for one and is
+    allowed to (see profiling.py), naming the capture in an X-Profile-Capture
+    header.
+    """
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        value = request.args.get("profile") or request.headers.get("X-Profile")
+        mode = profiling.requested_mode(value, request.remote_addr)
+        if mode is None:
+            return view(*args, **kwargs)
+        result, summary = profiling.capture(mode, request.endpoint, view, *args, **kwargs)
+        response = app.make_response(result)
+        response.headers["X-Profile-Capture"] = url_for("profile_file", filename=summary["file"])
+        return response
+    return wrapper
+
+
 @app.route("/")
 def index():
     return render_template("index.html")
@@ -33,12 +140,13 @@ def manage_people():
             VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
         ''', (name, team, grade, work_stream, location, contract_type, status, start_date, expected_end_date))
         conn.commit()
+        forecast_cache.refresh_people(conn, [c.lastrowid])
+        conn.close()
         return redirect(url_for("manage_people"))
     else:
-        c.execute("SELECT * FROM people")
-        people = c.fetchall()
+        page = page_from_request(conn, "people", request.args)
         conn.close()
-        return render_template("manage_people.html", people=people)
+        return render_template("manage_people.html", page=page)
 
 
 @app.route("/edit_person/<int:person_id>", methods=["GET", "POST"])
@@ -77,6 +185,7 @@ def edit_person(person_id):
             ),
         )
         conn.commit()
+        forecast_cache.refresh_people(conn, [person_id])
         conn.close()
         return redirect(url_for("manage_people"))
     else:
@@ -92,6 +201,7 @@ def delete_person(person_id):
     c = conn.cursor()
     c.execute("DELETE FROM people WHERE person_id=?", (person_id,))
     conn.commit()
+    forecast_cache.refresh_people(conn, [person_id])
     conn.close()
     return redirect(url_for("manage_people"))
 
@@ -120,48 +230,31 @@ def download_people_template():
     )
 
 
+def _queue_upload(table, file, replace_months=False):
+    # Queues the upload as a background job and shows its progress page.
+    g.queued_job = True
+    try:
+        job_id = jobs.submit_upload(table, file.stream, replace_months)
+    except (jobs.QueueFull, sqlite3.OperationalError) as exc:
+        return Response(f"Could not queue the upload: {exc}. Try again shortly.", 503, {"Retry-After": "30"},
+                        mimetype="text/plain")
+    return redirect(url_for("job_page", job_id=job_id))
+
+
 @app.route("/upload_people", methods=["POST"])
+@_profiled
 def upload_people():
     file = request.files.get("csv_file")
     if not file:
         return redirect(url_for("manage_people"))
-
-    stream = io.StringIO(file.stream.read().decode("utf-8"))
-    reader = csv.DictReader(stream)
+    if request.form.get("background"):
+        return _queue_upload("people", file)
 
     conn = get_db_connection()
-    c = conn.cursor()
-    for row in reader:
-        name = row.get("name")
-        team = row.get("team")
-        grade = row.get("grade")
-        work_stream = row.get("work_stream")
-        location = row.get("location")
-        contract_type = row.get("contract_type")
-        status = row.get("status")
-        start_date = row.get("start_date")
-        expected_end_date = row.get("expected_end_date")
-        if name and grade and location:
-            c.execute(
-                """
-                INSERT INTO people (name, team, grade, work_stream, location, contract_type, status, start_date, expected_end_date)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-                """,
-                (
-                    name,
-                    team,
-                    grade,
-                    work_stream,
-                    location,
-                    contract_type,
-                    status,
-                    start_date,
-                    expected_end_date,
-                ),
-            )
-    conn.commit()
+    summary = ingest_csv(file.stream, "people", conn)
+    forecast_cache.add_missing_people(conn)
     conn.close()
-    return redirect(url_for("manage_people"))
+    return render_template("upload_summary.html", summary=summary, back=url_for("manage_people"))
 
 @app.route("/manage_posts", methods=["GET", "POST"])
 def manage_posts():
@@ -173,18 +266,21 @@ def manage_posts():
         post_start_date = request.form["post_start_date"]
         post_end_date = request.form["post_end_date"]
         person_id = request.form["person_id"] if request.form["person_id"] else None
+        grade = request.form.get("grade") or None
+        location = request.form.get("location") or None
         
         c.execute('''
-            INSERT INTO posts (workforce_plan_number, funding_source, post_start_date, post_end_date, person_id)
-            VALUES (?, ?, ?, ?, ?)
-        ''', (workforce_plan_number, funding_source, post_start_date, post_end_date, person_id))
+            INSERT INTO posts (workforce_plan_number, funding_source, post_start_date, post_end_date, person_id,
+                               grade, location)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', (workforce_plan_number, funding_source, post_start_date, post_end_date, person_id, grade, location))
         conn.commit()
+        conn.close()
         return redirect(url_for("manage_posts"))
     else:
-        c.execute("SELECT * FROM posts")
-        posts = c.fetchall()
+        page = page_from_request(conn, "posts", request.args)
         conn.close()
-        return render_template("manage_posts.html", posts=posts)
+        return render_template("manage_posts.html", page=page)
 
 
 @app.route("/download_posts_template")
@@ -197,6 +293,8 @@ def download_posts_template():
         "post_start_date",
         "post_end_date",
         "person_id",
+        "grade",
+        "location",
     ])
     output.seek(0)
     return send_file(
@@ -208,40 +306,18 @@ def download_posts_template():
 
 
 @app.route("/upload_posts", methods=["POST"])
+@_profiled
 def upload_posts():
     file = request.files.get("csv_file")
     if not file:
         return redirect(url_for("manage_posts"))
-
-    stream = io.StringIO(file.stream.read().decode("utf-8"))
-    reader = csv.DictReader(stream)
+    if request.form.get("background"):
+        return _queue_upload("posts", file)
 
     conn = get_db_connection()
-    c = conn.cursor()
-    for row in reader:
-        workforce_plan_number = row.get("workforce_plan_number")
-        funding_source = row.get("funding_source")
-        post_start_date = row.get("post_start_date")
-        post_end_date = row.get("post_end_date")
-        person_id = row.get("person_id") or None
-        if not any([workforce_plan_number, funding_source, post_start_date, post_end_date, person_id]):
-            continue
-        c.execute(
-            """
-            INSERT INTO posts (workforce_plan_number, funding_source, post_start_date, post_end_date, person_id)
-            VALUES (?, ?, ?, ?, ?)
-            """,
-            (
-                workforce_plan_number,
-                funding_source,
-                post_start_date,
-                post_end_date,
-                person_id,
-            ),
-        )
-    conn.commit()
+    summary = ingest_csv(file.stream, "posts", conn)
     conn.close()
-    return redirect(url_for("manage_posts"))
+    return render_template("upload_summary.html", summary=summary, back=url_for("manage_posts"))
 
 @app.route("/manage_budget", methods=["GET", "POST"])
 def manage_budget():
@@ -258,12 +334,12 @@ def manage_budget():
             VALUES (?, ?, ?, ?)
         ''', (team, work_stream, year_month, allocated_budget))
         conn.commit()
+        conn.close()
         return redirect(url_for("manage_budget"))
     else:
-        c.execute("SELECT * FROM budget")
-        budgets = c.fetchall()
+        page = page_from_request(conn, "budget", request.args)
         conn.close()
-        return render_template("manage_budget.html", budgets=budgets)
+        return render_template("manage_budget.html", page=page)
 
 
 @app.route("/download_budget_template")
@@ -281,36 +357,18 @@ def download_budget_template():
 
 
 @app.route("/upload_budget", methods=["POST"])
+@_profiled
 def upload_budget():
     file = request.files.get("csv_file")
     if not file:
         return redirect(url_for("manage_budget"))
-
-    stream = io.StringIO(file.stream.read().decode("utf-8"))
-    reader = csv.DictReader(stream)
+    if request.form.get("background"):
+        return _queue_upload("budget", file)
 
     conn = get_db_connection()
-    c = conn.cursor()
-    for row in reader:
-        team = row.get("team")
-        work_stream = row.get("work_stream")
-        year_month = row.get("year_month")
-        allocated_budget = row.get("allocated_budget")
-        if year_month and allocated_budget:
-            try:
-                budget_val = float(allocated_budget)
-            except ValueError:
-                continue
-            c.execute(
-                """
-                INSERT INTO budget (team, work_stream, year_month, allocated_budget)
-                VALUES (?, ?, ?, ?)
-                """,
-                (team, work_stream, year_month, budget_val),
-            )
-    conn.commit()
+    summary = ingest_csv(file.stream, "budget", conn)
     conn.close()
-    return redirect(url_for("manage_budget"))
+    return render_template("upload_summary.html", summary=summary, back=url_for("manage_budget"))
 
 
 @app.route("/manage_pay", methods=["GET", "POST"])
@@ -327,16 +385,20 @@ def manage_pay():
             """
             INSERT INTO salaries (grade, location, year_month, monthly_planning_rate)
             VALUES (?, ?, ?, ?)
+            ON CONFLICT (grade, location, year_month)
+            DO UPDATE SET monthly_planning_rate = excluded.monthly_planning_rate
             """,
             (grade, location, year_month, pay),
         )
         conn.commit()
+        invalidate_rate_cache()
+        forecast_cache.refresh_rate(conn, grade, location, year_month)
+        conn.close()
         return redirect(url_for("manage_pay"))
     else:
-        c.execute("SELECT * FROM salaries")
-        salaries = c.fetchall()
+        page = page_from_request(conn, "salaries", request.args)
         conn.close()
-        return render_template("manage_pay.html", salaries=salaries)
+        return render_template("manage_pay.html", page=page)
 
 
 @app.route("/download_pay_template")
@@ -354,36 +416,21 @@ def download_pay_template():
 
 
 @app.route("/upload_pay", methods=["POST"])
+@_profiled
 def upload_pay():
     file = request.files.get("csv_file")
     if not file:
         return redirect(url_for("manage_pay"))
 
-    stream = io.StringIO(file.stream.read().decode("utf-8"))
-    reader = csv.DictReader(stream)
-
+    replace_months = request.form.get("mode") == "replace_months"
+    if request.form.get("background"):
+        return _queue_upload("salaries", file, replace_months)
     conn = get_db_connection()
-    c = conn.cursor()
-    for row in reader:
-        location = row.get("location")
-        grade = row.get("grade")
-        year_month = row.get("date")
-        pay = row.get("pay")
-        if location and grade and year_month and pay:
-            try:
-                pay_val = float(pay)
-            except ValueError:
-                continue
-            c.execute(
-                """
-                INSERT INTO salaries (grade, location, year_month, monthly_planning_rate)
-                VALUES (?, ?, ?, ?)
-                """,
-                (grade, location, year_month, pay_val),
-            )
-    conn.commit()
+    summary = ingest_csv(file.stream, "salaries", conn, replace_months=replace_months)
+    invalidate_rate_cache()
+    forecast_cache.invalidate_months(conn, summary["months"])
     conn.close()
-    return redirect(url_for("manage_pay"))
+    return render_template("upload_summary.html", summary=summary, back=url_for("manage_pay"))
 
 
 @app.route("/edit_pay/<int:salary_id>", methods=["GET", "POST"])
@@ -395,15 +442,22 @@ def edit_pay(salary_id):
         grade = request.form["grade"]
         year_month = request.form["date"]
         pay = float(request.form["pay"])
+        c.execute("SELECT * FROM salaries WHERE salary_id=?", (salary_id,))
+        previous = c.fetchone()
         c.execute(
             """
-            UPDATE salaries
+            UPDATE OR REPLACE salaries
             SET grade=?, location=?, year_month=?, monthly_planning_rate=?
             WHERE salary_id=?
             """,
             (grade, location, year_month, pay, salary_id),
         )
         conn.commit()
+        invalidate_rate_cache()
+        # The rate may have moved to another grade, location or month.
+        if previous:
+            forecast_cache.refresh_rate(conn, previous["grade"], previous["location"], previous["year_month"])
+        forecast_cache.refresh_rate(conn, grade, location, year_month)
         conn.close()
         return redirect(url_for("manage_pay"))
     else:
@@ -417,77 +471,700 @@ def edit_pay(salary_id):
 def delete_pay(salary_id):
     conn = get_db_connection()
     c = conn.cursor()
+    c.execute("SELECT * FROM salaries WHERE salary_id=?", (salary_id,))
+    previous = c.fetchone()
     c.execute("DELETE FROM salaries WHERE salary_id=?", (salary_id,))
     conn.commit()
+    invalidate_rate_cache()
+    if previous:
+        forecast_cache.refresh_rate(conn, previous["grade"], previous["location"], previous["year_month"])
     conn.close()
     return redirect(url_for("manage_pay"))
 
+@app.route("/manage_holidays", methods=["GET", "POST"])
+def manage_holidays():
+    conn = get_db_connection()
+    c = conn.cursor()
+    if request.method == "POST":
+        location = request.form["location"] or None
+        holiday_date = request.form["holiday_date"]
+        name = request.form["name"]
+        c.execute(
+            """
+            INSERT INTO public_holidays (location, holiday_date, name)
+            VALUES (?, ?, ?)
+            """,
+            (location, holiday_date, name),
+        )
+        conn.commit()
+        invalidate_rate_cache()
+        forecast_cache.invalidate_months(conn)
+        conn.close()
+        return redirect(url_for("manage_holidays"))
+    else:
+        c.execute("SELECT * FROM public_holidays ORDER BY holiday_date")
+        holidays = c.fetchall()
+        conn.close()
+        return render_template("manage_holidays.html", holidays=holidays)
+
+
+@app.route("/delete_holiday/<int:holiday_id>", methods=["POST"])
+def delete_holiday(holiday_id):
+    conn = get_db_connection()
+    c = conn.cursor()
+    c.execute("DELETE FROM public_holidays WHERE holiday_id=?", (holiday_id,))
+    conn.commit()
+    invalidate_rate_cache()
+    forecast_cache.invalidate_months(conn)
+    conn.close()
+    return redirect(url_for("manage_holidays"))
+
+@app.route("/manage_hazards", methods=["GET", "POST"])
+def manage_hazards():
+    conn = get_db_connection()
+    if request.method == "POST":
+        try:
+            annual_rate = float(request.form["annual_rate"])
+        except ValueError:
+            conn.close()
+            abort(400, description="annual_rate must be a number")
+        conn.execute(
+            """
+            INSERT INTO churn_hazards (grade, location, contract_type, annual_rate)
+            VALUES (?, ?, ?, ?)
+            """,
+            (request.form["grade"] or None, request.form["location"] or None,
+             request.form["contract_type"] or None, annual_rate),
+        )
+        conn.commit()
+        conn.close()
+        return redirect(url_for("manage_hazards"))
+    else:
+        hazards = churn.load_hazards(conn)
+        conn.close()
+        return render_template("manage_hazards.html", hazards=hazards)
+
+
+@app.route("/delete_hazard/<int:hazard_id>", methods=["POST"])
+def delete_hazard(hazard_id):
+    conn = get_db_connection()
+    conn.execute("DELETE FROM churn_hazards WHERE hazard_id=?", (hazard_id,))
+    conn.commit()
+    conn.close()
+    return redirect(url_for("manage_hazards"))
+
+@app.route("/manage_parameters", methods=["GET", "POST"])
+def manage_parameters():
+    conn = get_db_connection()
+    c = conn.cursor()
+    if request.method == "POST":
+        param_name = request.form["param_name"]
+        param_value = float(request.form["param_value"])
+        c.execute("UPDATE parameters SET param_value=? WHERE param_name=?", (param_value, param_name))
+        if c.rowcount == 0:
+            c.execute(
+                "INSERT INTO parameters (param_name, param_value) VALUES (?, ?)",
+                (param_name, param_value),
+            )
+        conn.commit()
+        conn.close()
+        # Churn is applied when forecast_cache totals are read, so nothing
+        # materialized needs recomputing.
+        invalidate_rate_cache()
+        return redirect(url_for("manage_parameters"))
+    else:
+        c.execute("SELECT * FROM parameters ORDER BY param_name")
+        parameters = c.fetchall()
+        conn.close()
+        return render_template("manage_parameters.html", parameters=parameters)
+
+
+@app.route("/manage_scenarios", methods=["GET", "POST"])
+def manage_scenarios():
+    conn = get_db_connection()
+    if request.method == "POST":
+        churn_rate = request.form.get("churn_rate")
+        try:
+            scenarios.create_scenario(
+                conn,
+                request.form["name"],
+                request.form.get("description") or None,
+                float(churn_rate) if churn_rate else None,
+            )
+        except sqlite3.IntegrityError:
+            conn.close()
+            abort(400, description="A scenario with that name already exists")
+        conn.close()
+        return redirect(url_for("manage_scenarios"))
+    else:
+        rows = scenarios.list_scenarios(conn)
+        conn.close()
+        return render_template("manage_scenarios.html", scenarios=rows)
+
+@app.route("/scenario/<int:scenario_id>", methods=["GET", "POST"])
+def edit_scenario(scenario_id):
+    """
+    Shows a scenario's overlay and adds to it: a people change when the form
+    has an "action", otherwise a rate multiplier.
+    """
+    conn = get_db_connection()
+    overlay = scenarios.load_overlays(conn, [scenario_id]).get(scenario_id)
+    if overlay is None:
+        conn.close()
+        abort(404)
+    if request.method == "POST":
+        form = request.form
+        try:
+            if form.get("action"):
+                scenarios.add_person_change(
+                    conn,
+                    scenario_id,
+                    form["action"],
+                    int(form["person_id"]) if form.get("person_id") else None,
+                    int(form.get("headcount") or 1),
+                    **{field: form.get(field) for field in scenarios.PERSON_FIELDS},
+                )
+            else:
+                scenarios.add_rate_multiplier(
+                    conn,
+                    scenario_id,
+                    float(form["multiplier"]),
+                    form.get("grade"),
+                    form.get("location"),
+                    form.get("start_month"),
+                    form.get("end_month"),
+                )
+        except ValueError as exc:
+            conn.close()
+            abort(400, description=str(exc))
+        conn.close()
+        return redirect(url_for("edit_scenario", scenario_id=scenario_id))
+    conn.close()
+    return render_template("edit_scenario.html", overlay=overlay, person_fields=scenarios.PERSON_FIELDS)
+
+@app.route("/delete_scenario/<int:scenario_id>", methods=["POST"])
+def delete_scenario(scenario_id):
+    conn = get_db_connection()
+    scenarios.delete_scenario(conn, scenario_id)
+    conn.close()
+    return redirect(url_for("manage_scenarios"))
+
+@app.route("/scenario/<int:scenario_id>/delete_change/<int:change_id>", methods=["POST"])
+def delete_scenario_change(scenario_id, change_id):
+    conn = get_db_connection()
+    scenarios.delete_person_change(conn, change_id)
+    conn.close()
+    return redirect(url_for("edit_scenario", scenario_id=scenario_id))
+
+@app.route("/scenario/<int:scenario_id>/delete_multiplier/<int:multiplier_id>", methods=["POST"])
+def delete_scenario_multiplier(scenario_id, multiplier_id):
+    conn = get_db_connection()
+    scenarios.delete_rate_multiplier(conn, multiplier_id)
+    conn.close()
+    return redirect(url_for("edit_scenario", scenario_id=scenario_id))
+
+def _scenario_ids():
+    try:
+        return [int(value) for value in request.args.get("ids", "").split(",") if value]
+    except ValueError:
+        abort(400, description="ids must be a comma-separated list of scenario ids")
+
+@app.route("/compare_scenarios")
+def compare_scenarios():
+    """
+    Forecasts the base data and the scenarios in "ids" side by side from
+    "start" to "end".
+    """
+    start_ym, end_ym, _ = _api_arguments()
+    ids = _scenario_ids()
+    comparison = scenarios.compare_scenarios(ids, start_ym, end_ym)
+    conn = get_db_connection()
+    available = scenarios.list_scenarios(conn)
+    conn.close()
+    return render_template("compare_scenarios.html", comparison=comparison, available=available,
+                           selected=ids, start=start_ym, end=end_ym)
+
+@app.route("/api/scenarios")
+def api_scenarios():
+    """
+    JSON version of /compare_scenarios, with the same ETag handling as the
+    other API routes.
+    """
+    start_ym, end_ym, _ = _api_arguments()
+    ids = _scenario_ids()
+    return _conditional_json(lambda: dict(scenarios.compare_scenarios(ids, start_ym, end_ym),
+                                          start=start_ym, end=end_ym))
+
+
+@app.route("/api/batch_forecast")
+def api_batch_forecast():
+    """
+    Runs batch.run_batch from "start" to "end" for each of the comma-separated
+    "churn_rates" (default: the churn_rate parameter) on up to "workers"
+    processes.
+    """
+    start_ym, end_ym, _ = _api_arguments()
+    try:
+        churn_rates = [float(value) for value in request.args.get("churn_rates", "").split(",") if value] or None
+        workers = int(request.args.get("workers", batch.DEFAULT_WORKERS))
+    except ValueError:
+        abort(400, description="churn_rates must be numbers and workers an integer")
+    return _conditional_json(lambda: dict(batch.run_batch(start_ym, end_ym, churn_rates, workers),
+                                          start=start_ym, end=end_ym))
+
+
+@app.route("/cache_stats")
+def cache_stats():
+    """
+    Reports hit/miss statistics for the planning-rate and parameter cache and
+    the rendered chart cache.
+    """
+    return jsonify({"rates": rate_cache.stats(), "charts": charts.chart_cache.stats()})
+
+@app.route("/pool_stats")
+def pool_stats():
+    """
+    Reports database connection pool usage: connections in use, waits and leaks.
+    """
+    return jsonify(get_pool().stats())
+
+@app.route("/metrics")
+def metrics_route():
+    """
+    Request latency, queries per request, query times and forecast spans in
+    the Prometheus text format. 404 unless WORKFORCE_METRICS is set.
+    """
+    if not metrics.ENABLED:
+        abort(404)
+    return Response(metrics.expose(), mimetype="text/plain; version=0.0.4")
+
+@app.route("/profiles")
+def profiles():
+    """
+    Lists recent profiler captures and their top functions. Only for the
+    addresses allowed to profile.
+    """
+    if not profiling.allowed(request.remote_addr):
+        abort(404)
+    return render_template("profiles.html", captures=profiling.list_captures())
+
+@app.route("/profiles/<filename>")
+def profile_file(filename):
+    """Downloads a saved .pstats or .collapsed capture."""
+    path = profiling.capture_path(filename) if profiling.allowed(request.remote_addr) else None
+    if path is None:
+        abort(404)
+    return send_file(os.path.abspath(path), as_attachment=True, download_name=filename)
+
 @app.route("/run_forecast")
+@_profiled
 def run_forecast_route():
     # Use query parameters "year" and "month" if provided, otherwise default to current.
     year = int(request.args.get("year", datetime.now().year))
     month = int(request.args.get("month", datetime.now().month))
     
-    forecast = run_forecast(year, month)
+    forecast = forecast_cache.month_forecast(year, month)
     budget_val = get_budget(year, month)
     return render_template("forecast.html", forecast=forecast, budget=budget_val)
 
+YEAR_MONTH = re.compile(r"^\d{4}-(0[1-9]|1[0-2])$")
+
+
+def _api_arguments():
+    """
+    Reads "start" and "end" (YYYY-MM, defaulting to the current year) and the
+    comma-separated "group_by" columns for the JSON API. Aborts with 400 on
+    anything invalid.
+    """
+    year = datetime.now().year
+    start_ym = request.args.get("start", f"{year}-01")
+    end_ym = request.args.get("end", f"{year}-12")
+    group_by = [column for column in request.args.get("group_by", "").split(",") if column]
+    if not (YEAR_MONTH.match(start_ym) and YEAR_MONTH.match(end_ym)) or start_ym > end_ym:
+        abort(400, description="start and end must be YYYY-MM with start <= end")
+    if any(column not in GROUP_COLUMNS for column in group_by):
+        abort(400, description=f"group_by may only contain {', '.join(GROUP_COLUMNS)}")
+    return start_ym, end_ym, group_by
+
+
+def _conditional_json(build):
+    """
+    Responds with build()'s payload as JSON, tagged with the data version.
+    Requests whose If-None-Match (or, failing that, If-Modified-Since) is
+    still current get a 304 without build() being called.
+    """
+    conn = get_db_connection()
+    version, updated_at = get_data_version(conn)
+    conn.close()
+    etag = f"v{version}"
+    last_modified = datetime.strptime(updated_at, "%Y-%m-%dT%H:%M:%SZ").replace(tzinfo=timezone.utc)
+    if request.if_none_match:
+        not_modified = request.if_none_match.contains_weak(etag)
+    else:
+        not_modified = request.if_modified_since is not None and last_modified <= request.if_modified_since
+    if not_modified:
+        response = Response(status=304)
+    else:
+        response = jsonify(dict(build(), data_version=version))
+    response.set_etag(etag)
+    response.last_modified = last_modified
+    # Clients may keep the response but must revalidate before using it.
+    response.cache_control.no_cache = True
+    return response
+
+
+def _forecast_rows(start_ym, end_ym, group_by):
+    if group_by:
+        return forecast_cache.grouped_totals(start_ym, end_ym, group_by)
+    totals = forecast_cache.monthly_totals(start_ym, end_ym)
+    return [{"year_month": f"{year}-{month:02d}", "forecast": total}
+            for (year, month), total in zip(month_range(start_ym, end_ym), totals)]
+
+
+def _budget_rows(start_ym, end_ym, group_by):
+    if group_by:
+        return get_budget_grouped(start_ym, end_ym, group_by)
+    totals = get_budget_range(start_ym, end_ym)
+    return [{"year_month": f"{year}-{month:02d}", "budget": total}
+            for (year, month), total in zip(month_range(start_ym, end_ym), totals)]
+
+
+@app.route("/api/forecast")
+def api_forecast():
+    """
+    Forecast cost after churn by month, optionally grouped by team and/or work_stream.
+    """
+    start_ym, end_ym, group_by = _api_arguments()
+    return _conditional_json(lambda: {
+        "start": start_ym, "end": end_ym, "group_by": group_by,
+        "rows": _forecast_rows(start_ym, end_ym, group_by),
+    })
+
+
+@app.route("/api/budget")
+def api_budget():
+    """
+    Allocated budget by month, optionally grouped by team and/or work_stream.
+    """
+    start_ym, end_ym, group_by = _api_arguments()
+    return _conditional_json(lambda: {
+        "start": start_ym, "end": end_ym, "group_by": group_by,
+        "rows": _budget_rows(start_ym, end_ym, group_by),
+    })
+
+
+@app.route("/api/variance")
+def api_variance():
+    """
+    Budget minus forecast by month, optionally grouped by team and/or
+    work_stream. Positive variance means forecast spend is under budget.
+    """
+    start_ym, end_ym, group_by = _api_arguments()
+    return _conditional_json(lambda: {
+        "start": start_ym, "end": end_ym, "group_by": group_by,
+        "rows": variance_rows(start_ym, end_ym, group_by),
+    })
+
+@app.route("/variance")
+def variance_page():
+    """
+    Shows budget, forecast and variance by month, grouped by team and/or
+    work_stream when "group_by" is given.
+    """
+    start_ym, end_ym, group_by = _api_arguments()
+    rows = variance_rows(start_ym, end_ym, group_by)
+    return render_template("variance.html", rows=rows, start=start_ym, end=end_ym,
+                           group_by=group_by, group_columns=GROUP_COLUMNS)
+
+@app.route("/api/headcount")
+def api_headcount():
+    """
+    People and posts active at any point in each month from "start" to "end",
+    answered from the interval indexes.
+    """
+    start_ym, end_ym, _ = _api_arguments()
+    year_months = [f"{year}-{month:02d}" for year, month in month_range(start_ym, end_ym)]
+
+    def build():
+        conn = get_db_connection()
+        people_index, posts_index = intervals.get_indexes(conn)
+        conn.close()
+        return {"start": start_ym, "end": end_ym, "months": year_months,
+                "people": people_index.monthly_counts(year_months).tolist(),
+                "posts": posts_index.monthly_counts(year_months).tolist()}
+    return _conditional_json(build)
+
+def _date_argument(name, default):
+    value = request.args.get(name, default)
+    try:
+        if len(value) != 10:
+            raise ValueError
+        datetime.strptime(value, "%Y-%m-%d")
+    except ValueError:
+        abort(400, description=f"{name} must be YYYY-MM-DD")
+    return value
+
+@app.route("/api/active")
+def api_active():
+    """
+    The ids of the people and posts active on "date", or at any point from
+    "date" to "until" (both YYYY-MM-DD), with their counts.
+    """
+    first = _date_argument("date", datetime.now().strftime("%Y-%m-%d"))
+    last = _date_argument("until", first)
+    if first > last:
+        abort(400, description="until must not be before date")
+
+    def build():
+        conn = get_db_connection()
+        people_index, posts_index = intervals.get_indexes(conn)
+        conn.close()
+        people = people_index.active(first, last).tolist()
+        posts = posts_index.active(first, last).tolist()
+        return {"date": first, "until": last, "people": len(people), "posts": len(posts),
+                "person_ids": people, "post_ids": posts}
+    return _conditional_json(build)
+
+@app.route("/api/post_costs")
+def api_post_costs():
+    """
+    Post-based costs from "start" to "end" by funding source: occupied posts
+    at their occupant's cost and vacant post-months at the post's rate.
+    """
+    start_ym, end_ym, _ = _api_arguments()
+    return _conditional_json(lambda: dict(occupancy.post_costs(start_ym, end_ym), start=start_ym, end=end_ym))
+
+@app.route("/post_costs")
+def post_costs_page():
+    """
+    Shows post-based costs by funding source and month.
+    """
+    start_ym, end_ym, _ = _api_arguments()
+    result = occupancy.post_costs(start_ym, end_ym)
+    return render_template("post_costs.html", result=result, start=start_ym, end=end_ym)
+
+def _churn_arguments():
+    """
+    Reads "start" and "end" as for the JSON API, plus "trials" and an
+    optional "seed" for a churn simulation.
+    """
+    start_ym, end_ym, _ = _api_arguments()
+    try:
+        trials = int(request.args.get("trials", churn.DEFAULT_TRIALS))
+        seed = request.args.get("seed")
+        seed = int(seed) if seed else None
+    except ValueError:
+        abort(400, description="trials and seed must be integers")
+    if not 1 <= trials <= churn.MAX_TRIALS:
+        abort(400, description=f"trials must be between 1 and {churn.MAX_TRIALS}")
+    return start_ym, end_ym, trials, seed
+
+@app.route("/api/churn_simulation")
+def api_churn_simulation():
+    """
+    P10/P50/P90 forecast cost from a Monte Carlo churn simulation. Without a
+    seed every call draws afresh, so the result is not cached; the seed used
+    is returned so a run can be repeated.
+    """
+    start_ym, end_ym, trials, seed = _churn_arguments()
+    return jsonify(dict(churn.simulate_churn(start_ym, end_ym, trials, seed), start=start_ym, end=end_ym))
+
+@app.route("/churn_simulation")
+def churn_simulation():
+    """
+    Shows the P10/P50/P90 bands of a churn simulation by month next to the
+    forecast with the flat churn_rate parameter.
+    """
+    start_ym, end_ym, trials, seed = _churn_arguments()
+    result = churn.simulate_churn(start_ym, end_ym, trials, seed)
+    flat = forecast_cache.monthly_totals(start_ym, end_ym)
+    return render_template("churn_simulation.html", result=result, flat=flat, start=start_ym, end=end_ym)
+
 @app.route("/export_csv")
 def export_csv():
     """
     Exports the People table as a CSV file.
     """
-    conn = get_db_connection()
-    c = conn.cursor()
-    c.execute("SELECT * FROM people")
-    people = c.fetchall()
-    conn.close()
-    
-    output = io.StringIO()
-    writer = csv.writer(output)
-    writer.writerow(["person_id", "name", "team", "grade", "work_stream", "location",
-                     "contract_type", "status", "start_date", "expected_end_date"])
-    for row in people:
-        writer.writerow([
-            row["person_id"], row["name"], row["team"], row["grade"],
-            row["work_stream"], row["location"], row["contract_type"],
-            row["status"], row["start_date"], row["expected_end_date"]
-        ])
-    output.seek(0)
-    return send_file(io.BytesIO(output.getvalue().encode()),
-                     mimetype="text/csv",
-                     as_attachment=True,
-                     download_name="people.csv")
+    return export_people_route("csv")
+
+
+def _streamed(chunks, fmt, filename):
+    return Response(
+        stream_with_context(chunks),
+        mimetype=FORMATS[fmt],
+        headers={"Content-Disposition": f"attachment; filename={filename}.{fmt}"},
+    )
+
+
+@app.route("/export/people.<fmt>")
+def export_people_route(fmt):
+    """
+    Streams the People table as CSV or NDJSON.
+    """
+    if fmt not in FORMATS:
+        abort(404)
+    return _streamed(export_people(fmt), fmt, "people")
+
+
+@app.route("/export/forecast.<fmt>")
+def export_forecast_route(fmt):
+    """
+    Streams the per-person, per-month forecast as CSV or NDJSON. Query
+    parameters "start" and "end" (YYYY-MM) default to the current year and
+    may span at most MAX_FORECAST_MONTHS.
+    """
+    if fmt not in FORMATS:
+        abort(404)
+    # Checked before streaming starts: an error inside the generator would
+    # only cut the response short.
+    start_ym, end_ym, _ = _api_arguments()
+    if len(month_range(start_ym, end_ym)) > MAX_FORECAST_MONTHS:
+        abort(400, description=f"exports may cover at most {MAX_FORECAST_MONTHS} months; "
+                               "queue longer ones as a background job")
+    return _streamed(export_forecast(fmt, start_ym, end_ym), fmt, f"forecast_{start_ym}_{end_ym}")
+
+def _job_json(job):
+    job = dict(job, status_url=url_for("api_job", job_id=job["job_id"]))
+    if job["has_output"]:
+        job["output_url"] = url_for("job_output", job_id=job["job_id"])
+    return job
+
+
+def _queued(job_id):
+    response = jsonify(_job_json(jobs.get_job(job_id)))
+    response.status_code = 202
+    response.headers["Location"] = url_for("api_job", job_id=job_id)
+    return response
+
+
+def _queue_failed(exc):
+    response = jsonify({"error": f"could not queue the job: {exc}"})
+    response.status_code = 503
+    response.headers["Retry-After"] = "30"
+    return response
+
+
+@app.route("/api/jobs/upload/<table>", methods=["POST"])
+def api_upload_job(table):
+    """
+    Queues a CSV upload ("csv_file") into people, posts, budget or salaries;
+    "mode=replace_months" replaces whole months of salaries. Returns 202 with
+    the job, or 503 when the queue is full.
+    """
+    file = request.files.get("csv_file")
+    if not file:
+        abort(400, description="csv_file is required")
+    try:
+        job_id = jobs.submit_upload(table, file.stream, request.form.get("mode") == "replace_months")
+    except ValueError as exc:
+        abort(400, description=str(exc))
+    except (jobs.QueueFull, sqlite3.OperationalError) as exc:
+        return _queue_failed(exc)
+    return _queued(job_id)
+
+
+@app.route("/api/jobs/forecast", methods=["POST"])
+def api_forecast_job():
+    """
+    Queues the per-person forecast from "start" to "end" (YYYY-MM) as a
+    "format" (csv or ndjson) file to download when done. Returns 202 with
+    the job, or 503 when the queue is full.
+    """
+    start_ym, end_ym, _ = _api_arguments()
+    try:
+        job_id = jobs.submit_forecast(start_ym, end_ym, request.args.get("format", "csv"))
+    except ValueError as exc:
+        abort(400, description=str(exc))
+    except (jobs.QueueFull, sqlite3.OperationalError) as exc:
+        return _queue_failed(exc)
+    return _queued(job_id)
+
+
+@app.route("/api/jobs")
+def api_jobs():
+    """The 50 most recent jobs, newest first."""
+    jobs.ensure_workers()
+    return jsonify([_job_json(job) for job in jobs.list_jobs()])
+
+
+@app.route("/api/jobs/<int:job_id>")
+def api_job(job_id):
+    """A job's status, progress (0 to 1), message and result; poll until status is done or failed."""
+    jobs.ensure_workers()
+    job = jobs.get_job(job_id)
+    if job is None:
+        abort(404)
+    return jsonify(_job_json(job))
+
+
+@app.route("/jobs", methods=["GET", "POST"])
+def jobs_page():
+    """
+    Lists recent background jobs; posting "start", "end" and "format" queues
+    a forecast.
+    """
+    jobs.ensure_workers()
+    if request.method == "POST":
+        start_ym = request.form.get("start", "")
+        end_ym = request.form.get("end", "")
+        if not (YEAR_MONTH.match(start_ym) and YEAR_MONTH.match(end_ym)) or start_ym > end_ym:
+            abort(400, description="start and end must be YYYY-MM with start <= end")
+        try:
+            job_id = jobs.submit_forecast(start_ym, end_ym, request.form.get("format", "csv"))
+        except ValueError as exc:
+            abort(400, description=str(exc))
+        except (jobs.QueueFull, sqlite3.OperationalError) as exc:
+            return Response(f"Could not queue the forecast: {exc}. Try again shortly.", 503,
+                            {"Retry-After": "30"}, mimetype="text/plain")
+        return redirect(url_for("job_page", job_id=job_id))
+    year = datetime.now().year
+    return render_template("jobs.html", jobs=jobs.list_jobs(), start=f"{year}-01", end=f"{year + 4}-12")
+
+
+@app.route("/jobs/<int:job_id>")
+def job_page(job_id):
+    """One job's progress, refreshing itself until the job ends."""
+    jobs.ensure_workers()
+    job = jobs.get_job(job_id)
+    if job is None:
+        abort(404)
+    return render_template("job.html", job=job)
+
+
+@app.route("/jobs/<int:job_id>/output")
+def job_output(job_id):
+    """Downloads a finished forecast job's file."""
+    output = jobs.get_output(job_id)
+    if output is None:
+        abort(404)
+    data, filename, mimetype = output
+    return send_file(io.BytesIO(data), mimetype=mimetype, as_attachment=True, download_name=filename)
 
 @app.route("/generate_chart")
+@_profiled
 def generate_chart():
     """
-    Generates a PNG chart comparing monthly forecast cost with the allocated budget.
+    Generates a chart comparing monthly forecast cost with the allocated
+    budget. Accepts "year", "width" and "height" in pixels, and "format"
+    (png or svg). Rendered charts are cached until the data changes.
     """
     year = int(request.args.get("year", datetime.now().year))
-    months = list(range(1, 13))
-    costs = []
-    budgets = []
-    for month in months:
-        forecast = run_forecast(year, month)
-        costs.append(forecast["total_cost"])
-        budgets.append(get_budget(year, month))
-    
-    plt.figure()
-    plt.plot(months, costs, marker='o', label='Forecast Cost')
-    if any(budgets):
-        plt.plot(months, budgets, marker='x', label='Allocated Budget')
-    plt.title(f"Monthly Workforce Cost Forecast for {year}")
-    plt.xlabel("Month")
-    plt.ylabel("Cost")
-    plt.legend()
-    plt.grid(True)
-    
-    img = io.BytesIO()
-    plt.savefig(img, format='png')
-    plt.close()
-    img.seek(0)
-    return send_file(img, mimetype='image/png', download_name="forecast_chart.png")
+    width = charts.clamp_size(request.args.get("width"), charts.DEFAULT_WIDTH)
+    height = charts.clamp_size(request.args.get("height"), charts.DEFAULT_HEIGHT)
+    fmt = request.args.get("format", "png")
+    if fmt not in charts.FORMATS:
+        abort(404)
+    conn = get_db_connection()
+    version, _ = get_data_version(conn)
+    conn.close()
+
+    def load():
+        return (forecast_cache.monthly_totals(f"{year}-01", f"{year}-12"),
+                get_budget_range(f"{year}-01", f"{year}-12"))
+
+    image = charts.get_chart(year, version, width, height, fmt, load)
+    return send_file(io.BytesIO(image), mimetype=charts.FORMATS[fmt],
+                     download_name=f"forecast_chart.{fmt}")
 
 if __name__ == "__main__":
     app.run(debug=True)
@@ -0,0 +1,176 @@
+"""
+Batch forecasts over long horizons on a pool of worker processes.
+
+The people, ordered by person_id, are split into chunks of chunk_size, and
+each task sends a worker its chunk of people; its result is one row of
+monthly totals. The worker processes belong to one pool of MAX_WORKERS
+(WORKFORCE_BATCH_WORKERS, default the number of CPUs) that is started on
+first use and shared by every later run in the process, so concurrent runs
+queue for the same processes. Each worker keeps its rate and holiday cache
+between runs (see utils.rate_cache). Chunk totals are added up in chunk order
+and the chunks depend only on chunk_size, so the result is identical for any
+number of workers, including the in-process serial run with workers=1. Churn
+is applied to the merged totals, so several churn rates cost no more than
+one.
+
+    WORKFORCE_BATCH_WORKERS=8 python batch.py --start 2025-01 --end 2034-12 --churn-rates 0 0.05 0.1
+"""
+
+import argparse
+import itertools
+import json
+import multiprocessing
+import os
+import threading
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+import numpy as np
+
+import database
+from records import load_people
+from utils import (
+    calculate_cost_matrix,
+    get_db_connection,
+    get_global_churn_rate,
+    get_holidays,
+    get_month_rates,
+    month_range,
+)
+
+CHUNK_SIZE = 5000
+MAX_WORKERS = int(os.environ.get("WORKFORCE_BATCH_WORKERS", os.cpu_count() or 1))
+DEFAULT_WORKERS = MAX_WORKERS
+
+_executor = None
+_executor_lock = threading.Lock()
+# Per worker process: the database its connection pool points at.
+_worker = {}
+
+
+def _load_people(conn, year_months):
+    people = load_people(conn)
+    # Warm this process's rate and holiday cache for every chunk to share.
+    get_month_rates(year_months, conn)
+    get_holidays(conn)
+    return people
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            # Spawned rather than forked, so no worker inherits the parent's
+            # SQLite connections or server threads.
+            _executor = ProcessPoolExecutor(max_workers=MAX_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+        return _executor
+
+
+def shutdown():
+    """Stops the worker processes; the next run starts new ones."""
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(cancel_futures=True)
+            _executor = None
+
+
+def _chunk_totals(people, year_months, conn):
+    return calculate_cost_matrix(people, year_months, conn).sum(axis=0)
+
+
+def _worker_chunk_totals(database_path, people, year_months):
+    if _worker.get("database") != database_path:
+        database.reset_pool(database_path)
+        _worker["database"] = database_path
+    conn = get_db_connection()
+    try:
+        return _chunk_totals(people, year_months, conn)
+    finally:
+        conn.close()
+
+
+def _map_bounded(executor, func, tasks, limit):
+    """executor.map with at most limit tasks submitted at a time, so one run leaves room for others."""
+    results = [None] * len(tasks)
+    remaining = iter(enumerate(tasks))
+    pending = {executor.submit(func, *task): index for index, task in itertools.islice(remaining, limit)}
+    while pending:
+        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            results[pending.pop(future)] = future.result()
+            for index, task in itertools.islice(remaining, 1):
+                pending[executor.submit(func, *task)] = index
+    return results
+
+
+def run_batch(start_ym, end_ym, churn_rates=None, workers=DEFAULT_WORKERS, chunk_size=CHUNK_SIZE):
+    """
+    Forecasts every month from start_ym to end_ym once per churn rate (the
+    churn_rate parameter when none are given), splitting the people across
+    up to workers of the shared pool's processes.
+
+    Returns the months, the pre-churn monthly totals and, per churn rate, the
+    monthly totals after churn and their sum.
+    """
+    year_months = [f"{year}-{month:02d}" for year, month in month_range(start_ym, end_ym)]
+    if churn_rates is None:
+        churn_rates = [get_global_churn_rate()]
+    conn = get_db_connection()
+    people = _load_people(conn, year_months)
+    n_people = len(people)
+    chunks = [people[first:first + chunk_size] for first in range(0, n_people, chunk_size)]
+    workers = max(1, min(workers, MAX_WORKERS, len(chunks)))
+
+    if workers == 1:
+        partials = [_chunk_totals(chunk, year_months, conn) for chunk in chunks]
+        conn.close()
+    else:
+        conn.close()
+        tasks = [(os.path.abspath(database.DATABASE_NAME), chunk, year_months) for chunk in chunks]
+        try:
+            partials = _map_bounded(_get_executor(), _worker_chunk_totals, tasks, workers)
+        except BrokenProcessPool:
+            # A worker died; start a fresh pool for the next run.
+            shutdown()
+            raise
+
+    totals = np.zeros(len(year_months))
+    for partial in partials:
+        totals += partial
+    forecasts = []
+    for churn_rate in churn_rates:
+        monthly = totals * (1 - churn_rate)
+        forecasts.append({"churn_rate": churn_rate, "monthly": monthly.tolist(), "total": float(monthly.sum())})
+    return {
+        "months": year_months,
+        "people": n_people,
+        "workers": workers,
+        "chunks": len(chunks),
+        "pre_churn": totals.tolist(),
+        "forecasts": forecasts,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--start", required=True, help="first month, YYYY-MM")
+    parser.add_argument("--end", required=True, help="last month, YYYY-MM")
+    parser.add_argument("--churn-rates", type=float, nargs="+", default=None,
+                        help="defaults to the churn_rate parameter")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help="at most WORKFORCE_BATCH_WORKERS")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+    parser.add_argument("--json", action="store_true", help="print the full result as JSON")
+    args = parser.parse_args()
+    result = run_batch(args.start, args.end, args.churn_rates, args.workers, args.chunk_size)
+    if args.json:
+        print(json.dumps(result))
+        return
+    print(f"{result['people']} people, {len(result['months'])} months, "
+          f"{result['chunks']} chunks on {result['workers']} workers")
+    for forecast in result["forecasts"]:
+        print(f"churn {forecast['churn_rate']:.4f}: total {forecast['total']:.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,536 @@
+"""
+Benchmarks for the forecast hot paths.
+
+Each benchmark builds a throwaway database in a temporary directory, fills it
+with synthetic people and pay rates, and times the code under test.
+
+    python benchmark.py --sizes 1000 10000 100000
+    python benchmark.py --only hot_paths --hot-scales 1000 10000 --json results.json
+    python benchmark.py --only hot_paths --json new.json --baseline results.json
+"""
+
+import argparse
+import calendar
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import date, datetime, timedelta
+
+import numpy as np
+
+import batch
+import charts
+import churn
+import database
+import forecast_cache
+import init_db
+import intervals
+import metrics
+import occupancy
+import records
+import synthetic
+import utils
+import variance
+from ingest import ingest_csv
+
+def populate(n_people, year, seed=0, years=1, posts=False, budget=False):
+    """Fill the database in the current directory with synthetic data."""
+    conn = sqlite3.connect("workforce_model.db")
+    synthetic.generate(conn, n_people, year, years, seed, posts=posts, budget=budget)
+    conn.close()
+
+
+@contextlib.contextmanager
+def scratch_db(n_people, year, **options):
+    """Run the body inside a temporary directory holding a populated database (see populate)."""
+    with tempfile.TemporaryDirectory() as tmp:
+        cwd = os.getcwd()
+        os.chdir(tmp)
+        try:
+            database.reset_pool(os.path.abspath("workforce_model.db"))
+            init_db.init_db()
+            populate(n_people, year, **options)
+            # Caches keyed on the data version would otherwise carry over
+            # from the previous scratch database.
+            utils.invalidate_rate_cache()
+            intervals.invalidate_indexes()
+            charts.chart_cache.clear()
+            yield
+        finally:
+            database.get_pool().close()
+            os.chdir(cwd)
+
+
+# The forecast as it was before the bulk rate loading (commit 8b52cd9), kept
+# verbatim as the baseline: its own connection and rate query per person, and
+# day-by-day working day counts.
+
+def legacy_get_db_connection():
+    conn = sqlite3.connect(database.DATABASE_NAME)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+def legacy_working_days_in_month(year, month, exclude_weekends=True):
+    total_working_days = 0
+    cal = calendar.Calendar()
+    for day in cal.itermonthdates(year, month):
+        if day.month == month:
+            if exclude_weekends:
+                if day.weekday() < 5:  # Monday-Friday
+                    total_working_days += 1
+            else:
+                total_working_days += 1
+    return total_working_days
+
+def legacy_working_days_in_period(period_start, period_end):
+    total = 0
+    current = period_start
+    while current <= period_end:
+        if current.weekday() < 5:
+            total += 1
+        current += timedelta(days=1)
+    return total
+
+def legacy_calculate_prorated_cost(monthly_planning_rate, person_start, person_end, year, month):
+    month_start = date(year, month, 1)
+    last_day = calendar.monthrange(year, month)[1]
+    month_end = date(year, month, last_day)
+
+    # Convert string dates to date objects.
+    start_date = datetime.strptime(person_start, "%Y-%m-%d").date() if person_start else month_start
+    end_date = datetime.strptime(person_end, "%Y-%m-%d").date() if person_end else month_end
+
+    # Determine the effective occupancy within the month.
+    effective_start = max(start_date, month_start)
+    effective_end = min(end_date, month_end)
+
+    if effective_start > effective_end:
+        return 0.0
+
+    working_days_month = legacy_working_days_in_month(year, month)
+    working_days_active = legacy_working_days_in_period(effective_start, effective_end)
+    return monthly_planning_rate * (working_days_active / working_days_month)
+
+def legacy_get_planning_rate(grade, location, forecast_year, forecast_month):
+    target_ym = f"{forecast_year}-{forecast_month:02d}"
+    conn = legacy_get_db_connection()
+    c = conn.cursor()
+    c.execute('''
+        SELECT monthly_planning_rate
+        FROM salaries
+        WHERE grade = ? AND location = ? AND year_month = ?
+        LIMIT 1
+    ''', (grade, location, target_ym))
+    row = c.fetchone()
+    conn.close()
+    if row:
+        return row["monthly_planning_rate"]
+    else:
+        return 0.0
+
+def legacy_get_global_churn_rate():
+    conn = legacy_get_db_connection()
+    c = conn.cursor()
+    c.execute("SELECT param_value FROM parameters WHERE param_name = 'churn_rate' LIMIT 1")
+    row = c.fetchone()
+    conn.close()
+    if row:
+        return row["param_value"]
+    else:
+        return 0.0
+
+def legacy_calculate_person_cost(person, year, month):
+    # Retrieve planning rate for the given month.
+    planning_rate = legacy_get_planning_rate(person["grade"], person["location"], year, month)
+
+    status = person["status"].lower() if person["status"] else ""
+    # If the status indicates an external or unpaid assignment, return zero cost.
+    if status in ["loan-out", "loan-out_unpaid"]:
+        return 0.0
+
+    last_day = calendar.monthrange(year, month)[1]
+    # Use start_date and expected_end_date fields.
+    start_date = person["start_date"] if person["start_date"] else f"{year}-{month:02d}-01"
+    end_date = person["expected_end_date"] if person["expected_end_date"] else f"{year}-{month:02d}-{last_day:02d}"
+
+    cost = legacy_calculate_prorated_cost(planning_rate, start_date, end_date, year, month)
+    return cost
+
+def legacy_run_forecast(year, month):
+    conn = legacy_get_db_connection()
+    c = conn.cursor()
+    c.execute("SELECT * FROM people")
+    people = c.fetchall()
+    conn.close()
+
+    total_cost = 0.0
+    details = []
+    churn_rate = legacy_get_global_churn_rate()
+
+    for person in people:
+        cost = legacy_calculate_person_cost(person, year, month)
+        adjusted_cost = cost * (1 - churn_rate)
+        total_cost += adjusted_cost
+        details.append({
+            "person_id": person["person_id"],
+            "name": person["name"],
+            "cost": adjusted_cost
+        })
+
+    return {
+        "year": year,
+        "month": month,
+        "total_cost": total_cost,
+        "details": details
+    }
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+
+def bench_run_forecast(sizes, year=2025, month=6, skip_legacy_above=None):
+    print(f"{'people':>8} {'legacy (s)':>12} {'bulk (s)':>10} {'speedup':>8}")
+    for n in sizes:
+        with scratch_db(n, year):
+            forecast, bulk_time = timed(utils.run_forecast, year, month)
+            if skip_legacy_above is not None and n > skip_legacy_above:
+                print(f"{n:>8} {'-':>12} {bulk_time:>10.3f} {'-':>8}")
+                continue
+            legacy, legacy_time = timed(legacy_run_forecast, year, month)
+            legacy_total = legacy["total_cost"]
+            assert abs(legacy_total - forecast["total_cost"]) < 1e-6 * max(1.0, legacy_total)
+            print(f"{n:>8} {legacy_time:>12.3f} {bulk_time:>10.3f} {legacy_time / bulk_time:>7.1f}x")
+
+
+def bench_run_forecast_range(n_people, n_months, year=2025):
+    end_year, end_month = year + (n_months - 1) // 12, (n_months - 1) % 12 + 1
+    with scratch_db(n_people, year):
+        forecast, elapsed = timed(utils.run_forecast_range, f"{year}-01", f"{end_year}-{end_month:02d}")
+    rows, cols = forecast["costs"].shape
+    print(f"run_forecast_range: {rows} people x {cols} months in {elapsed:.3f}s")
+
+
+def allocated(func, *args):
+    """Calls func, returning its result and the bytes it left allocated."""
+    tracemalloc.start()
+    result = func(*args)
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, size
+
+
+def bench_records(n_people, n_months, year=2025):
+    """Compares sqlite3.Row with records.Person: memory per 100k people, load time and forecast time."""
+    year_months = [f"{year}-{month:02d}" for month in range(1, n_months + 1)]
+    with scratch_db(n_people, year):
+        conn = utils.get_db_connection()
+        utils.get_month_rates(year_months, conn)
+        load_rows = lambda: conn.execute("SELECT * FROM people ORDER BY person_id").fetchall()
+        _, row_bytes = allocated(load_rows)
+        _, record_bytes = allocated(records.load_people, conn)
+        rows, row_load = timed(load_rows)
+        people, record_load = timed(records.load_people, conn)
+        row_costs, row_time = timed(utils.calculate_cost_matrix, rows, year_months, conn)
+        record_costs, record_time = timed(utils.calculate_cost_matrix, people, year_months, conn)
+        assert (row_costs == record_costs).all(), "records cost differently from rows"
+        rates = utils.get_month_rates(year_months[:1], conn)
+        _, row_loop = timed(lambda: [utils.calculate_person_cost(row, year, 1, rates) for row in rows])
+        _, record_loop = timed(lambda: [utils.calculate_person_cost(person, year, 1, rates) for person in people])
+        conn.close()
+    scale = 100000 / n_people
+    print(f"{'':>8} {'MB/100k':>8} {'load (s)':>9} {'matrix (s)':>11} {'loop (s)':>9}")
+    print(f"{'Row':>8} {row_bytes * scale / 2**20:>8.1f} {row_load:>9.3f} {row_time:>11.3f} {row_loop:>9.3f}")
+    print(f"{'Person':>8} {record_bytes * scale / 2**20:>8.1f} {record_load:>9.3f} {record_time:>11.3f} {record_loop:>9.3f}")
+    print(f"records: {row_bytes / record_bytes:.1f}x less memory, matrix {row_time / record_time:.1f}x, "
+          f"per-person loop {row_loop / record_loop:.1f}x faster")
+
+
+def bench_variance(n_people, n_teams, n_years, year=2025):
+    """Times variance_rows by month, team and work stream over several years of budget."""
+    start_ym, end_ym = f"{year}-01", f"{year + n_years - 1}-12"
+    with scratch_db(n_people, year):
+        conn = utils.get_db_connection()
+        conn.execute("UPDATE people SET team = 'Team ' || (person_id % ?)", (n_teams,))
+        conn.executemany(
+            "INSERT INTO budget (team, work_stream, year_month, allocated_budget) VALUES (?, ?, ?, ?)",
+            [(f"Team {team}", f"Stream {stream}", f"{y}-{m:02d}", 50000.0)
+             for team in range(n_teams) for stream in range(1, 11)
+             for y in range(year, year + n_years) for m in range(1, 13)],
+        )
+        conn.commit()
+        _, elapsed = timed(forecast_cache.ensure_months, conn,
+                           [f"{y}-{m:02d}" for y, m in utils.month_range(start_ym, end_ym)])
+        conn.close()
+        print(f"materialize {n_people} people x {n_years * 12} months: {elapsed:.3f}s")
+        for group_by in ([], ["team"], ["team", "work_stream"]):
+            rows, elapsed = timed(variance.variance_rows, start_ym, end_ym, group_by)
+            print(f"variance by {', '.join(['month'] + group_by)}: {len(rows)} rows in {elapsed:.3f}s")
+
+
+def bench_batch(n_people, n_months, workers, year=2025):
+    """Times batch.run_batch serially and on each worker count, checking the results agree exactly."""
+    end_year, end_month = year + (n_months - 1) // 12, (n_months - 1) % 12 + 1
+    start_ym, end_ym = f"{year}-01", f"{end_year}-{end_month:02d}"
+    with scratch_db(n_people, year):
+        serial, serial_time = timed(batch.run_batch, start_ym, end_ym, [0.0, 0.05, 0.1], 1)
+        print(f"batch {n_people} people x {n_months} months, serial: {serial_time:.3f}s")
+        for count in workers:
+            result, elapsed = timed(batch.run_batch, start_ym, end_ym, [0.0, 0.05, 0.1], count)
+            assert result["forecasts"] == serial["forecasts"], "parallel batch differs from serial"
+            print(f"batch on {result['workers']} workers: {elapsed:.3f}s ({serial_time / elapsed:.1f}x)")
+
+
+def bench_churn(n_people, n_months, trials, year=2025):
+    """Times churn.simulate_churn with a catch-all hazard, checking the seed makes it repeatable."""
+    end_year, end_month = year + (n_months - 1) // 12, (n_months - 1) % 12 + 1
+    start_ym, end_ym = f"{year}-01", f"{end_year}-{end_month:02d}"
+    with scratch_db(n_people, year):
+        conn = utils.get_db_connection()
+        conn.execute("INSERT INTO churn_hazards (annual_rate) VALUES (0.12)")
+        conn.commit()
+        conn.close()
+        result, elapsed = timed(churn.simulate_churn, start_ym, end_ym, trials, 1)
+        again = churn.simulate_churn(start_ym, end_ym, trials, 1, churn.MEMORY_BUDGET // 4)
+        assert again["total"] == result["total"], "churn simulation depends on the chunk size"
+        print(f"churn {trials} trials x {n_people} people x {n_months} months: {elapsed:.3f}s "
+              f"(P50 total {result['total']['p50']:.0f})")
+
+
+def bench_post_costs(n_posts, n_months, year=2025, seed=0):
+    """Times occupancy.post_costs over n_posts posts, one in five vacant, each filled by a different person."""
+    end_year, end_month = year + (n_months - 1) // 12, (n_months - 1) % 12 + 1
+    rng = random.Random(seed)
+    with scratch_db(n_posts, year):
+        conn = utils.get_db_connection()
+        people = conn.execute("SELECT person_id, grade, location FROM people").fetchall()
+        conn.executemany(
+            """
+            INSERT INTO posts (workforce_plan_number, funding_source, post_start_date, post_end_date, person_id,
+                               grade, location)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            """,
+            [(f"WP{i:06d}", rng.choice(["Core", "Project", "Grant"]), f"{year - 1}-{rng.randint(1, 12):02d}-01",
+              rng.choice([None, f"{end_year}-{rng.randint(1, 12):02d}-28"]),
+              person["person_id"] if rng.random() < 0.8 else None, person["grade"], person["location"])
+             for i, person in enumerate(people)],
+        )
+        conn.commit()
+        conn.close()
+        result, elapsed = timed(occupancy.post_costs, f"{year}-01", f"{end_year}-{end_month:02d}")
+        print(f"post costs {result['posts']} posts x {n_months} months: {elapsed:.3f}s")
+
+
+# Startup paths, and the heavy modules each must not load at import time.
+STARTUP_PATHS = {
+    "app": ["matplotlib"],
+    "workforce_forecast": ["flask", "matplotlib"],
+}
+
+
+def _import_in_fresh_interpreter(module):
+    """Seconds a new interpreter takes to import module, and every module then loaded."""
+    code = ("import sys, time; start = time.perf_counter(); "
+            f"{'import ' + module if module else 'pass'}; "
+            "print(time.perf_counter() - start); print(' '.join(sorted(sys.modules)))")
+    output = subprocess.run([sys.executable, "-c", code], cwd=os.path.dirname(os.path.abspath(__file__)),
+                            capture_output=True, text=True, check=True).stdout.splitlines()
+    return float(output[0]), set(output[1].split())
+
+
+def bench_startup(runs=5):
+    """
+    Times a fresh interpreter importing each startup path (best of runs), and
+    fails if one imports a module it should leave until needed.
+    """
+    _, baseline = _import_in_fresh_interpreter(None)
+    for module, forbidden in STARTUP_PATHS.items():
+        timings = [_import_in_fresh_interpreter(module) for _ in range(runs)]
+        loaded = timings[0][1]
+        unwanted = [name for name in forbidden if name in loaded]
+        assert not unwanted, f"importing {module} loads {', '.join(unwanted)}"
+        best = min(elapsed for elapsed, _ in timings)
+        print(f"import {module}: {best * 1000:.0f} ms, {len(loaded - baseline)} modules")
+
+
+def bench_ingest(n_rows):
+    print(f"{'table':>10} {'rows':>8} {'seconds':>8} {'rows/s':>10}")
+    for table in ["people", "posts", "budget", "salaries"]:
+        payload = synthetic.csv_upload(table, n_rows)
+        with scratch_db(0, 2025):
+            conn = utils.get_db_connection()
+            summary, elapsed = timed(ingest_csv, io.BytesIO(payload), table, conn)
+            conn.close()
+        assert summary["accepted"] == n_rows, summary
+        print(f"{table:>10} {n_rows:>8} {elapsed:>8.3f} {n_rows / elapsed:>10.0f}")
+
+
+def bench_metrics(n_people, runs=5, year=2025):
+    """
+    Times run_forecast and a fully materialized month_forecast with the
+    metrics instrumentation disabled and enabled.
+    """
+    enabled = metrics.ENABLED
+    with scratch_db(n_people, year):
+        conn = utils.get_db_connection()
+        forecast_cache.ensure_months(conn, [f"{year}-06"])
+        conn.close()
+        timings = {}
+        try:
+            for metrics.ENABLED in (False, True):
+                # Connections pick their factory when they are opened.
+                database.reset_pool(database.DATABASE_NAME)
+                timings[metrics.ENABLED] = (best_of(runs, utils.run_forecast, year, 6),
+                                            best_of(runs, forecast_cache.month_forecast, year, 6))
+        finally:
+            metrics.ENABLED = enabled
+            metrics.reset()
+    for name, off, on in zip(["run_forecast", "month_forecast"], timings[False], timings[True]):
+        print(f"{name} {n_people} people: {off * 1000:.1f} ms without metrics, {on * 1000:.1f} ms with "
+              f"({(on / off - 1) * 100:+.1f}%)")
+
+
+UPLOAD_ROUTES = {"people": "/upload_people", "posts": "/upload_posts", "budget": "/upload_budget",
+                 "salaries": "/upload_pay"}
+
+
+def best_of(runs, func, *args, setup=None):
+    """The fastest of runs calls to func, in seconds, calling setup before each."""
+    best = None
+    for _ in range(runs):
+        if setup:
+            setup()
+        _, elapsed = timed(func, *args)
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def request(client, method, path, data=None):
+    response = client.open(path, method=method, data=data)
+    response.get_data()  # Drains streamed responses.
+    assert response.status_code == 200, f"{method} {path}: {response.status_code}"
+
+
+def bench_hot_paths(scales, years, runs, output=None, baseline=None, year=2025, seed=0):
+    """
+    Times run_forecast, get_budget, /generate_chart, the CSV uploads and
+    /export_csv on a synthetic plan (people, posts, pay rates and budget
+    over years years) for each number of people in scales. Read paths are
+    the best of runs; each upload of as many rows as there are people is
+    timed once, as it adds to the data. Writes the results to output as
+    JSON, and with baseline, an earlier output, compares against it.
+    """
+    import app  # Only this benchmark needs Flask.
+
+    client = app.app.test_client()
+    results = []
+    for scale in scales:
+        timings = {}
+        with scratch_db(scale, year, seed=seed, years=years, posts=True, budget=True):
+            timings["run_forecast"] = best_of(runs, utils.run_forecast, year, 6)
+            timings["get_budget"] = best_of(runs, utils.get_budget, year, 6)
+            chart = f"/generate_chart?year={year}"
+            # The first chart also materializes the year's forecast (and, at
+            # the first scale, imports matplotlib).
+            timings["generate_chart (first)"] = best_of(1, request, client, "GET", chart)
+            timings["generate_chart (render)"] = best_of(runs, request, client, "GET", chart,
+                                                         setup=charts.chart_cache.clear)
+            timings["generate_chart (cached)"] = best_of(runs, request, client, "GET", chart)
+            timings["export_csv"] = best_of(runs, request, client, "GET", "/export_csv")
+            for table, path in UPLOAD_ROUTES.items():
+                payload = synthetic.csv_upload(table, scale, year, seed)
+                form = {"csv_file": (io.BytesIO(payload), f"{table}.csv")}
+                timings[path] = best_of(1, request, client, "POST", path, form)
+        for name, seconds in timings.items():
+            results.append({"benchmark": name, "scale": scale, "seconds": round(seconds, 6)})
+
+    previous = {}
+    if baseline:
+        with open(baseline) as stream:
+            previous = {(r["benchmark"], r["scale"]): r["seconds"] for r in json.load(stream)["results"]}
+    print(f"{'benchmark':<24} {'people':>8} {'ms':>10} {'baseline':>10} {'change':>7}")
+    for r in results:
+        before = previous.get((r["benchmark"], r["scale"]))
+        compared = f"{before * 1000:>10.3f} {r['seconds'] / before:>6.2f}x" if before else f"{'-':>10} {'-':>7}"
+        print(f"{r['benchmark']:<24} {r['scale']:>8} {r['seconds'] * 1000:>10.3f} {compared}")
+    if output:
+        with open(output, "w") as stream:
+            json.dump({
+                "created": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+                "python": platform.python_version(),
+                "numpy": np.__version__,
+                "platform": platform.platform(),
+                "seed": seed,
+                "years": years,
+                "runs": runs,
+                "results": results,
+            }, stream, indent=2)
+        print(f"results written to {output}")
+
+
+BENCHMARKS = ["startup", "run_forecast", "range", "records", "ingest", "variance", "batch", "post_costs", "churn",
+              "metrics", "hot_paths"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--skip-legacy-above", type=int, default=None,
+                        help="only time the bulk engine above this many people")
+    parser.add_argument("--range-people", type=int, default=50000)
+    parser.add_argument("--range-months", type=int, default=60)
+    parser.add_argument("--ingest-rows", type=int, default=100000)
+    parser.add_argument("--batch-people", type=int, default=100000)
+    parser.add_argument("--batch-months", type=int, default=120)
+    parser.add_argument("--batch-workers", type=int, nargs="+", default=[2, 4, 8])
+    parser.add_argument("--records-people", type=int, default=100000)
+    parser.add_argument("--records-months", type=int, default=12)
+    parser.add_argument("--post-count", type=int, default=30000)
+    parser.add_argument("--post-months", type=int, default=60)
+    parser.add_argument("--churn-people", type=int, default=50000)
+    parser.add_argument("--churn-months", type=int, default=24)
+    parser.add_argument("--churn-trials", type=int, default=10000)
+    parser.add_argument("--variance-people", type=int, default=100000)
+    parser.add_argument("--variance-teams", type=int, default=300)
+    parser.add_argument("--variance-years", type=int, default=3)
+    parser.add_argument("--metrics-people", type=int, default=50000)
+    parser.add_argument("--hot-scales", type=int, nargs="+", default=[1000, 10000, 50000],
+                        help="numbers of people for the hot path benchmark")
+    parser.add_argument("--hot-years", type=int, default=3)
+    parser.add_argument("--hot-runs", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="write the hot path results to this file")
+    parser.add_argument("--baseline", help="compare the hot path results with an earlier --json file")
+    parser.add_argument("--only", nargs="+", choices=BENCHMARKS, help="run only these benchmarks")
+    args = parser.parse_args()
+    benchmarks = {
+        "startup": lambda: bench_startup(),
+        "run_forecast": lambda: bench_run_forecast(args.sizes, skip_legacy_above=args.skip_legacy_above),
+        "range": lambda: bench_run_forecast_range(args.range_people, args.range_months),
+        "records": lambda: bench_records(args.records_people, args.records_months),
+        "ingest": lambda: bench_ingest(args.ingest_rows),
+        "variance": lambda: bench_variance(args.variance_people, args.variance_teams, args.variance_years),
+        "batch": lambda: bench_batch(args.batch_people, args.batch_months, args.batch_workers),
+        "post_costs": lambda: bench_post_costs(args.post_count, args.post_months),
+        "churn": lambda: bench_churn(args.churn_people, args.churn_months, args.churn_trials),
+        "metrics": lambda: bench_metrics(args.metrics_people),
+        "hot_paths": lambda: bench_hot_paths(args.hot_scales, args.hot_years, args.hot_runs, args.json,
+                                             args.baseline, seed=args.seed),
+    }
+    for name in args.only or BENCHMARKS:
+        benchmarks[name]()
+
+
+if __name__ == "__main__":
+    main()
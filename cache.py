@@ -0,0 +1,75 @@
+"""A small thread-safe LRU cache with hit/miss statistics."""
+
+import threading
+from collections import OrderedDict
+
+_MISSING = object()
+
+
+class LRUCache:
+    """
+    Keeps up to maxsize entries, evicting the least recently used first. With
+    maxbytes set, values must support len() and the least recently used are
+    also evicted until their combined length fits.
+    """
+
+    def __init__(self, maxsize=1024, maxbytes=None):
+        self.maxsize = maxsize
+        self.maxbytes = maxbytes
+        self.bytes = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            value = self._data.get(key, _MISSING)
+            if value is _MISSING:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            if self.maxbytes is not None:
+                if len(value) > self.maxbytes:
+                    return
+                previous = self._data.get(key, _MISSING)
+                if previous is not _MISSING:
+                    self.bytes -= len(previous)
+                self.bytes += len(value)
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize or (self.maxbytes is not None and self.bytes > self.maxbytes):
+                _, evicted = self._data.popitem(last=False)
+                if self.maxbytes is not None:
+                    self.bytes -= len(evicted)
+                self.evictions += 1
+
+    def clear(self):
+        """Drops every entry; the counters are kept."""
+        with self._lock:
+            self._data.clear()
+            self.bytes = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            stats = {
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+            if self.maxbytes is not None:
+                stats.update(bytes=self.bytes, maxbytes=self.maxbytes)
+            return stats
@@ -0,0 +1,100 @@
+"""
+Rendering and caching of the monthly forecast chart.
+
+Charts are drawn with matplotlib's object-oriented Figure API, which keeps no
+global state, on a small pool of worker threads. Rendered images are cached by
+(year, data version, width, height, format); the data version changes on
+every write, so a cached chart is never stale and repeat requests cost a
+dictionary lookup.
+
+matplotlib is imported by the first render rather than with this module, so
+the app and scripts that import it start without paying for matplotlib.
+"""
+
+import io
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from cache import LRUCache
+
+FORMATS = {"png": "image/png", "svg": "image/svg+xml"}
+
+DEFAULT_WIDTH = 640
+DEFAULT_HEIGHT = 480
+MIN_SIZE = 200
+MAX_SIZE = 2000
+DPI = 100
+
+RENDER_WORKERS = int(os.environ.get("WORKFORCE_CHART_WORKERS", "2"))
+
+chart_cache = LRUCache(maxsize=256, maxbytes=32 * 1024 * 1024)
+
+_executor = ThreadPoolExecutor(max_workers=RENDER_WORKERS, thread_name_prefix="chart")
+# Renders in progress, so concurrent requests for the same chart share one.
+_pending = {}
+_pending_lock = threading.Lock()
+
+
+def clamp_size(value, default):
+    """Parses a pixel dimension, falling back to default and clamping to the allowed range."""
+    try:
+        value = int(value)
+    except (TypeError, ValueError):
+        return default
+    return max(MIN_SIZE, min(MAX_SIZE, value))
+
+
+def render_chart(year, costs, budgets, width=DEFAULT_WIDTH, height=DEFAULT_HEIGHT, fmt="png"):
+    """Draws monthly forecast costs (and budgets, if any) and returns the image bytes."""
+    from matplotlib.figure import Figure
+
+    months = list(range(1, 13))
+    fig = Figure(figsize=(width / DPI, height / DPI), dpi=DPI)
+    ax = fig.subplots()
+    ax.plot(months, costs, marker='o', label='Forecast Cost')
+    if any(budgets):
+        ax.plot(months, budgets, marker='x', label='Allocated Budget')
+    ax.set_title(f"Monthly Workforce Cost Forecast for {year}")
+    ax.set_xlabel("Month")
+    ax.set_ylabel("Cost")
+    ax.legend()
+    ax.grid(True)
+
+    img = io.BytesIO()
+    fig.savefig(img, format=fmt)
+    return img.getvalue()
+
+
+def get_chart(year, data_version, width, height, fmt, load):
+    """
+    Returns the cached chart for these arguments, rendering it on the worker
+    pool if needed. load() is called in the caller's thread, and only on a
+    cache miss, to fetch (costs, budgets). Concurrent misses for the same
+    chart wait for the first one rather than loading and rendering it again.
+    """
+    key = (year, data_version, width, height, fmt)
+    image = chart_cache.get(key)
+    if image is not None:
+        return image
+    with _pending_lock:
+        pending = _pending.get(key)
+        if pending is None:
+            pending = _pending[key] = Future()
+            owner = True
+        else:
+            owner = False
+    if not owner:
+        return pending.result()
+    try:
+        costs, budgets = load()
+        image = _executor.submit(render_chart, year, costs, budgets, width, height, fmt).result()
+        chart_cache.put(key, image)
+        pending.set_result(image)
+        return image
+    except BaseException as exc:
+        pending.set_exception(exc)
+        raise
+    finally:
+        with _pending_lock:
+            del _pending[key]
@@ -0,0 +1,179 @@
+"""
+Monte Carlo churn simulation.
+
+Rather than discounting every cost by the flat churn_rate parameter, each
+trial draws a leaving month for every person from a monthly hazard that
+depends on their grade, location and contract type (see churn_hazards), and
+costs them only up to it. simulate_churn returns P10/P50/P90 bands of the
+monthly and total cost across trials.
+
+A person in post for a whole month always costs their grade and location's
+planning rate, so for those months a trial only needs to know how many people
+of each grade and location are still in post. Each person's run of whole
+months goes into a difference array, and the at most two part months at
+either end are handled individually. Each trial starts from the cost with
+nobody leaving and subtracts only what its leavers lose, so it costs one
+uniform draw per person plus work in proportion to the leavers, rather than
+O(people x months). Trials are drawn in chunks sized to fit memory_budget,
+and the draws do not depend on the chunk size, so a seed always gives the
+same result.
+"""
+
+import numpy as np
+
+from records import load_people
+from utils import cost_components, get_db_connection, month_range
+
+DEFAULT_TRIALS = 1000
+MAX_TRIALS = 100000
+MEMORY_BUDGET = 256 * 1024 * 1024
+# Working memory per person per trial in a chunk, in bytes.
+BYTES_PER_DRAW = 16
+PERCENTILES = (10, 50, 90)
+
+
+def load_hazards(conn):
+    return conn.execute("SELECT * FROM churn_hazards ORDER BY hazard_id").fetchall()
+
+
+def monthly_hazard(hazards, grade, location, contract_type):
+    """
+    The probability of leaving in any one month for a person of this grade,
+    location and contract type, converted from the annual rate of the most
+    specific matching churn_hazards row (the earliest wins ties). 0 when no
+    row matches.
+    """
+    best = None
+    best_score = -1
+    for row in hazards:
+        fields = ((row["grade"], grade), (row["location"], location), (row["contract_type"], contract_type))
+        if any(value is not None and value != actual for value, actual in fields):
+            continue
+        score = sum(value is not None for value, _ in fields)
+        if score > best_score:
+            best, best_score = row, score
+    if best is None:
+        return 0.0
+    annual_rate = min(max(best["annual_rate"], 0.0), 1.0)
+    return 1 - (1 - annual_rate) ** (1 / 12)
+
+
+def simulate_churn(start_ym, end_ym, trials=DEFAULT_TRIALS, seed=None, memory_budget=MEMORY_BUDGET, conn=None):
+    """
+    Simulates trials forecasts from start_ym to end_ym with people leaving at
+    random. Returns the months, the seed used (pass it back to repeat a run),
+    P10/P50/P90 of each month's cost and of the total, the mean total, and
+    the total with nobody leaving.
+    """
+    year_months = [f"{year}-{month:02d}" for year, month in month_range(start_ym, end_ym)]
+    n_months = len(year_months)
+    trials = max(1, min(int(trials), MAX_TRIALS))
+    if seed is None:
+        seed = int(np.random.SeedSequence().entropy % 2**32)
+    own_connection = conn is None
+    if own_connection:
+        conn = get_db_connection()
+    people = load_people(conn)
+    rate_matrix, fraction, paid = cost_components(people, year_months, conn)
+    hazards = load_hazards(conn)
+    if own_connection:
+        conn.close()
+
+    # Only people who are paid and in post at some point can cost anything.
+    in_post = fraction > 0
+    kept = np.nonzero(paid & in_post.any(axis=1))[0]
+    people = [people[i] for i in kept]
+    rate_matrix, fraction, in_post = rate_matrix[kept], fraction[kept], in_post[kept]
+    n_people = len(people)
+
+    kinds = {}
+    kind_index = np.array([kinds.setdefault((p.grade, p.location, p.contract_type), len(kinds))
+                           for p in people], dtype=np.intp)
+    hazard = np.array([monthly_hazard(hazards, *kind) for kind in kinds])[kind_index]
+    keys = {}
+    key_index = np.array([keys.setdefault((p.grade, p.location), len(keys)) for p in people], dtype=np.intp)
+    n_keys = len(keys)
+    key_rates = np.zeros((n_keys, n_months))
+    key_rates[key_index] = rate_matrix
+
+    # Each person's first month in post, from which they may leave, the month
+    # after their last, and their run of whole months [full_start, full_end).
+    # A month without working days inside the run costs nothing for anyone
+    # at that location, so it stays in the run at a zero rate.
+    first = in_post.argmax(axis=1)
+    stop = n_months - in_post[:, ::-1].argmax(axis=1)
+    full = fraction == 1.0
+    has_full = full.any(axis=1)
+    full_start = np.where(has_full, full.argmax(axis=1), 0)
+    full_end = np.where(has_full, n_months - full[:, ::-1].argmax(axis=1), 0)
+    months = np.arange(n_months)
+    gaps = (months >= full_start[:, None]) & (months < full_end[:, None]) & ~full
+    gap_person, gap_month = np.nonzero(gaps)
+    key_rates[key_index[gap_person], gap_month] = 0.0
+
+    # The at most two part months at the ends of each person's time in post,
+    # padded with month n_months at no cost.
+    part_person, part_month = np.nonzero(in_post & ~full & ~gaps)
+    slot = np.arange(len(part_person)) - np.searchsorted(part_person, part_person)
+    part_months = np.full((n_people, 2), n_months)
+    part_costs = np.zeros((n_people, 2))
+    part_months[part_person, slot] = part_month
+    part_costs[part_person, slot] = rate_matrix[part_person, part_month] * fraction[part_person, part_month]
+
+    # Cost with nobody leaving; each trial subtracts what its leavers lose.
+    run_counts = np.zeros((n_keys, n_months + 1))
+    np.add.at(run_counts, (key_index, full_start), 1.0)
+    np.add.at(run_counts, (key_index, full_end), -1.0)
+    no_churn = (np.cumsum(run_counts, axis=1)[:, :n_months] * key_rates).sum(axis=0)
+    no_churn += np.bincount(part_months.ravel(), weights=part_costs.ravel(), minlength=n_months + 1)[:n_months]
+
+    # A person leaves before stop with probability 1 - (1 - hazard)^(stop -
+    # first), so only draws under that threshold need a leaving month. The
+    # threshold is widened a little so float rounding never drops a leaver;
+    # anyone let through who does not leave in time loses nothing.
+    leaving = hazard > 0
+    log_stay = np.log1p(-np.where(leaving, hazard, 0.5)).astype(np.float32)
+    threshold = np.where(leaving, -np.expm1((stop - first) * log_stay.astype(np.float64)) * (1 + 1e-6) + 1e-7, -1.0)
+    threshold = threshold.astype(np.float32)
+
+    rng = np.random.default_rng(seed)
+    chunk = int(max(1, min(trials, memory_budget // (BYTES_PER_DRAW * max(n_people, 1)))))
+    cells_per_trial = n_keys * (n_months + 1)
+    totals = np.empty((trials, n_months))
+    for lo in range(0, trials, chunk):
+        n = min(chunk, trials - lo)
+        draws = rng.random((n, n_people), dtype=np.float32)
+        trial, person = np.nonzero(draws < threshold)
+        # Whole months in post before leaving, geometric in the monthly hazard.
+        stayed = np.floor(np.log1p(-draws[trial, person]) / log_stay[person])
+        del draws
+        leave = np.minimum(first[person] + stayed, n_months).astype(np.intp)
+
+        # Whole months lost: [max(leave, full_start), full_end).
+        cells = trial * cells_per_trial + key_index[person] * (n_months + 1)
+        lost = np.bincount(cells + np.clip(leave, full_start[person], full_end[person]), minlength=n * cells_per_trial)
+        lost -= np.bincount(cells + full_end[person], minlength=n * cells_per_trial)
+        lost_counts = np.cumsum(lost.reshape(n, n_keys, n_months + 1), axis=2)[:, :, :n_months]
+        chunk_totals = no_churn - np.einsum("tkm,km->tm", lost_counts, key_rates)
+
+        # Part months lost.
+        for end in (0, 1):
+            month = part_months[person, end]
+            chunk_totals -= np.bincount(trial * (n_months + 1) + month,
+                                        weights=part_costs[person, end] * (month >= leave),
+                                        minlength=n * (n_months + 1)).reshape(n, n_months + 1)[:, :n_months]
+        totals[lo:lo + n] = chunk_totals
+
+    horizon = totals.sum(axis=1)
+    monthly = np.percentile(totals, PERCENTILES, axis=0)
+    total = np.percentile(horizon, PERCENTILES)
+    return {
+        "months": year_months,
+        "trials": trials,
+        "seed": seed,
+        "people": n_people,
+        "monthly": {f"p{q}": row.tolist() for q, row in zip(PERCENTILES, monthly)},
+        "total": {f"p{q}": float(value) for q, value in zip(PERCENTILES, total)},
+        "mean_total": float(horizon.mean()),
+        "no_churn_total": float(no_churn.sum()),
+    }
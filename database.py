@@ -1,78 +1,621 @@
 """Database utilities for the workforce modeling application."""
 
+import os
 import sqlite3
+import threading
+import time
 from sqlite3 import Connection
 
-DATABASE_NAME = 'workforce.db'
-
-
-SCHEMA = [
-    '''
-    CREATE TABLE IF NOT EXISTS people (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        name TEXT NOT NULL,
-        grade TEXT,
-        location TEXT,
-        contract_type TEXT,
-        status TEXT,
-        start_date TEXT,
-        end_date TEXT
-    );
-    ''',
-    '''
-    CREATE TABLE IF NOT EXISTS posts (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        name TEXT,
-        start_date TEXT,
-        end_date TEXT,
-        funding_source TEXT,
-        occupant_id INTEGER,
-        FOREIGN KEY(occupant_id) REFERENCES people(id)
-    );
-    ''',
-    '''
-    CREATE TABLE IF NOT EXISTS salary_rates (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        grade TEXT NOT NULL,
-        location TEXT NOT NULL,
-        planning_rate REAL NOT NULL
-    );
-    ''',
-    '''
-    CREATE TABLE IF NOT EXISTS budgets (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        team TEXT,
-        start_date TEXT,
-        end_date TEXT,
-        amount REAL NOT NULL
-    );
-    ''',
-    '''
-    CREATE TABLE IF NOT EXISTS parameters (
-        name TEXT PRIMARY KEY,
-        value TEXT
-    );
-    '''
+import metrics
+
+DATABASE_NAME = os.environ.get('WORKFORCE_DB', 'workforce_model.db')
+POOL_SIZE = int(os.environ.get('WORKFORCE_DB_POOL_SIZE', '8'))
+
+# Applied to every pooled connection. WAL lets readers run alongside a writer,
+# and NORMAL sync is safe under WAL while avoiding an fsync per commit.
+PRAGMAS = [
+    'PRAGMA journal_mode=WAL',
+    'PRAGMA synchronous=NORMAL',
+    'PRAGMA busy_timeout=5000',
+    'PRAGMA temp_store=MEMORY',
+    'PRAGMA cache_size=-20000',
 ]
 
 
+# Each entry is (description, statements) and takes the database to the next
+# schema version, recorded in PRAGMA user_version. Append new migrations;
+# never edit one that has shipped. The first three use IF NOT EXISTS so that
+# databases created by earlier releases of init_db.py upgrade in place.
+MIGRATIONS = [
+    ('base tables', [
+        '''
+        CREATE TABLE IF NOT EXISTS people (
+            person_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            team TEXT,
+            grade TEXT NOT NULL,
+            work_stream TEXT,
+            location TEXT NOT NULL,
+            contract_type TEXT,
+            status TEXT,
+            start_date TEXT,           -- Format: YYYY-MM-DD
+            expected_end_date TEXT     -- Format: YYYY-MM-DD
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS posts (
+            post_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            workforce_plan_number TEXT,
+            funding_source TEXT,
+            post_start_date TEXT,      -- Format: YYYY-MM-DD
+            post_end_date TEXT,        -- Format: YYYY-MM-DD
+            person_id INTEGER,
+            FOREIGN KEY (person_id) REFERENCES people(person_id)
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS salaries (
+            salary_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            grade TEXT NOT NULL,
+            location TEXT NOT NULL,
+            year_month TEXT,            -- Format: "YYYY-MM"
+            monthly_planning_rate REAL
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS budget (
+            budget_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            team TEXT,
+            work_stream TEXT,
+            year_month TEXT,            -- Format: "YYYY-MM"
+            allocated_budget REAL
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS parameters (
+            parameter_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            param_name TEXT,
+            param_value REAL
+        )
+        ''',
+    ]),
+    ('public holidays', [
+        '''
+        CREATE TABLE IF NOT EXISTS public_holidays (
+            holiday_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            location TEXT,              -- NULL applies to every location
+            holiday_date TEXT NOT NULL, -- Format: YYYY-MM-DD
+            name TEXT
+        )
+        ''',
+    ]),
+    ('unique pay rate per grade, location and month', [
+        # Keep the first of any duplicates, which is the one forecasts used.
+        '''
+        DELETE FROM salaries
+        WHERE salary_id NOT IN (
+            SELECT MIN(salary_id) FROM salaries GROUP BY grade, location, year_month
+        )
+        ''',
+        '''
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_salaries_key
+        ON salaries (grade, location, year_month)
+        ''',
+    ]),
+    ('covering indexes for forecast lookups', [
+        '''
+        CREATE INDEX idx_salaries_month
+        ON salaries (year_month, grade, location, monthly_planning_rate)
+        ''',
+        'CREATE INDEX idx_budget_month ON budget (year_month, allocated_budget)',
+        'CREATE INDEX idx_parameters_name ON parameters (param_name, param_value)',
+    ]),
+    ('materialized forecast', [
+        # Pre-churn cost per person per month, for every month listed in
+        # forecast_cache_months. See forecast_cache.py.
+        '''
+        CREATE TABLE forecast_cache (
+            person_id INTEGER NOT NULL,
+            year_month TEXT NOT NULL,   -- Format: "YYYY-MM"
+            cost REAL NOT NULL,
+            PRIMARY KEY (person_id, year_month)
+        ) WITHOUT ROWID
+        ''',
+        'CREATE INDEX idx_forecast_cache_month ON forecast_cache (year_month, cost)',
+        'CREATE TABLE forecast_cache_months (year_month TEXT PRIMARY KEY) WITHOUT ROWID',
+        # Finds the people a changed planning rate applies to.
+        'CREATE INDEX idx_people_grade_location ON people (grade, location)',
+    ]),
+    ('keyset pagination indexes', [
+        # One per filterable/sortable column in pagination.LISTINGS, on the
+        # same IFNULL expression the listing queries use.
+        "CREATE INDEX idx_people_list_name ON people (IFNULL(name, ''), person_id)",
+        "CREATE INDEX idx_people_list_team ON people (IFNULL(team, ''), person_id)",
+        "CREATE INDEX idx_people_list_grade ON people (IFNULL(grade, ''), person_id)",
+        "CREATE INDEX idx_people_list_location ON people (IFNULL(location, ''), person_id)",
+        "CREATE INDEX idx_people_list_status ON people (IFNULL(status, ''), person_id)",
+        "CREATE INDEX idx_people_list_start_date ON people (IFNULL(start_date, ''), person_id)",
+        "CREATE INDEX idx_posts_list_number ON posts (IFNULL(workforce_plan_number, ''), post_id)",
+        "CREATE INDEX idx_posts_list_funding ON posts (IFNULL(funding_source, ''), post_id)",
+        "CREATE INDEX idx_posts_list_start_date ON posts (IFNULL(post_start_date, ''), post_id)",
+        "CREATE INDEX idx_budget_list_team ON budget (IFNULL(team, ''), budget_id)",
+        "CREATE INDEX idx_budget_list_work_stream ON budget (IFNULL(work_stream, ''), budget_id)",
+        "CREATE INDEX idx_budget_list_month ON budget (IFNULL(year_month, ''), budget_id)",
+        "CREATE INDEX idx_salaries_list_grade ON salaries (IFNULL(grade, ''), salary_id)",
+        "CREATE INDEX idx_salaries_list_location ON salaries (IFNULL(location, ''), salary_id)",
+        "CREATE INDEX idx_salaries_list_month ON salaries (IFNULL(year_month, ''), salary_id)",
+    ]),
+    ('data version counter', [
+        # A single row, bumped after every write so that clients and caches
+        # can tell whether anything changed. See bump_data_version.
+        '''
+        CREATE TABLE data_version (
+            version INTEGER NOT NULL,
+            updated_at TEXT NOT NULL    -- ISO 8601, UTC
+        )
+        ''',
+        "INSERT INTO data_version (version, updated_at) VALUES (1, strftime('%Y-%m-%dT%H:%M:%SZ', 'now'))",
+    ]),
+    ('forecast totals by team and work stream', [
+        # The materialized forecast summed per month, team and work stream,
+        # kept in step with forecast_cache, and the team and work stream each
+        # person's rows were summed under. NULLs are stored as ''.
+        '''
+        CREATE TABLE forecast_cache_groups (
+            year_month TEXT NOT NULL,
+            team TEXT NOT NULL,
+            work_stream TEXT NOT NULL,
+            cost REAL NOT NULL,
+            PRIMARY KEY (year_month, team, work_stream)
+        ) WITHOUT ROWID
+        ''',
+        '''
+        CREATE TABLE forecast_cache_people (
+            person_id INTEGER PRIMARY KEY,
+            team TEXT NOT NULL,
+            work_stream TEXT NOT NULL
+        )
+        ''',
+        'CREATE INDEX idx_budget_month_group ON budget (year_month, team, work_stream, allocated_budget)',
+        # Months materialized before this migration have no group totals;
+        # drop them so they are recomputed on the next read.
+        'DELETE FROM forecast_cache',
+        'DELETE FROM forecast_cache_months',
+    ]),
+    ('what-if scenarios', [
+        # A scenario records only its differences from the base tables. See
+        # scenarios.py.
+        '''
+        CREATE TABLE scenarios (
+            scenario_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL UNIQUE,
+            description TEXT,
+            churn_rate REAL             -- NULL uses the churn_rate parameter
+        )
+        ''',
+        '''
+        CREATE TABLE scenario_people (
+            change_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            scenario_id INTEGER NOT NULL,
+            action TEXT NOT NULL CHECK (action IN ('add', 'modify', 'remove')),
+            person_id INTEGER,          -- The base person modified or removed
+            headcount INTEGER NOT NULL DEFAULT 1,
+            -- For 'add', the new people; for 'modify', the fields that change
+            -- (NULL leaves the base value).
+            name TEXT,
+            team TEXT,
+            grade TEXT,
+            work_stream TEXT,
+            location TEXT,
+            contract_type TEXT,
+            status TEXT,
+            start_date TEXT,            -- Format: YYYY-MM-DD
+            expected_end_date TEXT,     -- Format: YYYY-MM-DD
+            FOREIGN KEY (scenario_id) REFERENCES scenarios(scenario_id)
+        )
+        ''',
+        'CREATE INDEX idx_scenario_people ON scenario_people (scenario_id, change_id)',
+        '''
+        CREATE TABLE scenario_rates (
+            multiplier_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            scenario_id INTEGER NOT NULL,
+            grade TEXT,                 -- NULL matches every grade
+            location TEXT,              -- NULL matches every location
+            start_month TEXT,           -- Format: "YYYY-MM"; NULL is open-ended
+            end_month TEXT,             -- Format: "YYYY-MM"; NULL is open-ended
+            multiplier REAL NOT NULL,
+            FOREIGN KEY (scenario_id) REFERENCES scenarios(scenario_id)
+        )
+        ''',
+        'CREATE INDEX idx_scenario_rates ON scenario_rates (scenario_id, multiplier_id)',
+    ]),
+    ('churn hazard rates', [
+        # Annual leaving rates for the Monte Carlo churn simulation. The most
+        # specific matching row applies; see churn.monthly_hazard.
+        '''
+        CREATE TABLE churn_hazards (
+            hazard_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            grade TEXT,                 -- NULL matches every grade
+            location TEXT,              -- NULL matches every location
+            contract_type TEXT,         -- NULL matches every contract type
+            annual_rate REAL NOT NULL   -- Fraction of people leaving per year
+        )
+        ''',
+    ]),
+    ('post grade, location and interval index', [
+        # Vacant post-months are costed at the post's own grade and location.
+        'ALTER TABLE posts ADD COLUMN grade TEXT',
+        'ALTER TABLE posts ADD COLUMN location TEXT',
+        # Posts still open at the start of a range, by end then start date,
+        # with missing or empty dates open-ended; see occupancy.post_costs.
+        '''
+        CREATE INDEX idx_posts_interval ON posts (
+            IFNULL(NULLIF(post_end_date, ''), '9999-12-31'), IFNULL(NULLIF(post_start_date, ''), '0001-01-01')
+        )
+        ''',
+    ]),
+    ('background jobs', [
+        # Uploads and long forecasts queued for the worker threads; see jobs.py.
+        '''
+        CREATE TABLE jobs (
+            job_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            kind TEXT NOT NULL,         -- 'upload' or 'forecast'
+            params TEXT NOT NULL,       -- JSON
+            input BLOB,                 -- The uploaded file, dropped when the job finishes
+            status TEXT NOT NULL DEFAULT 'queued'
+                CHECK (status IN ('queued', 'running', 'done', 'failed')),
+            progress REAL NOT NULL DEFAULT 0,   -- 0 to 1
+            message TEXT,
+            result TEXT,                -- JSON summary
+            output BLOB,                -- Downloadable result
+            output_name TEXT,
+            output_type TEXT,
+            created_at TEXT NOT NULL,   -- ISO 8601, UTC
+            started_at TEXT,
+            finished_at TEXT
+        )
+        ''',
+        'CREATE INDEX idx_jobs_status ON jobs (status, job_id)',
+    ]),
+    ('job owners and heartbeats', [
+        # The worker running a job (host:pid:random) and when it last said
+        # so; jobs whose heartbeat stops are queued again. See jobs.py.
+        'ALTER TABLE jobs ADD COLUMN owner TEXT',
+        'ALTER TABLE jobs ADD COLUMN heartbeat_at TEXT',
+    ]),
+]
+
+# Queries on the forecast hot path, with representative parameters. Each must
+# be answered from an index; check_query_plans fails if one falls back to a
+# full table scan.
+HOT_QUERIES = {
+    'planning rates for months': (
+        '''
+        SELECT grade, location, year_month, monthly_planning_rate
+        FROM salaries WHERE year_month IN (?, ?) ORDER BY salary_id
+        ''',
+        ('2025-01', '2025-02'),
+    ),
+    'budget for month': (
+        'SELECT SUM(allocated_budget) FROM budget WHERE year_month = ?',
+        ('2025-01',),
+    ),
+    'budget for month range': (
+        '''
+        SELECT year_month, SUM(allocated_budget) FROM budget
+        WHERE year_month BETWEEN ? AND ? GROUP BY year_month
+        ''',
+        ('2025-01', '2025-12'),
+    ),
+    'forecast totals for month range': (
+        '''
+        SELECT year_month, SUM(cost) FROM forecast_cache_groups
+        WHERE year_month BETWEEN ? AND ? GROUP BY year_month
+        ''',
+        ('2025-01', '2025-12'),
+    ),
+    'budget by team and work stream for month range': (
+        '''
+        SELECT year_month, IFNULL(team, ''), IFNULL(work_stream, ''), SUM(allocated_budget)
+        FROM budget WHERE year_month BETWEEN ? AND ?
+        GROUP BY year_month, IFNULL(team, ''), IFNULL(work_stream, '')
+        ''',
+        ('2025-01', '2025-12'),
+    ),
+    'posts open in date range with occupants': (
+        '''
+        SELECT posts.post_id, people.person_id FROM posts
+        LEFT JOIN people ON people.person_id = posts.person_id
+        WHERE IFNULL(NULLIF(posts.post_end_date, ''), '9999-12-31') >= ?
+          AND IFNULL(NULLIF(posts.post_start_date, ''), '0001-01-01') <= ?
+        ''',
+        ('2025-01-01', '2029-12-31'),
+    ),
+    'next queued job': (
+        "SELECT job_id FROM jobs WHERE status = 'queued' ORDER BY job_id LIMIT 1",
+        (),
+    ),
+    'running jobs without a recent heartbeat': (
+        "SELECT job_id, owner FROM jobs WHERE status = 'running' AND IFNULL(heartbeat_at, '') < ?",
+        ('2025-01-01T00:00:00Z',),
+    ),
+    'people page, ties on sort value': (
+        '''
+        SELECT * FROM people WHERE IFNULL(name, '') = ? AND person_id > ?
+        ORDER BY person_id LIMIT 101
+        ''',
+        ('Person 1', 1),
+    ),
+    'people page after sort value': (
+        '''
+        SELECT * FROM people WHERE IFNULL(name, '') > ?
+        ORDER BY IFNULL(name, ''), person_id LIMIT 101
+        ''',
+        ('Person 1',),
+    ),
+    'people page filtered by team': (
+        '''
+        SELECT * FROM people WHERE IFNULL(team, '') = ? AND person_id > ?
+        ORDER BY person_id LIMIT 101
+        ''',
+        ('Team 1', 1),
+    ),
+    'parameter by name': (
+        'SELECT param_value FROM parameters WHERE param_name = ? LIMIT 1',
+        ('churn_rate',),
+    ),
+}
+
+
 def get_connection():
     """Return a connection to the SQLite database."""
     conn = sqlite3.connect(DATABASE_NAME)
     return conn
 
 
-def init_db(conn: Connection | None = None) -> None:
-    """Create required tables if they do not exist."""
+def schema_version(conn: Connection) -> int:
+    """Return the number of migrations applied to the database."""
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+
+def get_data_version(conn: Connection) -> tuple[int, str]:
+    """Return the data version and when it last changed (ISO 8601, UTC)."""
+    row = conn.execute('SELECT version, updated_at FROM data_version').fetchone()
+    return row[0], row[1]
+
+
+def bump_data_version(conn: Connection) -> int:
+    """Record that the data changed; returns the new version."""
+    conn.execute(
+        "UPDATE data_version SET version = version + 1, updated_at = strftime('%Y-%m-%dT%H:%M:%SZ', 'now')"
+    )
+    conn.commit()
+    return get_data_version(conn)[0]
+
+
+def migrate(conn: Connection | None = None) -> list[str]:
+    """
+    Apply any pending migrations, each in its own transaction.
+
+    Returns the descriptions of the migrations that were applied.
+    """
     close = False
     if conn is None:
         conn = get_connection()
         close = True
 
-    cur = conn.cursor()
-    for ddl in SCHEMA:
-        cur.executescript(ddl)
-    conn.commit()
+    applied = []
+    try:
+        for version, (description, statements) in enumerate(MIGRATIONS, start=1):
+            if version <= schema_version(conn):
+                continue
+            conn.execute('BEGIN')
+            try:
+                for statement in statements:
+                    conn.execute(statement)
+                conn.execute(f'PRAGMA user_version = {version}')
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            applied.append(description)
+    finally:
+        if close:
+            conn.close()
+    return applied
+
+
+def init_db(conn: Connection | None = None) -> None:
+    """Create required tables and indexes if they do not exist."""
+    migrate(conn)
+
+
+def check_query_plans(conn: Connection) -> list[str]:
+    """
+    Run EXPLAIN QUERY PLAN over HOT_QUERIES.
+
+    Returns one message per query that scans a table (or a whole index)
+    instead of searching an index; an empty list means every hot query is
+    indexed.
+    """
+    problems = []
+    for name, (sql, params) in HOT_QUERIES.items():
+        for row in conn.execute(f'EXPLAIN QUERY PLAN {sql}', params):
+            detail = row[-1]
+            if detail.startswith('SCAN'):
+                problems.append(f'{name}: {detail}')
+    return problems
+
+
+class PoolTimeout(sqlite3.OperationalError):
+    """Raised when no pooled connection became free within the timeout."""
+
 
-    if close:
+class PooledConnection:
+    """
+    Wraps a pooled sqlite3 connection. close() hands the connection back to
+    the pool instead of closing it; everything else is passed through.
+    """
+
+    def __init__(self, pool: 'ConnectionPool', conn: Connection, owned: bool = True):
+        self._pool = pool
+        self._conn = conn
+        self._owned = owned
+
+    def __getattr__(self, name):
+        if self._conn is None:
+            raise sqlite3.ProgrammingError('Cannot operate on a closed database.')
+        return getattr(self._conn, name)
+
+    def __enter__(self):
+        return self._conn.__enter__()
+
+    def __exit__(self, *exc_info):
+        return self._conn.__exit__(*exc_info)
+
+    def close(self) -> None:
+        conn, self._conn = self._conn, None
+        if conn is not None and self._owned:
+            self._pool.release(conn)
+
+    def __del__(self):
+        if getattr(self, '_conn', None) is not None and self._owned:
+            self._pool.discard_leaked(self._conn)
+
+
+class ConnectionPool:
+    """
+    A bounded pool of SQLite connections.
+
+    Inside a scope (see begin_scope) every acquire() on the same thread shares
+    one connection, which goes back to the pool when the scope ends; the Flask
+    app opens a scope per request. Outside a scope each acquire() checks out
+    its own connection until close() is called on it.
+    """
+
+    def __init__(self, database: str = DATABASE_NAME, max_size: int = POOL_SIZE, timeout: float = 10.0):
+        self.database = database
+        self.max_size = max_size
+        self.timeout = timeout
+        self._idle: list[Connection] = []
+        self._created = 0
+        self._in_use = 0
+        self._waits = 0
+        self._leaks = 0
+        self._lock = threading.RLock()
+        self._available = threading.Condition(self._lock)
+        self._local = threading.local()
+
+    def _connect(self) -> Connection:
+        conn = sqlite3.connect(self.database, check_same_thread=False, factory=metrics.connection_factory())
+        conn.row_factory = sqlite3.Row
+        for pragma in PRAGMAS:
+            conn.execute(pragma)
+        return conn
+
+    def _checkout(self) -> Connection:
+        with self._lock:
+            if not self._idle and self._created >= self.max_size:
+                self._waits += 1
+                deadline = time.monotonic() + self.timeout
+                while not self._idle and self._created >= self.max_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise PoolTimeout(f'No database connection free after {self.timeout}s')
+                    self._available.wait(remaining)
+            self._in_use += 1
+            if self._idle:
+                return self._idle.pop()
+            self._created += 1
+        try:
+            return self._connect()
+        except Exception:
+            with self._lock:
+                self._created -= 1
+                self._in_use -= 1
+                self._available.notify()
+            raise
+
+    def acquire(self, dedicated: bool = False) -> PooledConnection:
+        """
+        Return a connection; close() it when done. A dedicated connection is
+        never the shared scope connection, for work that outlives the scope
+        such as a streamed response.
+        """
+        scope = getattr(self._local, 'scope', None)
+        if scope is None or dedicated:
+            return PooledConnection(self, self._checkout())
+        if not scope:
+            scope.append(self._checkout())
+        return PooledConnection(self, scope[0], owned=False)
+
+    def release(self, conn: Connection) -> None:
+        """Return a checked-out connection, rolling back anything uncommitted."""
+        if conn.in_transaction:
+            conn.rollback()
+        with self._lock:
+            self._in_use -= 1
+            self._idle.append(conn)
+            self._available.notify()
+
+    def discard_leaked(self, conn: Connection) -> None:
+        """Drop a connection that was garbage collected without being closed."""
+        with self._lock:
+            self._leaks += 1
+            self._in_use -= 1
+            self._created -= 1
+            self._available.notify()
         conn.close()
+
+    def begin_scope(self) -> None:
+        self._local.scope = []
+
+    def end_scope(self) -> None:
+        scope = getattr(self._local, 'scope', None)
+        self._local.scope = None
+        if scope:
+            self.release(scope[0])
+
+    def close(self) -> None:
+        """Close the idle connections; checked-out ones close as they come back."""
+        with self._lock:
+            idle, self._idle = self._idle, []
+            self._created -= len(idle)
+        for conn in idle:
+            conn.close()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'database': self.database,
+                'max_size': self.max_size,
+                'created': self._created,
+                'in_use': self._in_use,
+                'idle': len(self._idle),
+                'waits': self._waits,
+                'leaks': self._leaks,
+            }
+
+
+_pool: ConnectionPool | None = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> ConnectionPool:
+    """Return the process-wide pool, creating it on first use."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ConnectionPool(DATABASE_NAME)
+        return _pool
+
+
+def reset_pool(database: str | None = None) -> None:
+    """Close the process-wide pool, optionally pointing the next one elsewhere."""
+    global _pool, DATABASE_NAME
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+        if database is not None:
+            DATABASE_NAME = database
+        _pool = ConnectionPool(DATABASE_NAME)
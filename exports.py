@@ -0,0 +1,89 @@
+"""
+Streaming CSV and NDJSON exports.
+
+Each export is a generator of text chunks that reads its rows from a database
+cursor a batch at a time, so memory stays flat however large the table is.
+The generators check out their own pooled connection because they keep
+running after the request handler has returned.
+"""
+
+import csv
+import io
+import json
+
+from database import get_pool
+from utils import calculate_cost_matrix, get_global_churn_rate, month_range
+
+FORMATS = {"csv": "text/csv", "ndjson": "application/x-ndjson"}
+
+PEOPLE_COLUMNS = ["person_id", "name", "team", "grade", "work_stream", "location",
+                  "contract_type", "status", "start_date", "expected_end_date"]
+
+# Rows fetched from the cursor, and so written per chunk of output.
+BATCH_SIZE = 2000
+
+# The longest forecast export served in a request; longer ones are run as
+# background jobs.
+MAX_FORECAST_MONTHS = 120
+
+
+def _batches(conn, sql, params=()):
+    c = conn.cursor()
+    c.execute(sql, params)
+    while True:
+        rows = c.fetchmany(BATCH_SIZE)
+        if not rows:
+            return
+        yield rows
+
+
+def _csv_chunk(rows):
+    output = io.StringIO()
+    csv.writer(output).writerows(rows)
+    return output.getvalue()
+
+
+def _ndjson_chunk(records):
+    return "".join(json.dumps(record) + "\n" for record in records)
+
+
+def export_people(fmt):
+    """Yields the people table as CSV or NDJSON."""
+    conn = get_pool().acquire(dedicated=True)
+    try:
+        if fmt == "csv":
+            yield _csv_chunk([PEOPLE_COLUMNS])
+        for rows in _batches(conn, f"SELECT {', '.join(PEOPLE_COLUMNS)} FROM people ORDER BY person_id"):
+            if fmt == "csv":
+                yield _csv_chunk([tuple(row) for row in rows])
+            else:
+                yield _ndjson_chunk([dict(row) for row in rows])
+    finally:
+        conn.close()
+
+
+def export_forecast(fmt, start_ym, end_ym):
+    """
+    Yields the per-person, per-month forecast (after churn) from start_ym to
+    end_ym. CSV has one column per month; NDJSON has a "costs" object keyed by
+    month. People are costed a batch at a time rather than as one matrix.
+    """
+    year_months = [f"{year}-{month:02d}" for year, month in month_range(start_ym, end_ym)]
+    conn = get_pool().acquire(dedicated=True)
+    try:
+        multiplier = 1 - get_global_churn_rate()
+        if fmt == "csv":
+            yield _csv_chunk([["person_id", "name"] + year_months])
+        for people in _batches(conn, "SELECT * FROM people ORDER BY person_id"):
+            costs = calculate_cost_matrix(people, year_months, conn) * multiplier
+            if fmt == "csv":
+                yield _csv_chunk([[person["person_id"], person["name"]] + row.tolist()
+                                  for person, row in zip(people, costs)])
+            else:
+                yield _ndjson_chunk([
+                    {"person_id": person["person_id"], "name": person["name"],
+                     "costs": dict(zip(year_months, row.tolist()))}
+                    for person, row in zip(people, costs)
+                ])
+    finally:
+        conn.close()
@@ -0,0 +1,292 @@
+"""
+The materialized monthly forecast.
+
+forecast_cache holds each person's pre-churn cost for every month listed in
+forecast_cache_months. A month is computed in full the first time it is read
+and then kept up to date by the write routes: editing a person recomputes that
+person's rows, changing a rate recomputes the people on that grade and
+location, and churn is applied when totals are read, so changing it costs
+nothing here.
+
+forecast_cache_groups holds the same costs summed by month, team and work
+stream. It is adjusted by the difference whenever rows are written or
+removed, so monthly and per-team totals never have to read the per-person
+rows.
+
+Filling the cache needs the write lock. When another connection holds it for
+longer than the busy timeout (a long upload, say), reads compute their answer
+with utils.run_forecast_range instead and leave the cache for a later read.
+"""
+
+import logging
+import sqlite3
+
+import numpy as np
+
+import metrics
+from records import load_people
+from utils import (
+    GROUP_COLUMNS,
+    active_people,
+    calculate_cost_matrix,
+    get_db_connection,
+    get_global_churn_rate,
+    month_range,
+    run_forecast,
+    run_forecast_range,
+)
+
+# Person ids per statement when removing rows, to stay under SQLite's limit
+# on bound parameters.
+ID_CHUNK = 500
+
+log = logging.getLogger("workforce.forecast_cache")
+
+
+def materialized_months(conn):
+    return [row["year_month"] for row in conn.execute("SELECT year_month FROM forecast_cache_months")]
+
+
+def _add_group_totals(conn, rows):
+    conn.executemany('''
+        INSERT INTO forecast_cache_groups (year_month, team, work_stream, cost) VALUES (?, ?, ?, ?)
+        ON CONFLICT (year_month, team, work_stream) DO UPDATE SET cost = cost + excluded.cost
+    ''', rows)
+
+
+def _register(conn, people):
+    conn.executemany(
+        "INSERT OR REPLACE INTO forecast_cache_people (person_id, team, work_stream) VALUES (?, ?, ?)",
+        [(person.person_id, person.team or "", person.work_stream or "") for person in people],
+    )
+
+
+def _store(conn, people, year_months):
+    if not people or not year_months:
+        return
+    # Stored costs outlive the process, so they are costed from the rates on
+    # conn, not from a cache that may predate the latest write.
+    costs = calculate_cost_matrix(people, year_months, conn, cached=False)
+    conn.executemany(
+        "INSERT OR REPLACE INTO forecast_cache (person_id, year_month, cost) VALUES (?, ?, ?)",
+        [
+            (person.person_id, ym, float(cost))
+            for person, row in zip(people, costs)
+            for ym, cost in zip(year_months, row)
+        ],
+    )
+    _register(conn, people)
+    keys = [(person.team or "", person.work_stream or "") for person in people]
+    groups = {}
+    index = np.array([groups.setdefault(key, len(groups)) for key in keys])
+    totals = np.zeros((len(groups), len(year_months)))
+    np.add.at(totals, index, costs)
+    _add_group_totals(conn, [
+        (ym, team, work_stream, float(cost))
+        for (team, work_stream), row in zip(groups, totals)
+        for ym, cost in zip(year_months, row)
+    ])
+
+
+def _remove(conn, person_ids, year_months=None):
+    """Deletes the rows for person_ids (in year_months, or every month) and takes them off the group totals."""
+    month_clause = ""
+    month_params = []
+    if year_months is not None:
+        month_clause = f"AND f.year_month IN ({', '.join('?' for _ in year_months)})"
+        month_params = list(year_months)
+    for start in range(0, len(person_ids), ID_CHUNK):
+        chunk = person_ids[start:start + ID_CHUNK]
+        id_clause = f"f.person_id IN ({', '.join('?' for _ in chunk)})"
+        _add_group_totals(conn, conn.execute(f'''
+            SELECT f.year_month, g.team, g.work_stream, -SUM(f.cost)
+            FROM forecast_cache f JOIN forecast_cache_people g ON g.person_id = f.person_id
+            WHERE {id_clause} {month_clause}
+            GROUP BY f.year_month, g.team, g.work_stream
+        ''', chunk + month_params).fetchall())
+        conn.execute(f"DELETE FROM forecast_cache AS f WHERE {id_clause} {month_clause}", chunk + month_params)
+
+
+@metrics.timed("forecast_cache.ensure_months")
+def ensure_months(conn, year_months):
+    """
+    Compute and store every month in year_months that is not materialized yet.
+    Returns False, leaving the cache as it was, if the write lock could not
+    be had; the caller should then compute its answer without the cache.
+    """
+    if not set(year_months) - set(materialized_months(conn)):
+        return True
+    try:
+        # Take the write lock before checking again, so concurrent requests for
+        # the same new months queue behind one another instead of failing to
+        # upgrade their read transactions, and only the first computes them.
+        if not conn.in_transaction:
+            conn.execute("BEGIN IMMEDIATE")
+        missing = sorted(set(year_months) - set(materialized_months(conn)))
+        if missing:
+            people = load_people(conn)
+            # Only people in post at some point in the missing months get rows;
+            # the rest cost nothing there and month_forecast reports them as 0.
+            active = active_people(people, missing)
+            _register(conn, [person for person, keep in zip(people, active) if not keep])
+            _store(conn, [person for person, keep in zip(people, active) if keep], missing)
+            conn.executemany("INSERT OR IGNORE INTO forecast_cache_months (year_month) VALUES (?)",
+                             [(ym,) for ym in missing])
+        conn.commit()
+    except sqlite3.OperationalError as exc:
+        if "locked" not in str(exc) and "busy" not in str(exc):
+            raise
+        conn.rollback()
+        log.info("not materializing %s to %s: %s", year_months[0], year_months[-1], exc)
+        return False
+    return True
+
+
+def refresh_people(conn, person_ids):
+    """Recompute the given people's rows; people that no longer exist are dropped."""
+    person_ids = list(person_ids)
+    if not person_ids:
+        return
+    _remove(conn, person_ids)
+    for start in range(0, len(person_ids), ID_CHUNK):
+        chunk = person_ids[start:start + ID_CHUNK]
+        placeholders = ", ".join("?" for _ in chunk)
+        conn.execute(f"DELETE FROM forecast_cache_people WHERE person_id IN ({placeholders})", chunk)
+        people = load_people(conn, f"WHERE person_id IN ({placeholders})", chunk)
+        _store(conn, people, materialized_months(conn))
+    conn.commit()
+
+
+def add_missing_people(conn):
+    """Compute rows for people with none yet, e.g. after a bulk upload."""
+    if not materialized_months(conn):
+        return
+    person_ids = [row["person_id"] for row in conn.execute(
+        "SELECT person_id FROM people WHERE person_id NOT IN (SELECT person_id FROM forecast_cache_people)"
+    )]
+    refresh_people(conn, person_ids)
+
+
+def refresh_rate(conn, grade, location, year_month):
+    """Recompute the people a (grade, location, year_month) planning rate applies to."""
+    if year_month not in materialized_months(conn):
+        return
+    people = load_people(conn, "WHERE grade = ? AND location = ?", (grade, location))
+    _remove(conn, [person.person_id for person in people], [year_month])
+    _store(conn, people, [year_month])
+    conn.commit()
+
+
+def invalidate_months(conn, year_months=None):
+    """
+    Forget the given months (or all months), to be recomputed in full on the
+    next read. Used after bulk rate uploads and holiday changes.
+    """
+    if year_months is None:
+        for table in ("forecast_cache", "forecast_cache_months", "forecast_cache_groups", "forecast_cache_people"):
+            conn.execute(f"DELETE FROM {table}")
+    else:
+        year_months = list(year_months)
+        placeholders = ", ".join("?" for _ in year_months)
+        for table in ("forecast_cache", "forecast_cache_months", "forecast_cache_groups"):
+            conn.execute(f"DELETE FROM {table} WHERE year_month IN ({placeholders})", year_months)
+    conn.commit()
+
+
+@metrics.timed("forecast_cache.monthly_totals")
+def monthly_totals(start_ym, end_ym):
+    """Total forecast cost after churn for each month from start_ym to end_ym."""
+    year_months = [f"{year}-{month:02d}" for year, month in month_range(start_ym, end_ym)]
+    conn = get_db_connection()
+    if not ensure_months(conn, year_months):
+        conn.close()
+        return [float(total) for total in run_forecast_range(start_ym, end_ym)["total_cost"]]
+    c = conn.cursor()
+    c.execute('''
+        SELECT year_month, SUM(cost) AS total_cost
+        FROM forecast_cache_groups
+        WHERE year_month BETWEEN ? AND ?
+        GROUP BY year_month
+    ''', (start_ym, end_ym))
+    totals = {row["year_month"]: row["total_cost"] for row in c.fetchall()}
+    conn.close()
+    churn_rate = get_global_churn_rate()
+    return [totals.get(ym, 0.0) * (1 - churn_rate) for ym in year_months]
+
+
+def grouped_totals(start_ym, end_ym, group_by=()):
+    """
+    Forecast cost after churn from start_ym to end_ym, summed by month and by
+    the people columns in group_by (see utils.GROUP_COLUMNS). Returns a list
+    of dicts with year_month, each group column and forecast.
+    """
+    group_by = [column for column in GROUP_COLUMNS if column in group_by]
+    year_months = [f"{year}-{month:02d}" for year, month in month_range(start_ym, end_ym)]
+    columns = ", ".join(["year_month"] + group_by)
+    selected = ", ".join(["year_month"] + [f"NULLIF({column}, '') AS {column}" for column in group_by])
+    conn = get_db_connection()
+    if not ensure_months(conn, year_months):
+        conn.close()
+        return computed_totals(start_ym, end_ym, group_by)
+    c = conn.cursor()
+    c.execute(f'''
+        SELECT {selected}, SUM(cost) AS forecast
+        FROM forecast_cache_groups
+        WHERE year_month BETWEEN ? AND ?
+        GROUP BY {columns}
+        ORDER BY {columns}
+    ''', (start_ym, end_ym))
+    rows = [dict(row) for row in c.fetchall()]
+    conn.close()
+    multiplier = 1 - get_global_churn_rate()
+    for row in rows:
+        row["forecast"] *= multiplier
+    return rows
+
+
+def computed_totals(start_ym, end_ym, group_by=()):
+    """grouped_totals computed with utils.run_forecast_range, without the cache."""
+    group_by = [column for column in GROUP_COLUMNS if column in group_by]
+    forecast = run_forecast_range(start_ym, end_ym)
+    totals = {}
+    for person, costs in zip(forecast["people"], forecast["costs"]):
+        key = tuple(getattr(person, column) or None for column in group_by)
+        if key in totals:
+            totals[key] = totals[key] + costs
+        else:
+            totals[key] = costs
+    rows = [
+        {"year_month": f"{year}-{month:02d}", **dict(zip(group_by, key)), "forecast": float(cost)}
+        for key, costs in totals.items()
+        for (year, month), cost in zip(forecast["months"], costs)
+    ]
+    columns = ["year_month"] + group_by
+    return sorted(rows, key=lambda row: tuple(row[column] or "" for column in columns))
+
+
+@metrics.timed("forecast_cache.month_forecast")
+def month_forecast(year, month):
+    """The materialized equivalent of utils.run_forecast."""
+    ym = f"{year}-{month:02d}"
+    conn = get_db_connection()
+    if not ensure_months(conn, [ym]):
+        conn.close()
+        return run_forecast(year, month)
+    c = conn.cursor()
+    c.execute('''
+        SELECT p.person_id, p.name, IFNULL(f.cost, 0.0) AS cost
+        FROM people p LEFT JOIN forecast_cache f ON f.person_id = p.person_id AND f.year_month = ?
+        ORDER BY p.person_id
+    ''', (ym,))
+    rows = c.fetchall()
+    conn.close()
+    multiplier = 1 - get_global_churn_rate()
+    with metrics.span("forecast_cache.month_forecast.people"):
+        details = [{"person_id": row["person_id"], "name": row["name"], "cost": row["cost"] * multiplier}
+                   for row in rows]
+    return {
+        "year": year,
+        "month": month,
+        "total_cost": sum(item["cost"] for item in details),
+        "details": details,
+    }
@@ -0,0 +1,201 @@
+"""Streaming, batched CSV imports for the people, posts, budget and salaries tables."""
+
+import csv
+import io
+import re
+from datetime import date
+
+# Rows validated and written per executemany call.
+CHUNK_SIZE = 5000
+# Rejections reported individually; the rest are only counted.
+MAX_REPORTED_ERRORS = 100
+
+DATE = re.compile(r"^\d{4}-\d{2}-\d{2}$")
+YEAR_MONTH = re.compile(r"^\d{4}-(0[1-9]|1[0-2])$")
+
+
+def _required(row, *fields):
+    missing = [field for field in fields if not row.get(field)]
+    if missing:
+        raise ValueError(f"missing {', '.join(missing)}")
+
+
+def _number(row, field):
+    try:
+        return float(row[field])
+    except ValueError:
+        raise ValueError(f"{field} is not a number: {row[field]!r}") from None
+
+
+def _date(row, field):
+    # Empty, or a real YYYY-MM-DD date: the forecast parses every stored date.
+    value = row.get(field)
+    if value:
+        try:
+            if not DATE.match(value):
+                raise ValueError
+            date.fromisoformat(value)
+        except ValueError:
+            raise ValueError(f"{field} is not a YYYY-MM-DD date: {value!r}") from None
+    return value
+
+
+def _year_month(row, field):
+    if not YEAR_MONTH.match(row[field]):
+        raise ValueError(f"{field} is not a YYYY-MM month: {row[field]!r}")
+    return row[field]
+
+
+def _people_row(row):
+    _required(row, "name", "grade", "location")
+    return (
+        row.get("name"),
+        row.get("team"),
+        row.get("grade"),
+        row.get("work_stream"),
+        row.get("location"),
+        row.get("contract_type"),
+        row.get("status"),
+        _date(row, "start_date"),
+        _date(row, "expected_end_date"),
+    )
+
+
+def _posts_row(row):
+    values = (
+        row.get("workforce_plan_number"),
+        row.get("funding_source"),
+        _date(row, "post_start_date"),
+        _date(row, "post_end_date"),
+        row.get("person_id") or None,
+        row.get("grade") or None,
+        row.get("location") or None,
+    )
+    if not any(values):
+        raise ValueError("empty row")
+    return values
+
+
+def _budget_row(row):
+    _required(row, "year_month", "allocated_budget")
+    return (row.get("team"), row.get("work_stream"), _year_month(row, "year_month"),
+            _number(row, "allocated_budget"))
+
+
+def _pay_row(row):
+    _required(row, "location", "grade", "date", "pay")
+    return (row["grade"], row["location"], _year_month(row, "date"), _number(row, "pay"))
+
+
+# Per table: the CSV row validator, the insert statement, and the position of
+# the year_month value for tables that support replacing whole months.
+IMPORTS = {
+    "people": (
+        _people_row,
+        """
+        INSERT INTO people (name, team, grade, work_stream, location, contract_type, status, start_date, expected_end_date)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """,
+        None,
+    ),
+    "posts": (
+        _posts_row,
+        """
+        INSERT INTO posts (workforce_plan_number, funding_source, post_start_date, post_end_date, person_id,
+                           grade, location)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+        """,
+        None,
+    ),
+    "budget": (
+        _budget_row,
+        """
+        INSERT INTO budget (team, work_stream, year_month, allocated_budget)
+        VALUES (?, ?, ?, ?)
+        """,
+        None,
+    ),
+    # Pay rates are keyed on (grade, location, year_month): re-uploading a rate
+    # card updates the existing rows rather than adding duplicates.
+    "salaries": (
+        _pay_row,
+        """
+        INSERT INTO salaries (grade, location, year_month, monthly_planning_rate)
+        VALUES (?, ?, ?, ?)
+        ON CONFLICT (grade, location, year_month)
+        DO UPDATE SET monthly_planning_rate = excluded.monthly_planning_rate
+        """,
+        2,
+    ),
+}
+
+
+def ingest_csv(stream, table, conn, chunk_size=CHUNK_SIZE, replace_months=False, progress=None):
+    """
+    Imports a CSV upload into table from a binary stream.
+
+    The stream is decoded as it is read, rows are validated and inserted
+    chunk_size at a time with executemany, and the whole file is committed as
+    one transaction. Returns a summary of accepted and rejected rows, with the
+    line number and reason for (up to MAX_REPORTED_ERRORS) rejections.
+
+    For tables with a year_month column the summary also lists the months the
+    file touched. With replace_months, every existing row for a month that
+    appears in the file is deleted before the file's rows for that month are
+    written. progress, if given, is called after each chunk with the number
+    of rows read so far.
+    """
+    validate, insert_sql, month_column = IMPORTS[table]
+    if replace_months and month_column is None:
+        raise ValueError(f"{table} imports cannot replace whole months")
+    summary = {"table": table, "accepted": 0, "rejected": 0, "errors": [], "months": [], "replaced_months": []}
+    months = set()
+    replaced = set()
+    c = conn.cursor()
+
+    def write(batch):
+        if month_column is not None:
+            months.update(values[month_column] for values in batch)
+        if replace_months:
+            for year_month in sorted({values[month_column] for values in batch} - replaced):
+                c.execute(f"DELETE FROM {table} WHERE year_month = ?", (year_month,))
+                replaced.add(year_month)
+                summary["replaced_months"].append(year_month)
+        c.executemany(insert_sql, batch)
+        summary["accepted"] += len(batch)
+        if progress is not None:
+            progress(summary["accepted"] + summary["rejected"])
+
+    text = io.TextIOWrapper(stream, encoding="utf-8-sig", newline="")
+    reader = csv.DictReader(text)
+    batch = []
+    try:
+        for row in reader:
+            try:
+                batch.append(validate(row))
+            except ValueError as exc:
+                summary["rejected"] += 1
+                if len(summary["errors"]) < MAX_REPORTED_ERRORS:
+                    summary["errors"].append((reader.line_num, str(exc)))
+            if len(batch) >= chunk_size:
+                write(batch)
+                batch = []
+        write(batch)
+        conn.commit()
+        summary["months"] = sorted(months)
+    except UnicodeDecodeError:
+        conn.rollback()
+        summary["accepted"] = 0
+        summary["replaced_months"] = []
+        summary["errors"].append((reader.line_num + 1, "file is not valid UTF-8; nothing was imported"))
+    except csv.Error as exc:
+        # NUL bytes, an oversized field or broken quoting: the file cannot be
+        # read past this line.
+        conn.rollback()
+        summary["accepted"] = 0
+        summary["replaced_months"] = []
+        summary["errors"].append((reader.line_num, f"file is not valid CSV ({exc}); nothing was imported"))
+    finally:
+        # Leave the upload stream open for its owner to close.
+        text.detach()
+    return summary
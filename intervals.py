@@ -0,0 +1,116 @@
+"""
+In-memory interval indexes over people's and posts' dates.
+
+An IntervalIndex keeps the start dates of a set of intervals in sorted order
+(with their ids and end dates alongside) and, separately, the end dates in
+sorted order. The intervals overlapping [first, last] are those starting on
+or before last, less those that ended before first, so a headcount is two
+binary searches however many people there are.
+
+get_indexes builds the people and posts indexes once and keeps them until the
+data version moves on, i.e. until the next successful write; scripts that
+write to the database directly should call database.bump_data_version.
+"""
+
+import threading
+
+import numpy as np
+
+import database
+
+FIRST_DATE = np.datetime64("0001-01-01")
+LAST_DATE = np.datetime64("9999-12-31")
+
+_lock = threading.Lock()
+_cache = {}
+
+
+def parse_dates(values, missing):
+    # Empty or NULL dates become the supplied sentinel, mirroring the
+    # month-start/month-end fallbacks in utils.calculate_person_cost.
+    dates = np.array([value or None for value in values], dtype="datetime64[D]")
+    dates[np.isnat(dates)] = missing
+    return dates
+
+
+def month_bounds(year_months):
+    """The first and last day of each "YYYY-MM" month, as datetime64[D] arrays."""
+    firsts = np.array([f"{ym}-01" for ym in year_months], dtype="datetime64[D]")
+    lasts = (firsts.astype("datetime64[M]") + 1).astype("datetime64[D]") - 1
+    return firsts, lasts
+
+
+class IntervalIndex:
+    """
+    Closed date intervals [start, end] with integer ids. Intervals that end
+    before they start are never active and are left out.
+    """
+
+    def __init__(self, ids, starts, ends):
+        ids = np.asarray(ids, dtype=np.int64)
+        starts = np.asarray(starts, dtype="datetime64[D]")
+        ends = np.asarray(ends, dtype="datetime64[D]")
+        valid = starts <= ends
+        order = np.argsort(starts[valid], kind="stable")
+        self.ids = ids[valid][order]
+        self.starts = starts[valid][order]
+        self.ends = ends[valid][order]
+        self.sorted_ends = np.sort(self.ends)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def counts(self, firsts, lasts):
+        """The number of intervals overlapping each [first, last] pair of dates."""
+        firsts = np.asarray(firsts, dtype="datetime64[D]")
+        lasts = np.asarray(lasts, dtype="datetime64[D]")
+        return (np.searchsorted(self.starts, lasts, side="right")
+                - np.searchsorted(self.sorted_ends, firsts, side="left"))
+
+    def count(self, first, last=None):
+        """The number of intervals overlapping [first, last], or active on first if last is omitted."""
+        return int(self.counts(first, first if last is None else last))
+
+    def active(self, first, last=None):
+        """
+        The sorted ids of the intervals overlapping [first, last]. Only the
+        intervals starting on or before last are examined.
+        """
+        last = np.datetime64(first if last is None else last, "D")
+        cut = np.searchsorted(self.starts, last, side="right")
+        return np.sort(self.ids[:cut][self.ends[:cut] >= np.datetime64(first, "D")])
+
+    def monthly_counts(self, year_months):
+        """The number of intervals overlapping each "YYYY-MM" month."""
+        return self.counts(*month_bounds(year_months))
+
+
+def build_index(rows, id_column, start_column, end_column):
+    return IntervalIndex(
+        [row[id_column] for row in rows],
+        parse_dates([row[start_column] for row in rows], FIRST_DATE),
+        parse_dates([row[end_column] for row in rows], LAST_DATE),
+    )
+
+
+def get_indexes(conn):
+    """
+    The (people, posts) IntervalIndexes for the current data, rebuilt when
+    the data version has moved on since they were built.
+    """
+    key = (database.DATABASE_NAME, database.get_data_version(conn)[0])
+    with _lock:
+        if _cache.get("key") != key:
+            people = conn.execute("SELECT person_id, start_date, expected_end_date FROM people").fetchall()
+            posts = conn.execute("SELECT post_id, post_start_date, post_end_date FROM posts").fetchall()
+            _cache.update(
+                key=key,
+                people=build_index(people, "person_id", "start_date", "expected_end_date"),
+                posts=build_index(posts, "post_id", "post_start_date", "post_end_date"),
+            )
+        return _cache["people"], _cache["posts"]
+
+
+def invalidate_indexes():
+    with _lock:
+        _cache.clear()
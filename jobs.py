@@ -0,0 +1,396 @@
+"""
+Background jobs for long uploads and forecasts.
+
+Jobs are rows in the jobs table: a kind, JSON parameters and, for uploads,
+the uploaded file. submit queues one and returns at once; a pool of WORKERS
+threads (WORKFORCE_JOB_WORKERS, default 2) claims queued jobs oldest first
+and runs them, so at most that many run at a time, and submit refuses new
+jobs with QueueFull while MAX_QUEUED (WORKFORCE_JOB_QUEUE, default 20) are
+waiting.
+
+A finished job keeps its JSON result and, for forecasts, the exported file
+for download; its input is dropped. Uploads and exports go between temporary
+files and the row's BLOBs COPY_CHUNK bytes at a time, so neither is ever held
+in memory whole. Finished jobs are deleted after RETENTION_DAYS. Progress is
+held in memory while a job runs, since an upload holds the database's write
+lock until it commits, and is written to the row when the job finishes.
+Workers start when a job is submitted or the jobs are first looked at (see
+ensure_workers).
+
+A claimed job records its worker's owner id (host:pid:random) and a
+heartbeat, renewed every HEARTBEAT_SECONDS while it runs. Workers queue a
+running job again once its heartbeat is STALE_SECONDS old, unless its owner
+is a process on the same host that is still alive, so several app processes
+can share the queue and a job whose process stopped is picked up again.
+"""
+
+import io
+import json
+import logging
+import os
+import shutil
+import socket
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+
+import database
+import forecast_cache
+from exports import FORMATS, export_forecast
+from ingest import IMPORTS, ingest_csv
+from utils import get_db_connection, invalidate_rate_cache, month_range
+
+WORKERS = int(os.environ.get("WORKFORCE_JOB_WORKERS", "2"))
+MAX_QUEUED = int(os.environ.get("WORKFORCE_JOB_QUEUE", "20"))
+RETENTION_DAYS = 7
+# Bytes copied at a time between uploads and the jobs table.
+COPY_CHUNK = 1 << 20
+# Seconds an idle worker waits before looking for jobs queued elsewhere.
+POLL_SECONDS = 5.0
+HEARTBEAT_SECONDS = 15.0
+STALE_SECONDS = 300
+
+log = logging.getLogger("workforce.jobs")
+NOW = "strftime('%Y-%m-%dT%H:%M:%SZ', 'now')"
+
+_wakeup = threading.Condition()
+_workers = []
+_workers_lock = threading.Lock()
+_progress = {}
+_owner = None
+
+
+class QueueFull(Exception):
+    """Raised by submit when MAX_QUEUED jobs are already waiting."""
+
+
+def submit(kind, params, data=None):
+    """
+    Queues a job of kind with JSON-able params and, optionally, the contents
+    of data, a seekable binary file, as its input; returns its id.
+    """
+    if kind not in HANDLERS:
+        raise ValueError(f"unknown job kind {kind!r}")
+    conn = get_db_connection()
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        queued = conn.execute("SELECT COUNT(*) FROM jobs WHERE status = 'queued'").fetchone()[0]
+        if queued >= MAX_QUEUED:
+            conn.rollback()
+            raise QueueFull(f"{queued} jobs are already waiting")
+        job_id = conn.execute(
+            f"INSERT INTO jobs (kind, params, created_at) VALUES (?, ?, {NOW})",
+            (kind, json.dumps(params)),
+        ).lastrowid
+        if data is not None:
+            # A blob is written in place, so make room for the whole file first.
+            conn.execute("UPDATE jobs SET input = zeroblob(?) WHERE job_id = ?",
+                         (data.seek(0, io.SEEK_END), job_id))
+            data.seek(0)
+            with conn.blobopen("jobs", "input", job_id) as blob:
+                shutil.copyfileobj(data, blob, COPY_CHUNK)
+        conn.commit()
+    finally:
+        conn.close()
+    ensure_workers()
+    with _wakeup:
+        _wakeup.notify()
+    return job_id
+
+
+def submit_upload(table, data, replace_months=False):
+    """
+    Queues a CSV upload of data, a seekable binary file, into table, as
+    ingest_csv would import it; returns the job id.
+    """
+    if table not in IMPORTS:
+        raise ValueError(f"unknown table {table!r}")
+    if replace_months and IMPORTS[table][2] is None:
+        raise ValueError(f"{table} imports cannot replace whole months")
+    return submit("upload", {"table": table, "replace_months": replace_months}, data)
+
+
+def submit_forecast(start_ym, end_ym, fmt="csv"):
+    """Queues a per-person forecast export from start_ym to end_ym; returns the job id."""
+    if fmt not in FORMATS:
+        raise ValueError(f"unknown format {fmt!r}")
+    return submit("forecast", {"start": start_ym, "end": end_ym, "format": fmt})
+
+
+def get_job(job_id, conn=None):
+    """A job's status as a dict, without its input or output; None if there is no such job."""
+    own_connection = conn is None
+    if own_connection:
+        conn = get_db_connection()
+    row = conn.execute('''
+        SELECT job_id, kind, params, status, progress, message, result, output_name, output_type,
+               created_at, started_at, finished_at, output IS NOT NULL AS has_output
+        FROM jobs WHERE job_id = ?
+    ''', (job_id,)).fetchone()
+    if own_connection:
+        conn.close()
+    return None if row is None else _as_dict(row)
+
+
+def list_jobs(limit=50):
+    """The most recent jobs, newest first, as get_job returns them."""
+    conn = get_db_connection()
+    rows = conn.execute('''
+        SELECT job_id, kind, params, status, progress, message, result, output_name, output_type,
+               created_at, started_at, finished_at, output IS NOT NULL AS has_output
+        FROM jobs ORDER BY job_id DESC LIMIT ?
+    ''', (limit,)).fetchall()
+    conn.close()
+    return [_as_dict(row) for row in rows]
+
+
+def _as_dict(row):
+    job = dict(row)
+    job["params"] = json.loads(job["params"])
+    job["result"] = json.loads(job["result"]) if job["result"] else None
+    job["has_output"] = bool(job["has_output"])
+    if job["status"] == "running" and job["job_id"] in _progress:
+        job["progress"], job["message"] = _progress[job["job_id"]]
+    return job
+
+
+def get_output(job_id):
+    """(data, filename, mimetype) of a finished job's output; None if it has none."""
+    conn = get_db_connection()
+    row = conn.execute("SELECT output, output_name, output_type FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+    conn.close()
+    if row is None or row["output"] is None:
+        return None
+    return row["output"], row["output_name"], row["output_type"]
+
+
+# Handlers: each takes the job's params, its input (a binary file, or None)
+# and a report(fraction, message) callback, and returns (result, output,
+# output_name, output_type), output being a binary file or None.
+
+def _upload(params, data, report):
+    table = params["table"]
+    size = max(data.seek(0, io.SEEK_END), 1)
+    data.seek(0)
+    conn = get_db_connection()
+    try:
+        summary = ingest_csv(data, table, conn, replace_months=params.get("replace_months", False),
+                             progress=lambda rows: report(min(data.tell() / size, 1.0), f"{rows} rows read", conn))
+        # The same follow-up as the upload routes.
+        if table == "people":
+            forecast_cache.add_missing_people(conn)
+        elif table == "salaries":
+            invalidate_rate_cache()
+            forecast_cache.invalidate_months(conn, summary["months"])
+        if summary["accepted"]:
+            database.bump_data_version(conn)
+    finally:
+        conn.close()
+    return summary, None, None, None
+
+
+def _forecast(params, data, report):
+    start_ym, end_ym, fmt = params["start"], params["end"], params.get("format", "csv")
+    conn = get_db_connection()
+    people = conn.execute("SELECT COUNT(*) FROM people").fetchone()[0]
+    conn.close()
+    output = tempfile.TemporaryFile()
+    lines = 0
+    try:
+        for chunk in export_forecast(fmt, start_ym, end_ym):
+            output.write(chunk.encode())
+            lines += chunk.count("\n")
+            # One line per person, after the CSV header.
+            done = min(lines - (fmt == "csv"), people)
+            report(done / max(people, 1), f"{done} of {people} people")
+    except BaseException:
+        output.close()
+        raise
+    result = {"people": people, "months": len(month_range(start_ym, end_ym)), "bytes": output.tell()}
+    return result, output, f"forecast_{start_ym}_{end_ym}.{fmt}", FORMATS[fmt]
+
+
+HANDLERS = {"upload": _upload, "forecast": _forecast}
+
+
+# Workers
+
+def _owner_alive(owner):
+    # Only a process on this host can be checked; elsewhere the heartbeat decides.
+    host, pid, _ = (owner or "::").split(":", 2)
+    if host != socket.gethostname() or not pid.isdigit():
+        return False
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _requeue_abandoned(conn):
+    """Queues again the running jobs whose worker has stopped renewing their heartbeat."""
+    stale = conn.execute(
+        "SELECT job_id, owner FROM jobs WHERE status = 'running' AND IFNULL(heartbeat_at, '') < "
+        "strftime('%Y-%m-%dT%H:%M:%SZ', 'now', ?)",
+        (f"-{STALE_SECONDS} seconds",),
+    ).fetchall()
+    for row in stale:
+        if not _owner_alive(row["owner"]):
+            log.warning("queuing job %s again: its worker %s stopped", row["job_id"], row["owner"])
+            conn.execute("UPDATE jobs SET status = 'queued', owner = NULL, started_at = NULL, heartbeat_at = NULL "
+                         "WHERE job_id = ?", (row["job_id"],))
+
+
+def _beat(conn, job_ids):
+    placeholders = ", ".join("?" for _ in job_ids)
+    conn.execute(f"UPDATE jobs SET heartbeat_at = {NOW} WHERE owner = ? AND job_id IN ({placeholders})",
+                 [_owner, *job_ids])
+
+
+def _heartbeat():
+    while True:
+        time.sleep(HEARTBEAT_SECONDS)
+        job_ids = list(_progress)
+        if not job_ids:
+            continue
+        conn = get_db_connection()
+        try:
+            _beat(conn, job_ids)
+            conn.commit()
+        except sqlite3.OperationalError as exc:
+            # An upload holding the write lock renews its own heartbeat.
+            log.debug("could not renew the heartbeat of jobs %s: %s", job_ids, exc)
+        finally:
+            conn.close()
+
+
+def _claim():
+    conn = get_db_connection()
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        _requeue_abandoned(conn)
+        row = conn.execute("SELECT job_id FROM jobs WHERE status = 'queued' ORDER BY job_id LIMIT 1").fetchone()
+        if row is None:
+            conn.commit()
+            return None
+        conn.execute(f"UPDATE jobs SET status = 'running', owner = ?, started_at = {NOW}, heartbeat_at = {NOW} "
+                     "WHERE job_id = ?", (_owner, row["job_id"]))
+        conn.commit()
+        return conn.execute("SELECT job_id, kind, params, input IS NOT NULL AS has_input FROM jobs WHERE job_id = ?",
+                            (row["job_id"],)).fetchone()
+    finally:
+        conn.close()
+
+
+def _finish(job_id, status, message, result=None, output=None, output_name=None, output_type=None):
+    progress = 1.0 if status == "done" else _progress.get(job_id, (0.0,))[0]
+    result = None if result is None else json.dumps(result)
+    # Another worker's upload may hold the write lock for a while; the
+    # outcome must still be recorded.
+    while True:
+        conn = get_db_connection()
+        try:
+            updated = conn.execute(f'''
+                UPDATE jobs SET status = ?, progress = ?, message = ?, result = ?, output = NULL, output_name = ?,
+                                output_type = ?, input = NULL, finished_at = {NOW}
+                WHERE job_id = ? AND owner = ?
+            ''', (status, progress, message, result, output_name, output_type, job_id, _owner)).rowcount
+            if not updated:
+                log.warning("job %s was queued again while it ran; not recording its end", job_id)
+            elif output is not None:
+                conn.execute("UPDATE jobs SET output = zeroblob(?) WHERE job_id = ?",
+                             (output.seek(0, io.SEEK_END), job_id))
+                output.seek(0)
+                with conn.blobopen("jobs", "output", job_id) as blob:
+                    shutil.copyfileobj(output, blob, COPY_CHUNK)
+            conn.execute("DELETE FROM jobs WHERE finished_at < strftime('%Y-%m-%dT%H:%M:%SZ', 'now', ?)",
+                         (f"-{RETENTION_DAYS} days",))
+            conn.commit()
+            return
+        except sqlite3.OperationalError as exc:
+            log.warning("could not record the end of job %s yet: %s", job_id, exc)
+            time.sleep(POLL_SECONDS)
+        finally:
+            conn.close()
+
+
+def _input_file(job_id):
+    """A temporary file holding the job's input, copied out of its row a chunk at a time."""
+    spool = tempfile.TemporaryFile()
+    conn = get_db_connection()
+    try:
+        with conn.blobopen("jobs", "input", job_id, readonly=True) as blob:
+            shutil.copyfileobj(blob, spool, COPY_CHUNK)
+    finally:
+        conn.close()
+    spool.seek(0)
+    return spool
+
+
+def run_job(job):
+    """Runs a claimed job and records how it ended."""
+    job_id = job["job_id"]
+    _progress[job_id] = (0.0, "started")
+
+    def report(fraction, message, conn=None):
+        # A handler holding the write lock on conn passes it, so that the
+        # heartbeat is renewed in its own transaction.
+        _progress[job_id] = (fraction, message)
+        if conn is not None:
+            _beat(conn, [job_id])
+
+    data = output = None
+    try:
+        if job["has_input"]:
+            data = _input_file(job_id)
+        result, output, output_name, output_type = HANDLERS[job["kind"]](json.loads(job["params"]), data, report)
+    except Exception as exc:
+        log.exception("job %s failed", job_id)
+        _finish(job_id, "failed", f"{type(exc).__name__}: {exc}")
+    else:
+        _finish(job_id, "done", "finished", result, output, output_name, output_type)
+    finally:
+        for spool in (data, output):
+            if spool is not None:
+                spool.close()
+        _progress.pop(job_id, None)
+
+
+def _work():
+    while True:
+        try:
+            job = _claim()
+        except sqlite3.OperationalError as exc:
+            # Usually a long upload holding the write lock; try again later.
+            log.debug("could not claim a job: %s", exc)
+            job = None
+        if job is None:
+            with _wakeup:
+                _wakeup.wait(POLL_SECONDS)
+            continue
+        try:
+            run_job(job)
+        except Exception:
+            log.exception("job %s could not be run", job["job_id"])
+
+
+def ensure_workers():
+    """Starts the worker threads and their heartbeat, once per process."""
+    global _owner
+    if _workers:
+        return
+    with _workers_lock:
+        if _workers:
+            return
+        _owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        beat = threading.Thread(target=_heartbeat, name="job-heartbeat", daemon=True)
+        beat.start()
+        _workers.append(beat)
+        for i in range(max(WORKERS, 1)):
+            worker = threading.Thread(target=_work, name=f"job-worker-{i}", daemon=True)
+            worker.start()
+            _workers.append(worker)
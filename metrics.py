@@ -0,0 +1,253 @@
+"""
+Lightweight timing instrumentation, exposed in the Prometheus text format.
+
+When enabled, this records:
+
+- the latency of every request, by route, method and status;
+- how many queries each request ran, and how long they took;
+- every query's time, logging those slower than SLOW_QUERY_SECONDS to the
+  "workforce.slow_queries" logger;
+- named spans of the forecast (see timed and span) and template rendering.
+
+Set WORKFORCE_METRICS=1 to enable it and WORKFORCE_SLOW_QUERY_MS to change
+the slow query threshold (100 ms). When disabled, connections are plain
+sqlite3 connections, the request hooks do nothing, and a timed function or
+span costs one flag check.
+
+Queries are timed by the connection's execute methods, which return once the
+first row is ready, so rows fetched later are not included. Work on other
+threads (the chart renderers, batch workers) is not counted towards a
+request.
+"""
+
+import bisect
+import contextlib
+import functools
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+
+ENABLED = os.environ.get("WORKFORCE_METRICS", "0") not in ("", "0")
+SLOW_QUERY_SECONDS = float(os.environ.get("WORKFORCE_SLOW_QUERY_MS", "100")) / 1000
+
+# Prometheus's default latency buckets, in seconds.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.075, 0.1, 0.25, 0.5, 0.75, 1.0, 2.5, 5.0, 7.5, 10.0)
+QUERY_COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+slow_query_log = logging.getLogger("workforce.slow_queries")
+_local = threading.local()
+
+
+class Histogram:
+    """A Prometheus histogram with a fixed set of label names."""
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * len(self.buckets), 0.0, 0]
+            index = bisect.bisect_left(self.buckets, value)
+            if index < len(self.buckets):
+                series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def clear(self):
+        with self._lock:
+            self._series.clear()
+
+    def expose(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = sorted((labels, (list(counts), total, count))
+                            for labels, (counts, total, count) in self._series.items())
+        for label_values, (counts, total, count) in series:
+            labels = ",".join(f'{name}="{_escape(value)}"' for name, value in zip(self.labels, label_values))
+            prefix = labels + "," if labels else ""
+            cumulative = 0
+            for bound, n in zip(self.buckets, counts):
+                cumulative += n
+                lines.append(f'{self.name}_bucket{{{prefix}le="{bound}"}} {cumulative}')
+            lines.append(f'{self.name}_bucket{{{prefix}le="+Inf"}} {count}')
+            suffix = f"{{{labels}}}" if labels else ""
+            lines.append(f"{self.name}_sum{suffix} {total}")
+            lines.append(f"{self.name}_count{suffix} {count}")
+        return lines
+
+
+class Counter:
+    """A Prometheus counter without labels."""
+
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def clear(self):
+        with self._lock:
+            self.value = 0
+
+    def expose(self):
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter", f"{self.name} {self.value}"]
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+REQUEST_SECONDS = Histogram("workforce_request_seconds", "Request latency by route, method and status.",
+                            ("route", "method", "status"))
+REQUEST_QUERIES = Histogram("workforce_request_queries", "Queries run per request, by route.", ("route",),
+                            QUERY_COUNT_BUCKETS)
+REQUEST_QUERY_SECONDS = Histogram("workforce_request_query_seconds", "Time spent in queries per request, by route.",
+                                  ("route",))
+QUERY_SECONDS = Histogram("workforce_query_seconds", "Time to execute each query.")
+SLOW_QUERIES = Counter("workforce_slow_queries_total", "Queries slower than the slow query threshold.")
+SPAN_SECONDS = Histogram("workforce_span_seconds", "Time spent in instrumented functions and blocks, by span.",
+                         ("span",))
+METRICS = [REQUEST_SECONDS, REQUEST_QUERIES, REQUEST_QUERY_SECONDS, QUERY_SECONDS, SLOW_QUERIES, SPAN_SECONDS]
+
+
+def reset():
+    """Forgets everything recorded so far."""
+    for metric in METRICS:
+        metric.clear()
+
+
+def expose():
+    """Every metric in the Prometheus text exposition format."""
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.expose())
+    return "\n".join(lines) + "\n"
+
+
+# Queries
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def _record_query(sql, elapsed):
+    QUERY_SECONDS.observe(elapsed)
+    request = getattr(_local, "request", None)
+    if request is not None:
+        request[0] += 1
+        request[1] += elapsed
+    if elapsed >= SLOW_QUERY_SECONDS:
+        SLOW_QUERIES.inc()
+        slow_query_log.warning("%.1f ms: %s", elapsed * 1000, _WHITESPACE.sub(" ", sql).strip())
+
+
+class InstrumentedCursor(sqlite3.Cursor):
+    def execute(self, sql, parameters=()):
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            _record_query(sql, time.perf_counter() - start)
+
+    def executemany(self, sql, seq_of_parameters):
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            _record_query(sql, time.perf_counter() - start)
+
+
+class InstrumentedConnection(sqlite3.Connection):
+    """A connection whose cursors, and execute shortcuts, time each query."""
+
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+
+def connection_factory():
+    """The sqlite3.connect factory for new connections."""
+    return InstrumentedConnection if ENABLED else sqlite3.Connection
+
+
+# Spans
+
+def timed(name):
+    """Decorator recording each call's duration as span name."""
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not ENABLED:
+                return func(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                SPAN_SECONDS.observe(time.perf_counter() - start, name)
+        return wrapper
+    return decorate
+
+
+@contextlib.contextmanager
+def _span(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        SPAN_SECONDS.observe(time.perf_counter() - start, name)
+
+
+_NO_SPAN = contextlib.nullcontext()
+
+
+def span(name):
+    """Context manager recording the duration of its body as span name."""
+    return _span(name) if ENABLED else _NO_SPAN
+
+
+# Requests
+
+def begin_request():
+    if ENABLED:
+        _local.request = [0, 0.0, time.perf_counter()]
+
+
+def end_request(route, method, status):
+    request = getattr(_local, "request", None)
+    if request is None:
+        return
+    _local.request = None
+    queries, query_seconds, start = request
+    REQUEST_SECONDS.observe(time.perf_counter() - start, route, method, str(status))
+    REQUEST_QUERIES.observe(queries, route)
+    REQUEST_QUERY_SECONDS.observe(query_seconds, route)
+
+
+def begin_template(template):
+    if ENABLED:
+        _local.template = time.perf_counter()
+
+
+def end_template(template):
+    start = getattr(_local, "template", None)
+    if start is not None:
+        _local.template = None
+        SPAN_SECONDS.observe(time.perf_counter() - start, f"template:{template.name}")
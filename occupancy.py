@@ -0,0 +1,115 @@
+"""
+Post-based costing from the posts table.
+
+Rather than costing people, this costs posts: while a post's occupant is in
+it, it costs what the occupant costs, and for the rest of its open dates it
+is vacant and costs the planning rate of the post's grade and location
+(falling back to the occupant's when the post has none). Totals roll up by
+funding_source.
+
+The posts open in the range come from a range scan of idx_posts_interval,
+joined to their occupants on person_id, so the join is one indexed lookup per
+post. Each post then contributes three rows to a single cost_components call:
+the post over its open dates, the post over the occupied dates, and the
+occupant over the occupied dates. Vacancy is the first minus the second.
+"""
+
+import numpy as np
+
+from utils import cost_components, get_db_connection, month_range
+
+FIRST_DATE = "0001-01-01"
+LAST_DATE = "9999-12-31"
+
+
+def _open_posts(conn, start_ym, end_ym):
+    return conn.execute(f'''
+        SELECT posts.post_id, posts.funding_source,
+               COALESCE(posts.grade, people.grade) AS grade,
+               COALESCE(posts.location, people.location) AS location,
+               IFNULL(NULLIF(posts.post_start_date, ''), '{FIRST_DATE}') AS post_start_date,
+               IFNULL(NULLIF(posts.post_end_date, ''), '{LAST_DATE}') AS post_end_date,
+               people.person_id, people.grade AS occupant_grade,
+               people.location AS occupant_location, people.status AS occupant_status,
+               IFNULL(NULLIF(people.start_date, ''), '{FIRST_DATE}') AS occupant_start_date,
+               IFNULL(NULLIF(people.expected_end_date, ''), '{LAST_DATE}') AS occupant_end_date
+        FROM posts
+        LEFT JOIN people ON people.person_id = posts.person_id
+        WHERE IFNULL(NULLIF(posts.post_end_date, ''), '{LAST_DATE}') >= ?
+          AND IFNULL(NULLIF(posts.post_start_date, ''), '{FIRST_DATE}') <= ?
+        ORDER BY posts.post_id
+    ''', (f"{start_ym}-01", f"{end_ym}-31")).fetchall()
+
+
+def post_costs(start_ym, end_ym, conn=None):
+    """
+    Costs every post open between start_ym and end_ym.
+
+    Returns the months, the number of posts, and per funding_source (None for
+    posts without one) the occupied and vacant cost, vacant full-time
+    equivalent posts and total cost by month, with grand totals. No churn is
+    applied: vacancies are what this mode models instead.
+    """
+    year_months = [f"{year}-{month:02d}" for year, month in month_range(start_ym, end_ym)]
+    own_connection = conn is None
+    if own_connection:
+        conn = get_db_connection()
+    posts = _open_posts(conn, start_ym, end_ym)
+
+    # Occupied dates are the overlap of the post's and the occupant's; an
+    # empty post gets an empty overlap.
+    held = []
+    for post in posts:
+        if post["person_id"] is None:
+            held.append((LAST_DATE, FIRST_DATE))
+        else:
+            held.append((max(post["post_start_date"], post["occupant_start_date"]),
+                         min(post["post_end_date"], post["occupant_end_date"])))
+    rows = [{"grade": post["grade"], "location": post["location"], "status": None,
+             "start_date": post["post_start_date"], "expected_end_date": post["post_end_date"]}
+            for post in posts]
+    rows += [{"grade": post["grade"], "location": post["location"], "status": None,
+              "start_date": start, "expected_end_date": end}
+             for post, (start, end) in zip(posts, held)]
+    rows += [{"grade": post["occupant_grade"], "location": post["occupant_location"],
+              "status": post["occupant_status"], "start_date": start, "expected_end_date": end}
+             for post, (start, end) in zip(posts, held)]
+    rate_matrix, fraction, paid = cost_components(rows, year_months, conn)
+    if own_connection:
+        conn.close()
+
+    n_posts = len(posts)
+    post_rates = rate_matrix[:n_posts]
+    vacant_fte = fraction[:n_posts] - fraction[n_posts:2 * n_posts]
+    vacant = post_rates * vacant_fte
+    occupied = (rate_matrix * fraction * paid[:, None])[2 * n_posts:]
+
+    sources = {}
+    source_index = np.array([sources.setdefault(post["funding_source"], len(sources)) for post in posts],
+                            dtype=np.intp)
+    shape = (len(sources), len(year_months))
+    totals = {name: np.zeros(shape) for name in ("occupied", "vacant", "vacant_fte")}
+    np.add.at(totals["occupied"], source_index, occupied)
+    np.add.at(totals["vacant"], source_index, vacant)
+    np.add.at(totals["vacant_fte"], source_index, vacant_fte)
+
+    funding_sources = []
+    for source, i in sorted(sources.items(), key=lambda item: (item[0] is None, item[0] or "")):
+        monthly = totals["occupied"][i] + totals["vacant"][i]
+        funding_sources.append({
+            "funding_source": source,
+            "occupied": totals["occupied"][i].tolist(),
+            "vacant": totals["vacant"][i].tolist(),
+            "vacant_fte": totals["vacant_fte"][i].tolist(),
+            "monthly": monthly.tolist(),
+            "total": float(monthly.sum()),
+            "vacant_total": float(totals["vacant"][i].sum()),
+        })
+    monthly = totals["occupied"].sum(axis=0) + totals["vacant"].sum(axis=0)
+    return {
+        "months": year_months,
+        "posts": n_posts,
+        "funding_sources": funding_sources,
+        "monthly": monthly.tolist(),
+        "total": float(monthly.sum()),
+    }
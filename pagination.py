@@ -0,0 +1,127 @@
+"""
+Keyset pagination for the manage pages.
+
+Pages are fetched with a WHERE clause on the last row already shown rather
+than an OFFSET, so every page costs the same however deep into the table it
+is. Filterable and sortable columns are compared as IFNULL(column, '') so
+that NULLs sort first and the expression indexes created by the migrations
+in database.py can serve both the filter and the sort.
+"""
+
+import base64
+import json
+
+PAGE_SIZE = 100
+
+# Per table: its primary key and the columns that can be filtered and sorted on.
+LISTINGS = {
+    "people": ("person_id", ["name", "team", "grade", "location", "status", "start_date"]),
+    "posts": ("post_id", ["workforce_plan_number", "funding_source", "post_start_date"]),
+    "budget": ("budget_id", ["team", "work_stream", "year_month"]),
+    "salaries": ("salary_id", ["grade", "location", "year_month"]),
+}
+
+
+def encode_cursor(values):
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+
+def _bindable(value):
+    # What SQLite can bind: no containers, and integers within 64 bits.
+    if isinstance(value, bool):
+        return False
+    if isinstance(value, int):
+        return -2 ** 63 <= value < 2 ** 63
+    return value is None or isinstance(value, (str, float))
+
+
+def decode_cursor(token, length):
+    """The values in a cursor from encode_cursor, or None unless it holds exactly length bindable values."""
+    try:
+        values = json.loads(base64.urlsafe_b64decode(token.encode()))
+    except ValueError:
+        return None
+    if not isinstance(values, list) or len(values) != length or not all(_bindable(value) for value in values):
+        return None
+    return values
+
+
+def fetch_page(conn, table, filters=None, sort=None, descending=False, after=None, page_size=PAGE_SIZE):
+    """
+    Returns (rows, next_cursor) for one page of table.
+
+    filters maps column names to exact values; empty values are ignored. sort
+    is a column name (the primary key when omitted or not sortable) and after
+    is the cursor returned with the previous page. next_cursor is None on the
+    last page.
+    """
+    key, columns = LISTINGS[table]
+    if sort not in columns:
+        sort = key
+    sort_expr = key if sort == key else f"IFNULL({sort}, '')"
+    comparison = "<" if descending else ">"
+    direction = " DESC" if descending else ""
+
+    clauses = []
+    params = []
+    for column, value in (filters or {}).items():
+        if column in columns and value:
+            clauses.append(f"IFNULL({column}, '') = ?")
+            params.append(value)
+
+    def query(extra_clauses, extra_params, order, limit):
+        where = " AND ".join(clauses + extra_clauses)
+        sql = (f"SELECT * FROM {table} {'WHERE ' + where if where else ''} "
+               f"ORDER BY {', '.join(expr + direction for expr in order)} LIMIT ?")
+        return conn.execute(sql, params + extra_params + [limit]).fetchall()
+
+    # A cursor holds the primary key, preceded by the sort value unless
+    # sorting by the key; anything else starts from the first page.
+    cursor = decode_cursor(after, 1 if sort == key else 2) if after else None
+    limit = page_size + 1
+    if sort == key:
+        if cursor is not None:
+            rows = query([f"{key} {comparison} ?"], cursor, [key], limit)
+        else:
+            rows = query([], [], [key], limit)
+    elif cursor is not None:
+        # Two index seeks rather than one row-value comparison, which SQLite
+        # cannot turn into a range on an expression index: first the rest of
+        # the rows tied on the last sort value, then the rows after it.
+        value, last_key = cursor
+        rows = query([f"{sort_expr} = ?", f"{key} {comparison} ?"], [value, last_key], [key], limit)
+        if len(rows) < limit:
+            rows += query([f"{sort_expr} {comparison} ?"], [value], [sort_expr, key], limit - len(rows))
+    else:
+        rows = query([], [], [sort_expr, key], limit)
+
+    next_cursor = None
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        last = rows[-1]
+        values = [last[key]] if sort == key else [last[sort] if last[sort] is not None else "", last[key]]
+        next_cursor = encode_cursor(values)
+    return rows, next_cursor
+
+
+def page_from_request(conn, table, args):
+    """
+    Reads filters, sort, order ("asc"/"desc") and after from request args and
+    fetches that page. Returns the rows along with everything a template needs
+    to render the filter form and the next-page link.
+    """
+    _, columns = LISTINGS[table]
+    filters = {column: args.get(column, "") for column in columns}
+    sort = args.get("sort", "")
+    descending = args.get("order") == "desc"
+    rows, next_cursor = fetch_page(conn, table, filters, sort, descending, args.get("after"))
+    return {
+        "rows": rows,
+        "key": LISTINGS[table][0],
+        "columns": columns,
+        "filters": filters,
+        "sort": sort,
+        "order": "desc" if descending else "asc",
+        "next_cursor": next_cursor,
+        "first_page": not args.get("after"),
+    }
@@ -0,0 +1,191 @@
+"""
+Opt-in profiling of single requests.
+
+A request to a profiled route (see app._profiled) runs under a profiler when
+it asks to, with "?profile=cprofile" or "?profile=sample" or the same value
+in an X-Profile header, and comes from an address in WORKFORCE_PROFILE_ALLOW
+(comma-separated; empty, the default, turns profiling off).
+
+- cprofile runs the request under cProfile and saves a .pstats file, for
+  pstats, snakeviz and the like.
+- sample reads the request thread's stack every SAMPLE_INTERVAL seconds and
+  saves the samples as collapsed stacks (.collapsed), one "root;...;leaf
+  count" line per distinct stack, for flamegraph.pl or speedscope.
+
+Each capture is saved in WORKFORCE_PROFILE_DIR (default "profiles") with a
+JSON summary of its top functions; only the latest MAX_CAPTURES are kept.
+Both profilers see only the request's own thread, so time spent in the chart
+renderers shows up as waiting on their result.
+"""
+
+import cProfile
+import io
+import json
+import os
+import pstats
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timezone
+
+ALLOWED_ADDRESSES = {address.strip() for address in os.environ.get("WORKFORCE_PROFILE_ALLOW", "").split(",")
+                     if address.strip()}
+PROFILE_DIR = os.environ.get("WORKFORCE_PROFILE_DIR", "profiles")
+MODES = {"cprofile": ".pstats", "sample": ".collapsed"}
+MAX_CAPTURES = 50
+TOP_FUNCTIONS = 10
+SAMPLE_INTERVAL = 0.005
+
+CAPTURE_NAME = re.compile(r"^\d{8}T\d{12}-\d+-[a-z_]+\.(pstats|collapsed|json)$")
+_counter = 0
+_lock = threading.Lock()
+
+
+def allowed(remote_addr):
+    """Whether requests from remote_addr may be profiled and see the captures."""
+    return remote_addr in ALLOWED_ADDRESSES
+
+
+def requested_mode(value, remote_addr):
+    """
+    The profiler a request asked for with value ("1" means cprofile), or
+    None if it asked for none or its address is not allowed.
+    """
+    if not value or not allowed(remote_addr):
+        return None
+    value = "cprofile" if value == "1" else value
+    return value if value in MODES else None
+
+
+def _function_name(code):
+    module = os.path.splitext(os.path.basename(code.co_filename))[0]
+    return f"{module}:{code.co_name}"
+
+
+class Sampler:
+    """Samples one thread's stack on a background thread until stopped."""
+
+    def __init__(self, thread_id, interval=SAMPLE_INTERVAL):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="profile-sampler", daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(_function_name(frame.f_code))
+                frame = frame.f_back
+            if stack:
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+
+def _top_from_stats(profiler):
+    stats = pstats.Stats(profiler, stream=io.StringIO())
+    rows = sorted(stats.stats.items(), key=lambda item: item[1][2], reverse=True)[:TOP_FUNCTIONS]
+    return [{"function": f"{os.path.basename(filename)}:{line}({name})", "own": round(tottime, 6),
+             "cumulative": round(cumtime, 6), "calls": calls}
+            for (filename, line, name), (_, calls, tottime, cumtime, _) in rows]
+
+
+def _top_from_samples(stacks):
+    own = Counter()
+    total = Counter()
+    for stack, count in stacks.items():
+        frames = stack.split(";")
+        own[frames[-1]] += count
+        for name in set(frames):
+            total[name] += count
+    return [{"function": name, "own": count, "cumulative": total[name]}
+            for name, count in own.most_common(TOP_FUNCTIONS)]
+
+
+def capture(mode, label, func, *args, **kwargs):
+    """
+    Calls func under the profiler for mode, saves the capture and returns
+    (func's result, the capture's summary). label names the route.
+    """
+    global _counter
+    start = time.perf_counter()
+    if mode == "cprofile":
+        profiler = cProfile.Profile()
+        try:
+            result = profiler.runcall(func, *args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - start
+    else:
+        sampler = Sampler(threading.get_ident())
+        sampler.start()
+        try:
+            result = func(*args, **kwargs)
+        finally:
+            sampler.stop()
+            elapsed = time.perf_counter() - start
+
+    with _lock:
+        _counter += 1
+        created = datetime.now(timezone.utc)
+        stem = f"{created:%Y%m%dT%H%M%S%f}-{_counter}-{re.sub(r'[^a-z_]', '_', label.lower())}"
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    filename = stem + MODES[mode]
+    if mode == "cprofile":
+        profiler.dump_stats(os.path.join(PROFILE_DIR, filename))
+        top = _top_from_stats(profiler)
+    else:
+        with open(os.path.join(PROFILE_DIR, filename), "w") as stream:
+            for stack, count in sorted(sampler.stacks.items()):
+                stream.write(f"{stack} {count}\n")
+        top = _top_from_samples(sampler.stacks)
+    summary = {
+        "name": stem,
+        "file": filename,
+        "route": label,
+        "mode": mode,
+        "created": created.strftime("%Y-%m-%dT%H:%M:%SZ"),
+        "seconds": round(elapsed, 6),
+        "top": top,
+    }
+    with open(os.path.join(PROFILE_DIR, stem + ".json"), "w") as stream:
+        json.dump(summary, stream)
+    _prune()
+    return result, summary
+
+
+def list_captures():
+    """Summaries of the saved captures, newest first."""
+    if not os.path.isdir(PROFILE_DIR):
+        return []
+    captures = []
+    for filename in os.listdir(PROFILE_DIR):
+        if filename.endswith(".json") and CAPTURE_NAME.match(filename):
+            with open(os.path.join(PROFILE_DIR, filename)) as stream:
+                captures.append(json.load(stream))
+    return sorted(captures, key=lambda summary: summary["name"], reverse=True)
+
+
+def capture_path(filename):
+    """The path of a saved capture file, or None if there is no such capture."""
+    if not CAPTURE_NAME.match(filename):
+        return None
+    path = os.path.join(PROFILE_DIR, filename)
+    return path if os.path.isfile(path) else None
+
+
+def _prune():
+    for summary in list_captures()[MAX_CAPTURES:]:
+        for filename in (summary["file"], summary["name"] + ".json"):
+            path = capture_path(filename)
+            if path:
+                os.remove(path)
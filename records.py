@@ -0,0 +1,158 @@
+"""
+Typed, compact records for the forecast.
+
+A sqlite3.Row keeps every column as a separate Python object behind a
+mapping, so code that reads people from it re-parses date strings and
+lower-cases status every time. load_people instead builds one slotted Person
+per row, once per load. Each Person has its dates as proleptic Gregorian
+ordinals (date.toordinal) and its status as a Status. The repeated grade,
+location, team, work stream and contract type strings are interned, so 100k
+people share a few hundred string objects.
+
+utils.cost_components accepts Person records or rows; person_columns turns
+either into the arrays it works on.
+"""
+
+import enum
+import sys
+from dataclasses import dataclass
+from datetime import date
+
+import numpy as np
+
+from intervals import FIRST_DATE, LAST_DATE, parse_dates
+
+FIRST_ORDINAL = date.min.toordinal()
+LAST_ORDINAL = date.max.toordinal()
+# datetime64[D] counts days from 1970-01-01.
+EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+
+class Status(enum.Enum):
+    ACTIVE = "active"
+    LOAN_OUT = "loan-out"
+    LOAN_OUT_UNPAID = "loan-out_unpaid"
+    OTHER = "other"
+
+    @classmethod
+    def parse(cls, text):
+        """The Status for a people.status value, ignoring case; OTHER for anything unrecognised or empty."""
+        return _STATUSES.get((text or "").lower(), cls.OTHER)
+
+    @property
+    def paid(self):
+        """People out on loan cost nothing."""
+        return self not in (Status.LOAN_OUT, Status.LOAN_OUT_UNPAID)
+
+
+_STATUSES = {status.value: status for status in Status}
+
+
+def _intern(text):
+    return None if text is None else sys.intern(text)
+
+
+def to_ordinal(text, missing):
+    """A "YYYY-MM-DD" string as a date ordinal; missing when empty or NULL."""
+    return date.fromisoformat(text).toordinal() if text else missing
+
+
+@dataclass(slots=True)
+class Person:
+    person_id: int | None
+    name: str | None
+    team: str | None
+    grade: str | None
+    work_stream: str | None
+    location: str | None
+    contract_type: str | None
+    status: Status
+    start: int  # date ordinal, FIRST_ORDINAL when there is no start date
+    end: int    # date ordinal, LAST_ORDINAL when there is no expected end date
+
+    @classmethod
+    def from_row(cls, row):
+        return cls(
+            person_id=row["person_id"],
+            name=row["name"],
+            team=_intern(row["team"]),
+            grade=_intern(row["grade"]),
+            work_stream=_intern(row["work_stream"]),
+            location=_intern(row["location"]),
+            contract_type=_intern(row["contract_type"]),
+            status=Status.parse(row["status"]),
+            start=to_ordinal(row["start_date"], FIRST_ORDINAL),
+            end=to_ordinal(row["expected_end_date"], LAST_ORDINAL),
+        )
+
+
+@dataclass(slots=True)
+class Rate:
+    grade: str
+    location: str
+    year_month: str
+    monthly_planning_rate: float
+
+
+PERSON_COLUMNS = ("person_id", "name", "team", "grade", "work_stream", "location", "contract_type",
+                  "status", "start_date", "expected_end_date")
+
+
+def load_people(conn, where="", params=()):
+    """Person records for the people matching the optional WHERE clause, by person_id."""
+    # Plain tuples, as the columns are unpacked by position.
+    rows = conn.cursor()
+    rows.row_factory = None
+    rows.execute(f"SELECT {', '.join(PERSON_COLUMNS)} FROM people {where} ORDER BY person_id", params)
+    # The same few hundred strings, statuses and dates recur across people,
+    # so each is interned or parsed once per load.
+    strings = {None: None}
+    statuses = {}
+    starts = {}
+    ends = {}
+    people = []
+    for person_id, name, team, grade, work_stream, location, contract_type, status, start, end in rows:
+        if status not in statuses:
+            statuses[status] = Status.parse(status)
+        if start not in starts:
+            starts[start] = to_ordinal(start, FIRST_ORDINAL)
+        if end not in ends:
+            ends[end] = to_ordinal(end, LAST_ORDINAL)
+        people.append(Person(
+            person_id, name, strings.setdefault(team, team), strings.setdefault(grade, grade),
+            strings.setdefault(work_stream, work_stream), strings.setdefault(location, location),
+            strings.setdefault(contract_type, contract_type), statuses[status], starts[start], ends[end],
+        ))
+    return people
+
+
+def load_rates(conn, year_months):
+    """Rate records for every salaries row in the given "YYYY-MM" months, by salary_id."""
+    year_months = list(year_months)
+    if not year_months:
+        return []
+    placeholders = ", ".join("?" for _ in year_months)
+    rows = conn.execute(f'''
+        SELECT grade, location, year_month, monthly_planning_rate
+        FROM salaries
+        WHERE year_month IN ({placeholders})
+        ORDER BY salary_id
+    ''', year_months)
+    return [Rate(_intern(grade), _intern(location), year_month, rate) for grade, location, year_month, rate in rows]
+
+
+def person_columns(people):
+    """
+    The start and end dates (datetime64[D]), grades, locations and paid
+    flags of Person records or people rows, as parallel sequences.
+    """
+    if people and isinstance(people[0], Person):
+        n = len(people)
+        starts = (np.fromiter((p.start for p in people), np.int64, n) - EPOCH_ORDINAL).astype("datetime64[D]")
+        ends = (np.fromiter((p.end for p in people), np.int64, n) - EPOCH_ORDINAL).astype("datetime64[D]")
+        paid = np.fromiter((p.status.paid for p in people), bool, n)
+        return starts, ends, [p.grade for p in people], [p.location for p in people], paid
+    starts = parse_dates([p["start_date"] for p in people], FIRST_DATE)
+    ends = parse_dates([p["expected_end_date"] for p in people], LAST_DATE)
+    paid = np.array([Status.parse(p["status"]).paid for p in people], dtype=bool)
+    return starts, ends, [p["grade"] for p in people], [p["location"] for p in people], paid
@@ -0,0 +1,226 @@
+"""
+What-if scenarios as sparse overlays on the base tables.
+
+A scenario stores only how it differs from the base data: people added (with
+a headcount, so "40 G7s in Leeds from April" is one row), base people
+modified or removed, planning rate multipliers by grade, location and month
+range, and an optional churn rate. The base tables are never copied or
+changed.
+
+compare_scenarios costs the base people once and sums them by (grade,
+location) and month. Each scenario then only costs the people its overlay
+touches and rescales those sums by its multipliers, so dozens of scenarios
+side by side cost little more than one forecast.
+"""
+
+import numpy as np
+
+from utils import calculate_cost_matrix, get_db_connection, get_global_churn_rate, month_range
+
+PERSON_FIELDS = ["name", "team", "grade", "work_stream", "location", "contract_type",
+                 "status", "start_date", "expected_end_date"]
+ACTIONS = ("add", "modify", "remove")
+
+
+def list_scenarios(conn):
+    return conn.execute("SELECT * FROM scenarios ORDER BY name").fetchall()
+
+
+def create_scenario(conn, name, description=None, churn_rate=None):
+    """Creates an empty scenario and returns its id. Raises sqlite3.IntegrityError if the name is taken."""
+    c = conn.execute(
+        "INSERT INTO scenarios (name, description, churn_rate) VALUES (?, ?, ?)",
+        (name, description, churn_rate),
+    )
+    conn.commit()
+    return c.lastrowid
+
+
+def delete_scenario(conn, scenario_id):
+    for table in ("scenario_people", "scenario_rates", "scenarios"):
+        conn.execute(f"DELETE FROM {table} WHERE scenario_id = ?", (scenario_id,))
+    conn.commit()
+
+
+def add_person_change(conn, scenario_id, action, person_id=None, headcount=1, **fields):
+    """
+    Records one change to the people in a scenario. "add" needs at least a
+    grade and location and adds headcount identical people; "modify" and
+    "remove" need the base person_id, and "modify" overrides only the fields
+    given. Returns the change id.
+    """
+    if action not in ACTIONS:
+        raise ValueError(f"action must be one of {', '.join(ACTIONS)}")
+    if action == "add":
+        missing = [field for field in ("grade", "location") if not fields.get(field)]
+        if missing:
+            raise ValueError(f"added people need {', '.join(missing)}")
+        if headcount < 1:
+            raise ValueError("headcount must be at least 1")
+    elif person_id is None:
+        raise ValueError(f"{action} needs a person_id")
+    values = [fields.get(field) or None for field in PERSON_FIELDS]
+    c = conn.execute(
+        f"""
+        INSERT INTO scenario_people (scenario_id, action, person_id, headcount, {', '.join(PERSON_FIELDS)})
+        VALUES (?, ?, ?, ?, {', '.join('?' for _ in PERSON_FIELDS)})
+        """,
+        [scenario_id, action, person_id, headcount] + values,
+    )
+    conn.commit()
+    return c.lastrowid
+
+
+def add_rate_multiplier(conn, scenario_id, multiplier, grade=None, location=None, start_month=None, end_month=None):
+    """
+    Scales planning rates in a scenario, e.g. 1.03 for a 3% uplift. Unset
+    grade, location or months match everything; overlapping multipliers
+    compound. Returns the multiplier id.
+    """
+    c = conn.execute(
+        """
+        INSERT INTO scenario_rates (scenario_id, grade, location, start_month, end_month, multiplier)
+        VALUES (?, ?, ?, ?, ?, ?)
+        """,
+        (scenario_id, grade or None, location or None, start_month or None, end_month or None, multiplier),
+    )
+    conn.commit()
+    return c.lastrowid
+
+
+def delete_person_change(conn, change_id):
+    conn.execute("DELETE FROM scenario_people WHERE change_id = ?", (change_id,))
+    conn.commit()
+
+
+def delete_rate_multiplier(conn, multiplier_id):
+    conn.execute("DELETE FROM scenario_rates WHERE multiplier_id = ?", (multiplier_id,))
+    conn.commit()
+
+
+def load_overlays(conn, scenario_ids):
+    """
+    Returns {scenario_id: {"scenario", "people", "rates"}} for the given
+    scenarios, in the order given. Unknown ids are skipped.
+    """
+    overlays = {}
+    for scenario_id in scenario_ids:
+        scenario = conn.execute("SELECT * FROM scenarios WHERE scenario_id = ?", (scenario_id,)).fetchone()
+        if scenario is None:
+            continue
+        overlays[scenario_id] = {
+            "scenario": scenario,
+            "people": conn.execute(
+                "SELECT * FROM scenario_people WHERE scenario_id = ? ORDER BY change_id", (scenario_id,)
+            ).fetchall(),
+            "rates": conn.execute(
+                "SELECT * FROM scenario_rates WHERE scenario_id = ? ORDER BY multiplier_id", (scenario_id,)
+            ).fetchall(),
+        }
+    return overlays
+
+
+def _apply_changes(base_by_id, changes):
+    """
+    Applies a scenario's people changes in order. Returns the ids of the base
+    people whose cost comes out and the (row, weight) pairs whose cost goes
+    in: added people weighted by headcount, and modified people as changed.
+    """
+    touched = {}
+    added = []
+    for change in changes:
+        if change["action"] == "add":
+            row = {field: change[field] for field in PERSON_FIELDS}
+            added.append((dict(row, person_id=None), change["headcount"]))
+            continue
+        person_id = change["person_id"]
+        if person_id not in base_by_id:
+            continue
+        if change["action"] == "remove":
+            touched[person_id] = None
+        elif touched.get(person_id, base_by_id[person_id]) is not None:
+            row = dict(touched.get(person_id, base_by_id[person_id]))
+            row.update({field: change[field] for field in PERSON_FIELDS if change[field] is not None})
+            touched[person_id] = row
+    added += [(row, 1) for row in touched.values() if row is not None]
+    return list(touched), added
+
+
+def _multipliers(rates, keys, year_months):
+    """A (grade, location) x months table of the product of every matching multiplier."""
+    table = np.ones((len(keys), len(year_months)))
+    grades = np.array([grade for grade, _ in keys], dtype=object)
+    locations = np.array([location for _, location in keys], dtype=object)
+    months = np.array(year_months)
+    for rate in rates:
+        rows = np.ones(len(keys), dtype=bool)
+        if rate["grade"]:
+            rows &= grades == rate["grade"]
+        if rate["location"]:
+            rows &= locations == rate["location"]
+        columns = np.ones(len(year_months), dtype=bool)
+        if rate["start_month"]:
+            columns &= months >= rate["start_month"]
+        if rate["end_month"]:
+            columns &= months <= rate["end_month"]
+        table[np.ix_(rows, columns)] *= rate["multiplier"]
+    return table
+
+
+def compare_scenarios(scenario_ids, start_ym, end_ym, include_base=True, conn=None):
+    """
+    Forecasts each scenario (and the base data, unless include_base is
+    false) over every month from start_ym to end_ym.
+
+    Returns {"months": [...], "scenarios": [...]} where each scenario entry
+    has scenario_id (None for the base), name, churn_rate, monthly totals
+    after churn and their total.
+    """
+    year_months = [f"{year}-{month:02d}" for year, month in month_range(start_ym, end_ym)]
+    own_connection = conn is None
+    if own_connection:
+        conn = get_db_connection()
+    people = conn.execute("SELECT * FROM people").fetchall()
+    base_costs = calculate_cost_matrix(people, year_months, conn)
+    overlays = load_overlays(conn, scenario_ids)
+
+    # Everything the overlays add or change is costed together in one call.
+    base_by_id = {person["person_id"]: person for person in people}
+    plans = []
+    extra_rows = []
+    extra_weights = []
+    for scenario_id, overlay in overlays.items():
+        removed, added = _apply_changes(base_by_id, overlay["people"])
+        plans.append((overlay, removed, len(extra_rows), len(extra_rows) + len(added)))
+        extra_rows += [row for row, _ in added]
+        extra_weights += [weight for _, weight in added]
+    extra_costs = calculate_cost_matrix(extra_rows, year_months, conn) * np.array(extra_weights, dtype=float)[:, None]
+    base_churn = get_global_churn_rate()
+    if own_connection:
+        conn.close()
+
+    keys = {}
+    base_index = np.array([keys.setdefault((p["grade"], p["location"]), len(keys)) for p in people], dtype=int)
+    extra_index = np.array([keys.setdefault((p["grade"], p["location"]), len(keys)) for p in extra_rows], dtype=int)
+    base_groups = np.zeros((len(keys), len(year_months)))
+    np.add.at(base_groups, base_index, base_costs)
+    row_of = {person["person_id"]: i for i, person in enumerate(people)}
+
+    def entry(scenario_id, name, churn_rate, groups):
+        monthly = groups.sum(axis=0) * (1 - churn_rate)
+        return {"scenario_id": scenario_id, "name": name, "churn_rate": churn_rate,
+                "monthly": monthly.tolist(), "total": float(monthly.sum())}
+
+    results = []
+    if include_base:
+        results.append(entry(None, "Base", base_churn, base_groups))
+    for overlay, removed, first, last in plans:
+        groups = base_groups.copy()
+        rows = np.array([row_of[person_id] for person_id in removed], dtype=int)
+        np.subtract.at(groups, base_index[rows], base_costs[rows])
+        np.add.at(groups, extra_index[first:last], extra_costs[first:last])
+        groups *= _multipliers(overlay["rates"], keys, year_months)
+        scenario = overlay["scenario"]
+        churn_rate = base_churn if scenario["churn_rate"] is None else scenario["churn_rate"]
+        results.append(entry(scenario["scenario_id"], scenario["name"], churn_rate, groups))
+    return {"months": year_months, "scenarios": results}
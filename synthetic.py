@@ -0,0 +1,180 @@
+"""
+Seedable synthetic workforce data, for benchmarks and demonstrations.
+
+generate fills people, posts, salaries, budget and parameters with data
+shaped like a real plan: people spread across grades, locations, teams and
+work streams, about one in three with an expected end date; a post for most
+people plus some vacant ones; a rate card for every grade, location and month
+with a pay award each April; and a budget for every team and work stream by
+month. The same seed always gives the same data.
+
+    python synthetic.py --people 10000 --years 3 --seed 1 --db demo.db
+
+csv_upload builds the same kind of rows as a CSV upload for ingest.
+"""
+
+import argparse
+import csv
+import io
+import random
+import sqlite3
+
+import database
+
+GRADES = ["AA", "AO", "EO", "HEO", "SEO", "G7", "G6", "SCS1"]
+LOCATIONS = ["London", "Leeds", "Manchester", "Bristol", "Cardiff", "Glasgow"]
+CONTRACT_TYPES = ["permanent", "fixed-term", "contractor"]
+STATUSES = ["active", "active", "active", "loan-out"]
+FUNDING_SOURCES = ["Core", "Project", "Grant"]
+WORK_STREAMS = 10
+PAY_AWARD = 0.03
+
+COLUMNS = {
+    "people": ["name", "team", "grade", "work_stream", "location", "contract_type", "status", "start_date",
+               "expected_end_date"],
+    "posts": ["workforce_plan_number", "funding_source", "post_start_date", "post_end_date", "person_id",
+              "grade", "location"],
+    "budget": ["team", "work_stream", "year_month", "allocated_budget"],
+}
+
+
+def _date(rng, year):
+    return f"{year}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}"
+
+
+def people_rows(rng, n_people, start_year, years=1, n_teams=50):
+    """Rows for people: starting up to a year before start_year, about 30% leaving within the plan."""
+    for i in range(n_people):
+        start = _date(rng, start_year - 1 + rng.randint(0, years))
+        end = _date(rng, start_year + rng.randint(0, years)) if rng.random() < 0.3 else None
+        yield (f"Person {i}", f"Team {rng.randint(1, n_teams)}", rng.choice(GRADES),
+               f"Stream {rng.randint(1, WORK_STREAMS)}", rng.choice(LOCATIONS), rng.choice(CONTRACT_TYPES),
+               rng.choice(STATUSES), start, end)
+
+
+def post_rows(rng, people, start_year, years=1, vacant=0.2):
+    """
+    Rows for posts: one for each of people, a sequence of (person_id, grade,
+    location) tuples, plus vacant posts making up the given fraction of the total.
+    """
+    slots = list(people)
+    n_vacant = round(len(slots) * vacant / (1 - vacant))
+    slots += [(None, rng.choice(GRADES), rng.choice(LOCATIONS)) for _ in range(n_vacant)]
+    for i, (person_id, grade, location) in enumerate(slots):
+        end = _date(rng, start_year + years) if rng.random() < 0.5 else None
+        yield (f"WP{i:06d}", rng.choice(FUNDING_SOURCES), f"{start_year - 1}-{rng.randint(1, 12):02d}-01", end,
+               person_id, grade, location)
+
+
+def salary_rows(start_year, years=1):
+    """A rate for every grade, location and month, rising by PAY_AWARD each April."""
+    for g, grade in enumerate(GRADES):
+        for l, location in enumerate(LOCATIONS):
+            base = 2000.0 + 500 * g + 100 * l
+            for year in range(start_year, start_year + years):
+                for month in range(1, 13):
+                    awards = year - start_year + (month >= 4)
+                    yield grade, location, f"{year}-{month:02d}", round(base * (1 + PAY_AWARD) ** awards, 2)
+
+
+def budget_rows(rng, start_year, years=1, n_teams=50):
+    """A budget for every team and work stream in every month."""
+    for team in range(1, n_teams + 1):
+        for stream in range(1, WORK_STREAMS + 1):
+            amount = rng.randint(5000, 60000)
+            for year in range(start_year, start_year + years):
+                for month in range(1, 13):
+                    yield f"Team {team}", f"Stream {stream}", f"{year}-{month:02d}", float(amount)
+
+
+def generate(conn, n_people, start_year, years=1, seed=0, n_teams=50, posts=True, budget=True):
+    """
+    Adds n_people synthetic people, with pay rates for years years from
+    start_year and a churn_rate parameter, to the database on conn. With
+    posts, adds their posts and some vacant ones; with budget, a budget for
+    every team and work stream. Moves the data version on.
+    """
+    rng = random.Random(seed)
+    c = conn.cursor()
+    c.executemany(
+        """
+        INSERT INTO salaries (grade, location, year_month, monthly_planning_rate)
+        VALUES (?, ?, ?, ?)
+        """,
+        salary_rows(start_year, years),
+    )
+    c.executemany(
+        """
+        INSERT INTO people (name, team, grade, work_stream, location, contract_type, status, start_date, expected_end_date)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """,
+        people_rows(rng, n_people, start_year, years, n_teams),
+    )
+    if posts:
+        people = c.execute("SELECT person_id, grade, location FROM people ORDER BY person_id").fetchall()
+        c.executemany(
+            """
+            INSERT INTO posts (workforce_plan_number, funding_source, post_start_date, post_end_date, person_id,
+                               grade, location)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            """,
+            post_rows(rng, [tuple(person) for person in people], start_year, years),
+        )
+    if budget:
+        c.executemany(
+            "INSERT INTO budget (team, work_stream, year_month, allocated_budget) VALUES (?, ?, ?, ?)",
+            budget_rows(rng, start_year, years, n_teams),
+        )
+    c.execute("INSERT INTO parameters (param_name, param_value) VALUES ('churn_rate', 0.05)")
+    conn.commit()
+    database.bump_data_version(conn)
+
+
+def csv_upload(table, n_rows, start_year=2025, seed=0):
+    """
+    An in-memory CSV upload of n_rows for the given ingest table. Pay rates
+    use made-up locations so that every row is a new (grade, location,
+    month) rather than an update.
+    """
+    rng = random.Random(seed)
+    text = io.StringIO()
+    writer = csv.writer(text)
+    if table == "people":
+        writer.writerow(COLUMNS["people"])
+        writer.writerows(people_rows(rng, n_rows, start_year))
+    elif table == "posts":
+        writer.writerow(COLUMNS["posts"])
+        slots = [(None, rng.choice(GRADES), rng.choice(LOCATIONS)) for _ in range(n_rows)]
+        writer.writerows(post_rows(rng, slots, start_year, vacant=0))
+    elif table == "budget":
+        writer.writerow(COLUMNS["budget"])
+        for i in range(n_rows):
+            writer.writerow([f"Team {i % 500}", f"Stream {i % 10}", f"{2000 + i // 6000}-{i % 12 + 1:02d}",
+                             rng.randint(10000, 90000)])
+    else:
+        writer.writerow(["location", "grade", "date", "pay"])
+        for i in range(n_rows):
+            writer.writerow([f"Location {i % 1000}", GRADES[i // 1000 % len(GRADES)],
+                             f"{2000 + i // 96000}-{i // 8000 % 12 + 1:02d}", rng.randint(2000, 9000)])
+    return text.getvalue().encode()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--people", type=int, default=1000)
+    parser.add_argument("--years", type=int, default=1, help="years of pay rates and budget")
+    parser.add_argument("--start-year", type=int, default=2025)
+    parser.add_argument("--teams", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--db", help="database file (default: WORKFORCE_DB or workforce_model.db)")
+    args = parser.parse_args()
+    path = args.db or database.DATABASE_NAME
+    conn = sqlite3.connect(path)
+    database.migrate(conn)
+    generate(conn, args.people, args.start_year, args.years, args.seed, args.teams)
+    conn.close()
+    print(f"{args.people} people, {args.years} years of pay rates and budget in {path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,41 +1,56 @@
-import sqlite3
-from datetime import datetime, timedelta, date
+from datetime import datetime, date
 import calendar
+import threading
 
+import numpy as np
+
+import metrics
+from cache import LRUCache
+import database
+from database import get_data_version, get_pool
+from intervals import month_bounds
+from records import Person, load_people, load_rates, person_columns
+from workdays import DEFAULT_CALENDAR, build_calendars, load_holidays
+
+# Planning rates, parameters and holidays change a few times a month but are
+# read by every forecast, so they are kept per process. Entries are keyed on
+# the database and its data version, so writes from anywhere that move the
+# version on (other processes, the CLI) are seen; write routes also call
+# invalidate_rate_cache() so the change shows before the version moves.
+# Months of rates are the bulk of the entries.
+rate_cache = LRUCache(maxsize=600)
+_MISSING = object()
+# Moved on by invalidate_rate_cache, so that a value loaded before it is not
+# put back afterwards.
+_generation = 0
+_generation_lock = threading.Lock()
+
+@metrics.timed("get_db_connection")
 def get_db_connection():
-    conn = sqlite3.connect("workforce_model.db")
-    conn.row_factory = sqlite3.Row
-    return conn
-
-def working_days_in_month(year, month, exclude_weekends=True):
-    total_working_days = 0
-    cal = calendar.Calendar()
-    for day in cal.itermonthdates(year, month):
-        if day.month == month:
-            if exclude_weekends:
-                if day.weekday() < 5:  # Monday-Friday
-                    total_working_days += 1
-            else:
-                total_working_days += 1
-    return total_working_days
-
-def working_days_in_period(period_start, period_end):
-    total = 0
-    current = period_start
-    while current <= period_end:
-        if current.weekday() < 5:
-            total += 1
-        current += timedelta(days=1)
-    return total
-
-def calculate_prorated_cost(monthly_planning_rate, person_start, person_end, year, month):
+    # Pooled; inside a Flask request every call shares the request's connection.
+    return get_pool().acquire()
+
+def working_days_in_month(year, month, exclude_weekends=True, work_calendar=None):
+    last_day = calendar.monthrange(year, month)[1]
+    if not exclude_weekends:
+        return last_day
+    return working_days_in_period(date(year, month, 1), date(year, month, last_day), work_calendar)
+
+def working_days_in_period(period_start, period_end, work_calendar=None):
+    # Weekdays only unless a calendar carrying public holidays is supplied.
+    return (work_calendar or DEFAULT_CALENDAR).working_days(period_start, period_end)
+
+def calculate_prorated_cost(monthly_planning_rate, person_start, person_end, year, month, work_calendar=None):
     month_start = date(year, month, 1)
     last_day = calendar.monthrange(year, month)[1]
     month_end = date(year, month, last_day)
     
-    # Convert string dates to date objects.
-    start_date = datetime.strptime(person_start, "%Y-%m-%d").date() if person_start else month_start
-    end_date = datetime.strptime(person_end, "%Y-%m-%d").date() if person_end else month_end
+    # Convert string dates to date objects; records.Person dates arrive as dates already.
+    if isinstance(person_start, date):
+        start_date, end_date = person_start, person_end
+    else:
+        start_date = datetime.strptime(person_start, "%Y-%m-%d").date() if person_start else month_start
+        end_date = datetime.strptime(person_end, "%Y-%m-%d").date() if person_end else month_end
     
     # Determine the effective occupancy within the month.
     effective_start = max(start_date, month_start)
@@ -44,41 +59,121 @@ def calculate_prorated_cost(monthly_planning_rate, person_start, person_end, yea
     if effective_start > effective_end:
         return 0.0
 
-    working_days_month = working_days_in_month(year, month)
-    working_days_active = working_days_in_period(effective_start, effective_end)
+    working_days_month = working_days_in_month(year, month, work_calendar=work_calendar)
+    working_days_active = working_days_in_period(effective_start, effective_end, work_calendar)
     return monthly_planning_rate * (working_days_active / working_days_month)
 
 def get_planning_rate(grade, location, forecast_year, forecast_month):
     target_ym = f"{forecast_year}-{forecast_month:02d}"
+    return get_month_rates([target_ym]).get((grade, location, target_ym), 0.0)
+
+def _cache_key(conn, *key):
+    return (database.DATABASE_NAME, get_data_version(conn)[0]) + key
+
+def _cache_put(generation, key, value):
+    # Skipped if the cache was invalidated while the value was being loaded.
+    with _generation_lock:
+        if generation == _generation:
+            rate_cache.put(key, value)
+
+def get_parameter(param_name, default=0.0):
+    """
+    Returns the value of a row in the parameters table, served from rate_cache.
+    """
     conn = get_db_connection()
-    c = conn.cursor()
-    c.execute('''
-        SELECT monthly_planning_rate
-        FROM salaries
-        WHERE grade = ? AND location = ? AND year_month = ?
-        LIMIT 1
-    ''', (grade, location, target_ym))
-    row = c.fetchone()
+    generation = _generation
+    key = _cache_key(conn, "param", param_name)
+    value = rate_cache.get(key, _MISSING)
+    if value is _MISSING:
+        c = conn.cursor()
+        c.execute("SELECT param_value FROM parameters WHERE param_name = ? LIMIT 1", (param_name,))
+        row = c.fetchone()
+        value = row["param_value"] if row else None
+        _cache_put(generation, key, value)
     conn.close()
-    if row:
-        return row["monthly_planning_rate"]
-    else:
-        return 0.0
+    return default if value is None else value
 
 def get_global_churn_rate():
-    conn = get_db_connection()
-    c = conn.cursor()
-    c.execute("SELECT param_value FROM parameters WHERE param_name = 'churn_rate' LIMIT 1")
-    row = c.fetchone()
-    conn.close()
-    if row:
-        return row["param_value"]
-    else:
-        return 0.0
+    return get_parameter("churn_rate", 0.0)
+
+def get_month_rates(year_months, conn=None):
+    """
+    Returns planning rates for the given "YYYY-MM" months keyed by
+    (grade, location, year_month). Months already in rate_cache cost no query;
+    the rest are loaded together in one.
+    """
+    close = conn is None
+    if close:
+        conn = get_db_connection()
+    generation = _generation
+    key = _cache_key(conn, "rates")
+    rates = {}
+    missing = []
+    for ym in year_months:
+        month_rates = rate_cache.get(key + (ym,))
+        if month_rates is None:
+            missing.append(ym)
+        else:
+            rates.update(month_rates)
+    if missing:
+        loaded = load_planning_rates(conn, missing)
+        by_month = {ym: {} for ym in missing}
+        for rate_key, rate in loaded.items():
+            by_month[rate_key[2]][rate_key] = rate
+        for ym, month_rates in by_month.items():
+            _cache_put(generation, key + (ym,), month_rates)
+            rates.update(month_rates)
+    if close:
+        conn.close()
+    return rates
+
+def get_holidays(conn=None):
+    """
+    Returns public holidays by location (see workdays.load_holidays), served
+    from rate_cache.
+    """
+    close = conn is None
+    if close:
+        conn = get_db_connection()
+    generation = _generation
+    key = _cache_key(conn, "holidays")
+    holidays = rate_cache.get(key)
+    if holidays is None:
+        holidays = load_holidays(conn)
+        _cache_put(generation, key, holidays)
+    if close:
+        conn.close()
+    return holidays
+
+def invalidate_rate_cache():
+    """
+    Empties rate_cache. Call after any write to salaries, parameters or
+    public_holidays, so the change is seen before the data version moves on.
+    """
+    global _generation
+    with _generation_lock:
+        _generation += 1
+        rate_cache.clear()
 
-def calculate_person_cost(person, year, month):
-    # Retrieve planning rate for the given month.
-    planning_rate = get_planning_rate(person["grade"], person["location"], year, month)
+def load_planning_rates(conn, year_months):
+    """
+    Loads every planning rate for the given "YYYY-MM" months in one query and
+    returns a dict keyed by (grade, location, year_month).
+    """
+    rates = {}
+    for rate in load_rates(conn, year_months):
+        # Keep the first match per key, as get_planning_rate's LIMIT 1 does.
+        rates.setdefault((rate.grade, rate.location, rate.year_month), rate.monthly_planning_rate)
+    return rates
+
+def calculate_person_cost(person, year, month, rates=None, work_calendar=None):
+    if isinstance(person, Person):
+        return _record_cost(person, year, month, rates, work_calendar)
+    # Retrieve planning rate for the given month, from the preloaded index if supplied.
+    if rates is None:
+        planning_rate = get_planning_rate(person["grade"], person["location"], year, month)
+    else:
+        planning_rate = rates.get((person["grade"], person["location"], f"{year}-{month:02d}"), 0.0)
     
     status = person["status"].lower() if person["status"] else ""
     # If the status indicates an external or unpaid assignment, return zero cost.
@@ -90,37 +185,145 @@ def calculate_person_cost(person, year, month):
     start_date = person["start_date"] if person["start_date"] else f"{year}-{month:02d}-01"
     end_date = person["expected_end_date"] if person["expected_end_date"] else f"{year}-{month:02d}-{last_day:02d}"
     
-    cost = calculate_prorated_cost(planning_rate, start_date, end_date, year, month)
+    cost = calculate_prorated_cost(planning_rate, start_date, end_date, year, month, work_calendar)
     return cost
 
-def run_forecast(year, month):
+def _record_cost(person, year, month, rates=None, work_calendar=None):
+    # calculate_person_cost for a records.Person: nothing to parse or lower-case.
+    if not person.status.paid:
+        return 0.0
+    if rates is None:
+        planning_rate = get_planning_rate(person.grade, person.location, year, month)
+    else:
+        planning_rate = rates.get((person.grade, person.location, f"{year}-{month:02d}"), 0.0)
+    return calculate_prorated_cost(planning_rate, date.fromordinal(person.start), date.fromordinal(person.end),
+                                   year, month, work_calendar)
+
+def month_range(start_ym, end_ym):
+    """
+    Returns the (year, month) pairs from start_ym to end_ym inclusive, both "YYYY-MM".
+    """
+    start_year, start_month = (int(part) for part in start_ym.split("-"))
+    end_year, end_month = (int(part) for part in end_ym.split("-"))
+    months = []
+    year, month = start_year, start_month
+    while (year, month) <= (end_year, end_month):
+        months.append((year, month))
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+    return months
+
+@metrics.timed("cost_components")
+def cost_components(people, year_months, conn=None, cached=True):
+    """
+    The factors of calculate_cost_matrix for the given people (rows or
+    records.Person) and "YYYY-MM" months: the planning rate and the fraction of working days in
+    post (both people x months), and whether each person is paid at all.
+    Without cached, rates and holidays are read from conn rather than rate_cache.
+    """
+    if cached:
+        rates = get_month_rates(year_months, conn)
+        holidays = get_holidays(conn)
+    else:
+        rates = load_planning_rates(conn, year_months)
+        holidays = load_holidays(conn)
+    if not people or not year_months:
+        shape = (len(people), len(year_months))
+        return np.zeros(shape), np.zeros(shape), np.ones(len(people), dtype=bool)
+
+    month_starts, month_ends = month_bounds(year_months)
+    starts, ends, grades, person_locations, paid = person_columns(people)
+
+    # One working-day calendar per location, covering just the forecast months.
+    locations = {}
+    location_index = np.array([locations.setdefault(location, len(locations)) for location in person_locations])
+    calendars = build_calendars(holidays, locations, month_starts.min(), month_ends.max())
+    prefix = np.stack([calendars[location].prefix for location in locations])
+    any_calendar = calendars[next(iter(locations))]
+
+    # Working days each person is active in each month, people x months, as
+    # differences of the cumulative counts. Empty overlaps go negative and clip to 0.
+    effective_start = any_calendar.index(np.maximum(starts[:, None], month_starts[None, :]))
+    effective_end = any_calendar.index(np.minimum(ends[:, None], month_ends[None, :]) + 1)
+    rows = location_index[:, None]
+    active_days = np.clip(prefix[rows, effective_end] - prefix[rows, effective_start], 0, None)
+    month_days = (prefix[:, any_calendar.index(month_ends + 1)] - prefix[:, any_calendar.index(month_starts)])[location_index]
+
+    # One row of rates per distinct (grade, location), gathered per person.
+    keys = {}
+    key_index = np.array([keys.setdefault(key, len(keys)) for key in zip(grades, person_locations)])
+    rate_table = np.array([[rates.get((grade, location, ym), 0.0) for ym in year_months]
+                           for grade, location in keys])
+    rate_matrix = rate_table[key_index]
+
+    # A month made entirely of holidays has nothing to prorate against.
+    fraction = np.divide(active_days, month_days, out=np.zeros(active_days.shape), where=month_days > 0)
+    return rate_matrix, fraction, paid
+
+def calculate_cost_matrix(people, year_months, conn=None, cached=True):
+    """
+    Costs each of the given people (rows or records.Person) in each "YYYY-MM"
+    month, before churn. Without cached, rates and holidays are read from conn
+    (see cost_components).
+
+    Returns a len(people) x len(year_months) array.
+    """
+    rate_matrix, fraction, paid = cost_components(people, year_months, conn, cached)
+    return rate_matrix * fraction * paid[:, None]
+
+def active_people(people, year_months):
+    """
+    A boolean mask of the records.Person in people whose dates overlap any of
+    the "YYYY-MM" months. Read from the records themselves rather than
+    intervals.get_indexes, whose index may predate writes whose data version
+    is not bumped yet.
+    """
+    firsts, lasts = month_bounds(year_months)
+    first, last = firsts.min().item().toordinal(), lasts.max().item().toordinal()
+    return np.array([person.start <= last and person.end >= first and person.start <= person.end
+                     for person in people], dtype=bool)
+
+@metrics.timed("run_forecast_range")
+def run_forecast_range(start_ym, end_ym):
+    """
+    Forecasts every person over every month from start_ym to end_ym inclusive.
+
+    Returns the months, the people (as records.Person) and a people x months cost matrix
+    (after churn), along with per-month totals.
+    """
+    months = month_range(start_ym, end_ym)
+    year_months = [f"{year}-{month:02d}" for year, month in months]
+
     conn = get_db_connection()
-    c = conn.cursor()
-    c.execute("SELECT * FROM people")
-    people = c.fetchall()
+    with metrics.span("run_forecast_range.load_people"):
+        people = load_people(conn)
+    # People not in post in any of the months cost nothing and are skipped.
+    active = active_people(people, year_months)
+    costs = np.zeros((len(people), len(year_months)))
+    with metrics.span("run_forecast_range.cost_matrix"):
+        costs[active] = calculate_cost_matrix([person for person, keep in zip(people, active) if keep],
+                                              year_months, conn)
     conn.close()
-    
-    total_cost = 0.0
-    details = []
-    churn_rate = get_global_churn_rate()
-    
-    for person in people:
-        cost = calculate_person_cost(person, year, month)
-        adjusted_cost = cost * (1 - churn_rate)
-        total_cost += adjusted_cost
-        details.append({
-            "person_id": person["person_id"],
-            "name": person["name"],
-            "cost": adjusted_cost
-        })
-    
+    costs *= 1 - get_global_churn_rate()
+    return {"months": months, "people": people, "costs": costs, "total_cost": costs.sum(axis=0)}
+
+@metrics.timed("run_forecast")
+def run_forecast(year, month):
+    ym = f"{year}-{month:02d}"
+    forecast = run_forecast_range(ym, ym)
+    costs = forecast["costs"][:, 0]
+    with metrics.span("run_forecast.people"):
+        details = [
+            {"person_id": person.person_id, "name": person.name, "cost": float(cost)}
+            for person, cost in zip(forecast["people"], costs)
+        ]
     return {
         "year": year,
         "month": month,
-        "total_cost": total_cost,
+        "total_cost": float(costs.sum()),
         "details": details
     }
 
+@metrics.timed("get_budget")
 def get_budget(year, month):
     """
     Retrieves the overall allocated budget for the specified month by summing all records.
@@ -139,3 +342,45 @@ def get_budget(year, month):
         return row["total_budget"]
     else:
         return 0.0
+
+@metrics.timed("get_budget_range")
+def get_budget_range(start_ym, end_ym):
+    """
+    Retrieves the overall allocated budget for each month from start_ym to end_ym
+    inclusive, in one query. Months without budget records are 0.0.
+    """
+    conn = get_db_connection()
+    c = conn.cursor()
+    c.execute('''
+        SELECT year_month, SUM(allocated_budget) as total_budget
+        FROM budget
+        WHERE year_month BETWEEN ? AND ?
+        GROUP BY year_month
+    ''', (start_ym, end_ym))
+    totals = {row["year_month"]: row["total_budget"] or 0.0 for row in c.fetchall()}
+    conn.close()
+    return [totals.get(f"{year}-{month:02d}", 0.0) for year, month in month_range(start_ym, end_ym)]
+
+# Columns the forecast and budget can be broken down by; both tables have them.
+GROUP_COLUMNS = ("team", "work_stream")
+
+def get_budget_grouped(start_ym, end_ym, group_by=()):
+    """
+    Retrieves the allocated budget from start_ym to end_ym summed by month and
+    by the given GROUP_COLUMNS. Returns a list of dicts with year_month, each
+    group column and budget.
+    """
+    group_by = [column for column in group_by if column in GROUP_COLUMNS]
+    columns = ", ".join(["year_month"] + group_by)
+    conn = get_db_connection()
+    c = conn.cursor()
+    c.execute(f'''
+        SELECT {columns}, SUM(allocated_budget) as budget
+        FROM budget
+        WHERE year_month BETWEEN ? AND ?
+        GROUP BY {columns}
+        ORDER BY {columns}
+    ''', (start_ym, end_ym))
+    rows = [dict(row) for row in c.fetchall()]
+    conn.close()
+    return rows
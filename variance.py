@@ -0,0 +1,84 @@
+"""
+Budget against forecast, grouped by team and/or work_stream.
+
+Both sides are aggregated in one SQL statement: the forecast from the
+per-month, team and work stream totals kept in forecast_cache_groups, and the
+budget from an index-only range scan of idx_budget_month_group. The two are
+combined by a single GROUP BY, so a month, team or work stream that only has
+a forecast or only has a budget still gets a row. When the forecast cache
+cannot be filled (see forecast_cache.ensure_months), the forecast is computed
+directly and combined with the budget here instead.
+"""
+
+from forecast_cache import computed_totals, ensure_months
+from utils import GROUP_COLUMNS, get_db_connection, get_global_churn_rate, month_range
+
+
+def variance_rows(start_ym, end_ym, group_by=(), conn=None):
+    """
+    Returns a list of dicts with year_month, each group column in group_by,
+    forecast (after churn), budget and variance (budget minus forecast, so
+    positive means under budget), ordered by month and then group. Without
+    group_by there is exactly one row per month in the range.
+    """
+    group_by = [column for column in GROUP_COLUMNS if column in group_by]
+    year_months = [f"{year}-{month:02d}" for year, month in month_range(start_ym, end_ym)]
+    columns = ", ".join(["year_month"] + group_by)
+    selected = ", ".join(["year_month"] + [f"NULLIF({column}, '') AS {column}" for column in group_by])
+    own_connection = conn is None
+    if own_connection:
+        conn = get_db_connection()
+    if not ensure_months(conn, year_months):
+        rows = _computed_rows(conn, start_ym, end_ym, group_by)
+        if own_connection:
+            conn.close()
+        return rows if group_by else _by_month(rows, year_months)
+    multiplier = 1 - get_global_churn_rate()
+    rows = conn.execute(f'''
+        SELECT {selected}, SUM(forecast) AS forecast, SUM(budget) AS budget,
+               SUM(budget) - SUM(forecast) AS variance
+        FROM (
+            SELECT year_month, team, work_stream, cost * ? AS forecast, 0.0 AS budget
+            FROM forecast_cache_groups
+            WHERE year_month BETWEEN ? AND ?
+            UNION ALL
+            SELECT year_month, IFNULL(team, ''), IFNULL(work_stream, ''), 0.0, allocated_budget
+            FROM budget
+            WHERE year_month BETWEEN ? AND ?
+        )
+        GROUP BY {columns}
+        ORDER BY {columns}
+    ''', (multiplier, start_ym, end_ym, start_ym, end_ym)).fetchall()
+    if own_connection:
+        conn.close()
+    rows = [dict(row) for row in rows]
+    if group_by:
+        return rows
+    return _by_month(rows, year_months)
+
+
+def _by_month(rows, year_months):
+    by_month = {row["year_month"]: row for row in rows}
+    return [by_month.get(ym, {"year_month": ym, "forecast": 0.0, "budget": 0.0, "variance": 0.0})
+            for ym in year_months]
+
+
+def _computed_rows(conn, start_ym, end_ym, group_by):
+    """variance_rows' rows with the forecast from forecast_cache.computed_totals."""
+    columns = ["year_month"] + group_by
+    selected = ", ".join(["year_month"] + [f"NULLIF(IFNULL({column}, ''), '') AS {column}" for column in group_by])
+    rows = {}
+    for row in computed_totals(start_ym, end_ym, group_by):
+        rows[tuple(row[column] for column in columns)] = dict(row, budget=0.0)
+    for row in conn.execute(f'''
+        SELECT {selected}, SUM(allocated_budget) AS budget
+        FROM budget
+        WHERE year_month BETWEEN ? AND ?
+        GROUP BY {", ".join(f"IFNULL({column}, '')" for column in columns)}
+    ''', (start_ym, end_ym)):
+        key = tuple(row[column] for column in columns)
+        entry = rows.setdefault(key, dict(zip(columns, key), forecast=0.0, budget=0.0))
+        entry["budget"] += row["budget"]
+    for entry in rows.values():
+        entry["variance"] = entry["budget"] - entry["forecast"]
+    return sorted(rows.values(), key=lambda row: tuple(row[column] or "" for column in columns))
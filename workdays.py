@@ -0,0 +1,75 @@
+"""Working-day calendars backed by cumulative business-day counts."""
+
+from datetime import date, timedelta
+
+import numpy as np
+
+# Range covered by the default calendar used when no calendar is supplied.
+DEFAULT_START = date(1990, 1, 1)
+DEFAULT_END = date(2100, 12, 31)
+
+_EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+
+class WorkingDayCalendar:
+    """
+    Counts Monday-Friday working days, less any holidays, over a fixed date range.
+
+    prefix[i] holds the number of working days strictly before start + i days, so
+    the working days in any period inside the range are two lookups and a
+    subtraction. Periods reaching outside the range fall back to
+    numpy.busday_count, which gives the same answer more slowly.
+    """
+
+    def __init__(self, start=DEFAULT_START, end=DEFAULT_END, holidays=()):
+        self.start = np.datetime64(start, "D")
+        self.end = np.datetime64(end, "D")
+        self.holidays = np.array(sorted(set(holidays)), dtype="datetime64[D]")
+        days = np.arange(self.start, self.end + 1)
+        is_working = np.is_busday(days, holidays=self.holidays)
+        self.prefix = np.concatenate(([0], np.cumsum(is_working)))
+        self._offset = int(self.start.astype(int))
+        self._size = len(days)
+
+    def working_days(self, period_start, period_end):
+        """Working days from period_start to period_end inclusive, as an int."""
+        i = period_start.toordinal() - _EPOCH_ORDINAL - self._offset
+        j = period_end.toordinal() - _EPOCH_ORDINAL - self._offset
+        if j < i:
+            return 0
+        if 0 <= i and j < self._size:
+            return int(self.prefix[j + 1] - self.prefix[i])
+        return int(np.busday_count(period_start, period_end + timedelta(days=1), holidays=self.holidays))
+
+    def index(self, dates):
+        """Positions of datetime64[D] dates in the prefix array, clipped to the range."""
+        return np.clip((dates - self.start).astype(int), 0, self._size)
+
+
+def load_holidays(conn):
+    """
+    Returns public holidays as a dict of location -> list of dates. Holidays
+    recorded without a location are keyed under None and apply everywhere.
+    """
+    c = conn.cursor()
+    c.execute("SELECT location, holiday_date FROM public_holidays")
+    holidays = {}
+    for row in c.fetchall():
+        location = row["location"] or None
+        holidays.setdefault(location, []).append(date.fromisoformat(row["holiday_date"]))
+    return holidays
+
+
+def build_calendars(holidays, locations, start, end):
+    """
+    Builds one calendar per location over start..end, each combining the
+    location's own holidays with the organisation-wide ones.
+    """
+    shared = holidays.get(None, [])
+    return {
+        location: WorkingDayCalendar(start, end, shared + holidays.get(location, []))
+        for location in locations
+    }
+
+
+DEFAULT_CALENDAR = WorkingDayCalendar()
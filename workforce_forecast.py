@@ -0,0 +1,146 @@
+"""
+workforce-forecast: headless forecasts, imports and exports.
+
+Built on utils, forecast_cache, ingest and exports alone, so it never imports
+Flask or matplotlib and starts in a fraction of the time the app takes.
+
+    python workforce_forecast.py forecast --start 2025-01 --end 2025-12
+    python workforce_forecast.py forecast --month 2025-06 --details
+    python workforce_forecast.py import people people.csv
+    python workforce_forecast.py import salaries rates.csv --replace-months
+    python workforce_forecast.py export forecast --format ndjson --start 2025-01 --end 2025-12 -o forecast.ndjson
+
+Set WORKFORCE_DB, or pass --db, to use a database other than
+workforce_model.db. Imports move the data version on, as writes through the
+app do, so a running app sees them on its next read.
+"""
+
+import argparse
+import json
+import sys
+from datetime import datetime
+
+import database
+import forecast_cache
+from exports import FORMATS, export_forecast, export_people
+from ingest import IMPORTS, ingest_csv
+from utils import get_budget_range, get_db_connection, invalidate_rate_cache, run_forecast_range
+
+
+def forecast(args):
+    result = run_forecast_range(args.start, args.end)
+    year_months = [f"{year}-{month:02d}" for year, month in result["months"]]
+    budgets = get_budget_range(args.start, args.end)
+    if args.json:
+        payload = {"months": year_months, "forecast": result["total_cost"].tolist(), "budget": budgets}
+        if args.details:
+            payload["people"] = [{"person_id": person.person_id, "name": person.name, "costs": row.tolist()}
+                                 for person, row in zip(result["people"], result["costs"])]
+        print(json.dumps(payload))
+        return 0
+    print(f"{'month':<8} {'forecast':>16} {'budget':>16}")
+    for ym, total, budget in zip(year_months, result["total_cost"], budgets):
+        print(f"{ym:<8} {total:>16.2f} {budget:>16.2f}")
+    if args.details:
+        print()
+        for person, row in zip(result["people"], result["costs"]):
+            print(f"{person.person_id:>8} {person.name or '':<30} {row.sum():>16.2f}")
+    return 0
+
+
+def import_csv(args):
+    with open(args.file, "rb") as stream:
+        conn = get_db_connection()
+        summary = ingest_csv(stream, args.table, conn, replace_months=args.replace_months)
+        # The same follow-up as the upload routes.
+        if args.table == "people":
+            forecast_cache.add_missing_people(conn)
+        elif args.table == "salaries":
+            invalidate_rate_cache()
+            forecast_cache.invalidate_months(conn, summary["months"])
+        if summary["accepted"]:
+            database.bump_data_version(conn)
+        conn.close()
+    print(f"{args.table}: {summary['accepted']} rows imported, {summary['rejected']} rejected")
+    for line, reason in summary["errors"]:
+        print(f"  line {line}: {reason}", file=sys.stderr)
+    return 1 if summary["rejected"] else 0
+
+
+def export(args):
+    if args.what == "people":
+        chunks = export_people(args.format)
+    else:
+        chunks = export_forecast(args.format, args.start, args.end)
+    output = open(args.output, "w", newline="") if args.output else sys.stdout
+    try:
+        for chunk in chunks:
+            output.write(chunk)
+    except BrokenPipeError:
+        # The reader stopped early, e.g. piped into head; not an error.
+        sys.stdout = None
+    finally:
+        chunks.close()
+        if args.output:
+            output.close()
+    return 0
+
+
+def month(value):
+    try:
+        if len(value) != 7:
+            raise ValueError
+        datetime.strptime(value, "%Y-%m")
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"{value!r} is not YYYY-MM")
+    return value
+
+
+def build_parser():
+    year = datetime.now().year
+    parser = argparse.ArgumentParser(prog="workforce-forecast", description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db", help="database file (default: WORKFORCE_DB or workforce_model.db)")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    command = commands.add_parser("forecast", help="monthly forecast (after churn) against budget")
+    command.add_argument("--start", type=month, default=f"{year}-01")
+    command.add_argument("--end", type=month, default=f"{year}-12")
+    command.add_argument("--month", type=month, help="a single month; overrides --start and --end")
+    command.add_argument("--details", action="store_true", help="also list each person's cost")
+    command.add_argument("--json", action="store_true")
+    command.set_defaults(run=forecast)
+
+    command = commands.add_parser("import", help="import a CSV file as the upload pages do")
+    command.add_argument("table", choices=sorted(IMPORTS))
+    command.add_argument("file")
+    command.add_argument("--replace-months", action="store_true",
+                         help="replace every existing row for the months in the file (salaries only)")
+    command.set_defaults(run=import_csv)
+
+    command = commands.add_parser("export", help="stream the people table or the per-person forecast")
+    command.add_argument("what", choices=["people", "forecast"])
+    command.add_argument("--format", choices=sorted(FORMATS), default="csv")
+    command.add_argument("--start", type=month, default=f"{year}-01")
+    command.add_argument("--end", type=month, default=f"{year}-12")
+    command.add_argument("-o", "--output", help="file to write (default: standard output)")
+    command.set_defaults(run=export)
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if getattr(args, "month", None):
+        args.start = args.end = args.month
+    if getattr(args, "start", None) and args.start > args.end:
+        parser.error("--start must not be after --end")
+    if getattr(args, "replace_months", False) and IMPORTS[args.table][2] is None:
+        parser.error(f"{args.table} imports cannot replace whole months")
+    if args.db:
+        database.reset_pool(args.db)
+    return args.run(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())